@@ -0,0 +1,15 @@
+"""
+Helpers shared by the benchmark scripts.
+"""
+from calorimeter import Calorimeter, Layer
+
+
+def make_calorimeter(pairs=40, lead_cuts=None):
+    '''Return a sampling calorimeter of pairs of lead and scintillator layers, the lead
+    with the production cuts lead_cuts if given.'''
+    cal = Calorimeter()
+    lead = Layer('lead', 2.0, 0.5, 0.0, cuts=lead_cuts)
+    scintillator = Layer('Scin', 0.01, 0.5, 1.0)
+    for i in range(pairs):
+        cal.add_layers([lead, scintillator])
+    return cal
@@ -0,0 +1,59 @@
+"""
+Measure the time per event and the bias of the mean ionisation of electron showers
+stopped early by an energy budget, for a range of budget fractions. The bias of every
+active layer is given in units of its statistical error, as the largest pull and the
+chi2 per layer, and that of the total ionisation in percent. With depth first traversal
+the energy leaves the stack as the sub-showers are finished, so the time saved is about
+the fraction, while with breadth first traversal it stays on the stack until the last
+generations of the shower and less is saved.
+
+Usage: python benchmarks/energy_budget.py [energy] [pairs] [events] [breadth|depth]
+"""
+import sys
+import time
+
+import numpy as np
+
+from calorimeter import Simulation, Electron
+
+from common import make_calorimeter
+
+FRACTIONS = (None, 0.05, 0.1, 0.2, 0.3, 0.5)
+
+
+def measure(cal, budget, energy, events, traversal, repeats=3):
+    '''Return the best time per event in ms of a few repeats and the sample of
+    ionisations.'''
+    sim = Simulation(cal, transport='event', processes=0, traversal=traversal, budget=budget)
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        sample = sim.simulate_sample([Electron(0.0, energy)]*events, seed=1)
+        best = min(best, time.perf_counter() - start)
+    return 1e3*best/events, sample
+
+
+if __name__ == '__main__':
+    energy = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    pairs = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    events = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+    traversal = sys.argv[4] if len(sys.argv) > 4 else 'depth'
+
+    cal = make_calorimeter(pairs)
+    print(f'{energy:g} GeV electrons, {pairs} lead/scintillator pairs, {events} events, {traversal} first')
+    print(f'{"budget":>8s} {"ms/event":>10s} {"max pull":>9s} {"chi2/layer":>11s} {"total bias %":>13s}')
+    reference = None
+    for fraction in FRACTIONS:
+        ms, sample = measure(cal, fraction, energy, events, traversal)
+        if reference is None:
+            reference = sample
+            print(f'{"none":>8s} {ms:10.2f}')
+            continue
+        # The events draw the same random numbers until they are stopped, so the error is
+        # that of the differences of the events
+        difference = sample - reference
+        error = difference.std(axis=0)/np.sqrt(events)
+        used = error > 0
+        pulls = difference.mean(axis=0)[used]/error[used]
+        total = 100*(sample.sum(axis=1).mean()/reference.sum(axis=1).mean() - 1)
+        print(f'{fraction:8g} {ms:10.2f} {np.abs(pulls).max():9.2f} {np.mean(pulls**2):11.2f} {total:13.2f}')
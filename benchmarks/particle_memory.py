@@ -0,0 +1,82 @@
+"""
+Measure the memory of a particle and the allocations and time of a shower when
+stepped with Calorimeter.step, which returns a list on every step, and with
+Calorimeter.propagate, which returns None when nothing happens.
+
+Usage: python benchmarks/particle_memory.py [energy]
+"""
+import copy
+import sys
+import time
+import tracemalloc
+from collections import deque
+
+from calorimeter import Electron
+
+from common import make_calorimeter
+
+
+class DictElectron:
+    '''An electron with the same attributes held in a per instance dictionary.'''
+
+    def __init__(self, z, energy):
+        self.type, self.z, self.energy, self.ionise, self.cutoff = 'elec', z, energy, True, 0.01
+        self.x = self.y = self.angle_x = self.angle_y = 0
+        self.trace = self.parent = None
+
+
+def instance_size(factory, n=100000):
+    '''Return the memory in bytes per instance made by factory.'''
+    tracemalloc.start()
+    objects = [factory() for _ in range(n)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return (size - 8*n)/n
+
+
+def run_step(cal, energy, step):
+    particles = deque([Electron(0.0, energy)])
+    while particles:
+        p = particles.popleft()
+        new = cal.step(p, step) if step else cal.advance(p)
+        particles.extend(n for n in new if n.z < cal._zend)
+
+
+def run_propagate(cal, energy, step):
+    particles = deque([Electron(0.0, energy)])
+    while particles:
+        p = particles.popleft()
+        new = cal.propagate(p, step)
+        if new is None:
+            if p.z < cal._zend:
+                particles.append(p)
+            continue
+        particles.extend(n for n in new if n.z < cal._zend)
+
+
+def measure(run, cal, energy, step):
+    '''Return the peak memory in MB and the time in s of a shower.'''
+    cal = copy.deepcopy(cal)
+    start = time.perf_counter()
+    run(cal, energy, step)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    run(cal, energy, step)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak/1e6, elapsed
+
+
+if __name__ == '__main__':
+    energy = float(sys.argv[1]) if len(sys.argv) > 1 else 50.0
+    print(f'Electron with __slots__: {instance_size(lambda: Electron(0.0, 1.0)):6.0f} bytes')
+    print(f'Electron with __dict__ : {instance_size(lambda: DictElectron(0.0, 1.0)):6.0f} bytes')
+
+    cal = make_calorimeter()
+    for step in (0.1, None):
+        print(f'{energy:g} GeV electron shower, {"step 0.1" if step else "event transport"}')
+        for name, run in (('step/advance', run_step), ('propagate', run_propagate)):
+            peak, elapsed = measure(run, cal, energy, step)
+            print(f'  {name:12s}: peak memory {peak:6.2f} MB, time {elapsed:6.3f} s')
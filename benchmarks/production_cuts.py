@@ -0,0 +1,61 @@
+"""
+Measure the time per event and the energy resolution of electron showers for a range
+of production cuts, the energy below which electrons and photons are absorbed rather
+than split, to show how much accuracy a coarser cut trades for speed. The cuts of the
+scintillator are kept at the default in the 'passive' rows, so only the lead is coarser.
+
+Usage: python benchmarks/production_cuts.py [energy] [events] [plot.png]
+"""
+import sys
+import time
+
+import numpy as np
+
+from calorimeter import Simulation, Electron
+from calorimeter.particle import DEFAULT_CUTS
+
+from common import make_calorimeter
+
+CUTS = (0.0025, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2)
+
+
+def measure(cal, cuts, energy, events):
+    '''Return the time per event in ms and the resolution sigma/mean of the total
+    ionisation of a sample of electrons.'''
+    sim = Simulation(cal, transport='event', processes=0, cuts=cuts)
+    start = time.perf_counter()
+    totals = sim.simulate_sample([Electron(0.0, energy)]*events, seed=1).sum(axis=1)
+    elapsed = time.perf_counter() - start
+    return 1e3*elapsed/events, totals.std()/totals.mean()
+
+
+if __name__ == '__main__':
+    energy = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+    events = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    print(f'{energy:g} GeV electrons, {events} events, default cut {DEFAULT_CUTS["elec"]:g}')
+    print(f'{"":8s} {"cut":>8s} {"ms/event":>10s} {"sigma/mean":>11s}')
+    curves = {}
+    for name in ('all', 'passive'):
+        curves[name] = []
+        for cut in CUTS:
+            if name == 'all':
+                result = measure(make_calorimeter(), {'elec': cut, 'phot': cut}, energy, events)
+            else:
+                result = measure(make_calorimeter(lead_cuts={'elec': cut, 'phot': cut}), None, energy, events)
+            curves[name].append(result)
+            print(f'{name:8s} {cut:8g} {result[0]:10.2f} {result[1]:11.4f}')
+
+    if len(sys.argv) > 3:
+        import matplotlib.pyplot as plt
+        fig, ax = plt.subplots()
+        for name, points in curves.items():
+            ms, resolution = np.array(points).T
+            ax.plot(ms, resolution, 'o-', label=f'cuts in {name} layers')
+            for cut, x, y in zip(CUTS, ms, resolution):
+                ax.annotate(f'{cut:g}', (x, y))
+        ax.set_xscale('log')
+        ax.set_xlabel('time per event [ms]')
+        ax.set_ylabel('sigma/mean of the total ionisation')
+        ax.legend()
+        fig.savefig(sys.argv[3])
@@ -0,0 +1,58 @@
+"""
+Compare the cost of the random numbers used by the python engine when drawn from
+the stdlib random module, from a numpy Generator one call at a time and from the
+block buffered RandomStream.
+
+Usage: python benchmarks/rng_buffer.py [energy]
+"""
+import sys
+import random
+import timeit
+
+import numpy as np
+
+from calorimeter import Electron
+from calorimeter.rng import RandomStream
+from calorimeter.simulation import _run_single_simulation_indexed
+
+from common import make_calorimeter
+
+
+class UnbufferedStream:
+    '''A numpy Generator called once per number.'''
+
+    def __init__(self, generator):
+        self.generator = generator
+
+    def random(self):
+        return self.generator.random()
+
+    def gauss(self, mu, sigma):
+        return self.generator.normal(mu, sigma)
+
+    def expovariate(self, lambd):
+        return self.generator.exponential(1.0/lambd)
+
+
+def sources():
+    return {'stdlib random': random,
+            'numpy, per call': UnbufferedStream(np.random.default_rng(1)),
+            'numpy, buffered': RandomStream(np.random.default_rng(1))}
+
+
+if __name__ == '__main__':
+    energy = float(sys.argv[1]) if len(sys.argv) > 1 else 20.0
+    n = 1000000
+    print(f'{n} calls of random() and gauss()')
+    for name, rng in sources().items():
+        uniform = timeit.timeit(rng.random, number=n)
+        normal = timeit.timeit(lambda: rng.gauss(0.0, 0.02), number=n)
+        print(f'  {name:16s}: random {1e9*uniform/n:6.1f} ns, gauss {1e9*normal/n:6.1f} ns')
+
+    cal = make_calorimeter()
+    for step in (0.1, None):
+        print(f'{energy:g} GeV electron shower, {"step 0.1" if step else "event transport"}')
+        for name, rng in sources().items():
+            elapsed = timeit.timeit(lambda: _run_single_simulation_indexed((cal, Electron(0.0, energy), step, 0), rng),
+                                    number=3)/3
+            print(f'  {name:16s}: {elapsed:6.3f} s')
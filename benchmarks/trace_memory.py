@@ -0,0 +1,46 @@
+"""
+Measure the memory and time used by a single shower with and without tracing.
+
+Usage: python benchmarks/trace_memory.py [energy]
+"""
+import copy
+import sys
+import time
+import tracemalloc
+from collections import deque
+
+from calorimeter import Electron
+
+from common import make_calorimeter
+
+
+def shower(cal, energy, trace):
+    '''Run one shower and return the peak traced memory in MB and the time in s.'''
+    cal = copy.deepcopy(cal)
+    if trace:
+        cal.enable_tracing()
+    cal.reset()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    particles = deque([Electron(0.0, energy)])
+    while particles:
+        p = particles.popleft()
+        for new in cal.step(p, 0.1):
+            if new.z < cal._zend:
+                particles.append(new)
+            else:
+                cal.record_trace(new)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak/1e6, elapsed
+
+
+if __name__ == '__main__':
+    energy = float(sys.argv[1]) if len(sys.argv) > 1 else 100.0
+    cal = make_calorimeter()
+    for trace in (False, True):
+        peak, elapsed = shower(cal, energy, trace)
+        print(f'{energy:g} GeV electron, tracing {"on " if trace else "off"}: '
+              f'peak memory {peak:8.2f} MB, time {elapsed:6.2f} s')
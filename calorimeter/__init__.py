@@ -13,19 +13,38 @@ __email__ = "ulrik.egede@monash.edu"
 
 # Import main classes now located at package level
 from .calorimeter import Calorimeter
+from .geometry import Geometry
 from .simulation import Simulation
 from .layer import Layer
 from .particle import Electron, Photon, Muon
 from .spectrum import Spectrum
+from .tracestore import TraceStore
+from .fastsim import ShowerLibrary, SubShowerLibrary
+from .roulette import RussianRoulette
+from .digitise import Digitiser
+from .sparse import SparseSample
+from .dataset import ResultDataset
+from .cache import ResultCache
+from .accumulate import LayerStatistics
 
 # Public API
 __all__ = [
     # Model classes
     "Calorimeter",
+    "Geometry",
     "Simulation",
     "Layer",
     "Electron",
     "Photon",
     "Muon",
     "Spectrum",
+    "TraceStore",
+    "ShowerLibrary",
+    "SubShowerLibrary",
+    "RussianRoulette",
+    "Digitiser",
+    "SparseSample",
+    "ResultDataset",
+    "ResultCache",
+    "LayerStatistics",
 ]
@@ -0,0 +1,121 @@
+import numpy as np
+
+
+class LayerStatistics:
+    '''Running statistics of the ionisations of a sample of events, which take memory
+    in proportion to the square of the number of layers, width, whatever the number
+    of events: the mean of every layer, the co-moment matrix from which the
+    variances and covariances of the layers follow, and, if edges are given, a
+    histogram of the total ionisation of the events with those bin edges, with the
+    events outside them counted as underflow and overflow.
+
+    Blocks of events are added with add, and statistics of different parts of a
+    sample, from workers or from runs on other machines given the same seed and their
+    first_event, are combined with merge. Both use the pairwise update of the mean
+    and co-moments of Chan et al., the block form of Welford's algorithm, so the
+    result is that of the whole sample up to rounding, in any order.'''
+
+    _fields = ('count', 'mean', 'comoment', 'edges', 'counts', 'underflow', 'overflow')
+
+    def __init__(self, width, edges=None):
+        self.width = int(width)
+        self.count = 0
+        self.mean = np.zeros(self.width)
+        self.comoment = np.zeros((self.width, self.width))
+        self.edges = None if edges is None else np.asarray(edges, dtype=float)
+        self.counts = None if edges is None else np.zeros(len(self.edges) - 1, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, ionisations):
+        '''Add the events of an (events x layers) array of ionisations.'''
+        ionisations = np.asarray(ionisations, dtype=float)
+        if ionisations.shape[1:] != (self.width,):
+            raise ValueError(f"The ionisations have {ionisations.shape[1:]} columns, not {self.width}")
+        if not len(ionisations):
+            return
+        block = LayerStatistics(self.width, self.edges)
+        block.count = len(ionisations)
+        block.mean = ionisations.mean(axis=0)
+        deviations = ionisations - block.mean
+        block.comoment = deviations.T @ deviations
+        if self.edges is not None:
+            totals = ionisations.sum(axis=1)
+            block.counts = np.histogram(totals, self.edges)[0]
+            block.underflow = int(np.count_nonzero(totals < self.edges[0]))
+            block.overflow = int(np.count_nonzero(totals > self.edges[-1]))
+        self.merge(block)
+
+    def merge(self, other):
+        '''Add the statistics of another part of the sample.'''
+        if other.width != self.width:
+            raise ValueError(f"Cannot merge statistics of {other.width} layers into {self.width}")
+        if (self.edges is None) != (other.edges is None) or \
+                (self.edges is not None and not np.array_equal(self.edges, other.edges)):
+            raise ValueError("Cannot merge statistics with different histogram bins")
+        count = self.count + other.count
+        if other.count:
+            delta = other.mean - self.mean
+            self.mean = self.mean + delta*other.count/count
+            self.comoment = self.comoment + other.comoment + np.outer(delta, delta)*self.count*other.count/count
+        self.count = count
+        if self.edges is not None:
+            self.counts = self.counts + other.counts
+            self.underflow += other.underflow
+            self.overflow += other.overflow
+        return self
+
+    @classmethod
+    def combine(cls, statistics):
+        '''Return the statistics of all parts given, of which there has to be one.'''
+        statistics = list(statistics)
+        combined = cls(statistics[0].width, statistics[0].edges)
+        for part in statistics:
+            combined.merge(part)
+        return combined
+
+    @property
+    def covariance(self):
+        '''The sample covariance matrix of the layers.'''
+        return self.comoment/max(self.count - 1, 1)
+
+    @property
+    def variance(self):
+        '''The sample variance of every layer.'''
+        return np.diag(self.covariance).copy()
+
+    @property
+    def total_mean(self):
+        '''The mean total ionisation of the events.'''
+        return float(self.mean.sum())
+
+    @property
+    def total_variance(self):
+        '''The variance of the total ionisation of the events, the sum of the covariances.'''
+        return float(self.covariance.sum())
+
+    @property
+    def resolution(self):
+        '''The energy resolution, the spread of the total ionisation over its mean.'''
+        return np.sqrt(self.total_variance)/self.total_mean
+
+    def save(self, path):
+        '''Save the statistics to a .npz file.'''
+        np.savez(path, width=self.width, **{name: getattr(self, name) for name in self._fields
+                                            if getattr(self, name) is not None})
+
+    @classmethod
+    def load(cls, path):
+        '''Load statistics saved with save.'''
+        with np.load(path, allow_pickle=False) as data:
+            statistics = cls(int(data['width']), data['edges'] if 'edges' in data else None)
+            for name in cls._fields:
+                if name in data:
+                    setattr(statistics, name, data[name][()] if data[name].ndim == 0 else data[name])
+        statistics.count = int(statistics.count)
+        statistics.underflow = int(statistics.underflow)
+        statistics.overflow = int(statistics.overflow)
+        return statistics
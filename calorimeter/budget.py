@@ -0,0 +1,198 @@
+import math
+import numpy as np
+
+
+class EnergyBudget:
+    '''Early termination of showers. A shower is stopped once the energy of the
+    particles waiting on the stack, counted with their weights, has dropped to
+    fraction of the energy of the incoming particle, and the expected ionisation of
+    the sub-showers of the waiting particles, see residual, is added to the layers
+    instead. The mean ionisation of every layer is kept, and the error of an event is
+    bounded by the fluctuation of the showers of at most fraction of its energy. As
+    the work left in a shower is about in proportion to the energy left, the time
+    saved is about the fraction.
+
+    The ionisation of the model is the yield times the length of the tracks of
+    charged particles. Every electron or photon above the production cut splits in
+    two at its interaction, with the energy shared uniformly, and all of them have the
+    interaction rate of the material they are in, so the daughters of generation g of
+    a particle start after g interactions, at an optical depth that has a Gamma
+    distribution, and the expected number of tracks of every generation only depends
+    on the energy, see generations. This gives the expected ionisation of the shower
+    of a particle layer by layer, exactly for event driven transport.'''
+
+    def __init__(self, geometry, fraction, max_energy=100.0):
+        if not 0 < fraction < 1:
+            raise ValueError(f"The budget fraction has to be between 0 and 1, not {fraction}")
+        self.cutoff = geometry.uniform_cut()
+        if self.cutoff is None:
+            raise ValueError("The energy budget needs the same production cut for electrons and photons in all layers")
+        self.fraction = fraction
+        self.geometry = geometry
+        # Layers in front of the last active layer, as only they can be given ionisation
+        self._layers = int(np.count_nonzero(geometry.z < geometry.reach))
+        self._table(max_energy/self.cutoff)
+
+    def _table(self, top):
+        '''Tabulate the expected number of tracks of each generation of the showers of
+        electrons and photons on a grid in log(x), with x the energy in units of the
+        cut, from x=1 up to top. Above the cut, the daughters of a particle of energy x
+        have energies uniform in [0, x], so the tracks of generation g + 1 are the
+        averages over [0, x] of those of generation g of the daughters: an electron
+        gives an electron and a photon, a photon two electrons.'''
+        self._log_x = np.linspace(0.0, math.log(max(top, math.e)), 128*int(math.ceil(math.log(max(top, math.e)))) + 1)
+        x = np.exp(self._log_x)
+        electron = [np.ones_like(x)]
+        photon = [np.zeros_like(x)]
+        # Integrals over [0, 1], below the cut an electron is one track of generation 0
+        below = (1.0, 0.0)
+        while len(electron) < 200:
+            def integral(values, start):
+                # Cumulative integral over [0, x] by the trapezoidal rule in log(x)
+                steps = 0.5*(values[1:]*x[1:] + values[:-1]*x[:-1])*np.diff(self._log_x)
+                return start + np.concatenate(([0.0], np.cumsum(steps)))
+            e = integral(electron[-1], below[0])
+            p = integral(photon[-1], below[1])
+            electron.append((e + p)/x)
+            photon.append(2*e/x)
+            below = (0.0, 0.0)
+            if electron[-1][-1] + photon[-1][-1] < 1e-12*(electron[-1].max() + 1):
+                break
+        self._electrons = np.array(electron)
+        self._photons = np.array(photon)
+        geometry = self.geometry
+        layers = {}
+        self._transfers = [layers.setdefault(key, self._transfer(*key)) for key in
+                           zip(geometry.material.tolist(), geometry.thickness.tolist(), geometry.yields.tolist())]
+
+    def _transfer(self, material, thickness, response):
+        '''Return the (deposit, transfer) of a layer for tracks entering it as a vector
+        over the number k of interactions still to come before they start: the
+        ionisation deposit.dot(v) added to the layer and the vector transfer.dot(v)
+        leaving it. With d the optical depth of the layer, a track that starts after k
+        more interactions is in the layer at depth s with the Poisson probability of k
+        interactions in s.'''
+        n = len(self._electrons)
+        depth = material*thickness
+        poisson = _poisson(np.array([depth]), n)[0]
+        if material > 0:
+            deposit = response/material*(1.0 - np.cumsum(poisson))
+        else:
+            deposit = np.zeros(n)
+            deposit[0] = response*thickness
+        transfer = np.zeros((n, n))
+        for m in range(n):
+            transfer[np.arange(n - m), np.arange(m, n)] = poisson[m]
+        return deposit, transfer
+
+    def tracks(self, particle):
+        '''Return the expected number of ionising tracks in the shower of particle. With
+        x the energy in units of the production cut, an electron below the cutoff is one track
+        and a photon none, and above it the splitting gives 8x/3 - 1/2 - 1/(6x^2) tracks
+        for an electron and 8x/3 - 1 + 1/(3x^2) for a photon, all counted with the
+        weight of the particle. Particles that never interact are not counted, as
+        residual adds them exactly.'''
+        if not particle.interacts:
+            return 0.0
+        x = particle.energy/self.cutoff
+        if particle.ionise:
+            return particle.weight*(1.0 if x <= 1 else 8/3*x - 0.5 - 1/(6*x*x))
+        return particle.weight*(0.0 if x <= 1 else 8/3*x - 1 + 1/(3*x*x))
+
+    def generations(self, particles):
+        '''Return the expected number of tracks of each generation in the showers of
+        the particles, counted with their weights, as a (particles x generations) array.
+        Generation 0 is the particle itself.'''
+        energies = np.array([p.energy for p in particles], dtype=float)/self.cutoff
+        if len(energies) and energies.max() > math.exp(self._log_x[-1]):
+            self._table(2*energies.max())
+        position = np.interp(np.log(np.maximum(energies, 1.0)), self._log_x, np.arange(len(self._log_x)))
+        lower = np.minimum(position.astype(int), len(self._log_x) - 2)
+        fraction = position - lower
+        # Only the generations that are expected at all for the highest energy
+        top = lower.max(initial=0) + 1
+        n = int(np.nonzero(self._electrons[:, top] + self._photons[:, top] > 1e-12)[0].max()) + 1
+        electron = np.array([p.ionise for p in particles], dtype=bool)
+        table = np.where(electron, self._electrons[:n, lower], self._photons[:n, lower])*(1 - fraction) + \
+            np.where(electron, self._electrons[:n, lower + 1], self._photons[:n, lower + 1])*fraction
+        # Below the cut an electron is a single track and a photon none
+        below = energies <= 1.0
+        table[:, below] = 0.0
+        table[0, below & electron] = 1.0
+        return (table*np.array([p.weight for p in particles])).T
+
+    def limit(self, particle):
+        '''The energy left on the stack, counted with the weights, at which the shower
+        of the incoming particle is stopped.'''
+        return self.fraction*particle.weight*particle.energy
+
+    def profile(self, particles):
+        '''Return the expected ionisation of the showers of the particles, which all
+        have to interact, in every layer of the geometry. The tracks still to come are
+        followed through the layers as a vector over the number of interactions before
+        they start, to which the particles in a layer are added at its back and those
+        between layers at the front of the next one.'''
+        geometry = self.geometry
+        deposits = np.zeros(len(geometry))
+        if not particles:
+            return deposits
+        weights = self.generations(particles)
+        n = weights.shape[1]
+
+        z = np.array([p.z for p in particles], dtype=float)
+        index = geometry.locate_all(z)
+        inside = index >= 0
+        front = np.zeros((self._layers + 1, n))
+        back = np.zeros((self._layers + 1, n))
+        # Particles between layers start at the front of the next one
+        np.add.at(front, np.searchsorted(geometry.z, z[~inside]), weights[~inside])
+
+        layer = index[inside]
+        weights = weights[inside]
+        length = geometry.z[layer] + geometry.thickness[layer] - z[inside]
+        material = geometry.material[layer]
+        depth = material*length
+        poisson = _poisson(depth, n)
+        # The ionisation in their own layer and the tracks leaving it at the back
+        absorbing = material[:, None] > 0
+        within = np.where(absorbing, (1.0 - np.cumsum(poisson, axis=1))/np.where(absorbing, material[:, None], 1.0),
+                          np.where(np.arange(n) == 0, length[:, None], 0.0))
+        np.add.at(deposits, layer, geometry.yields[layer]*(weights*within).sum(axis=1))
+        # The tracks of generation k + m leave with k interactions to come after m in the layer
+        later = np.lib.stride_tricks.sliding_window_view(np.pad(weights, ((0, 0), (0, n - 1))), n, axis=1)
+        np.add.at(back, layer, np.einsum('pm,pkm->pk', poisson, later))
+
+        tracks = np.zeros(n)
+        for i in range(max(int(np.searchsorted(geometry.z, z.min(), side='right')) - 1, 0), self._layers):
+            tracks += front[i]
+            deposit, transfer = self._transfers[i]
+            deposits[i] += deposit[:n].dot(tracks)
+            tracks = transfer[:n, :n].dot(tracks) + back[i]
+        return deposits
+
+    def residual(self, calorimeter, particles):
+        '''Add the expected ionisation of the showers of the particles to the layers of
+        the calorimeter and return the total added. Particles that never interact are
+        crossed in closed form.'''
+        total = 0.0
+        showers = []
+        for p in particles:
+            if p.interacts:
+                showers.append(p)
+            elif p.ionise:
+                for i, path in self.geometry.paths(p.z, self.geometry.reach):
+                    amount = p.weight*self.geometry.yields[i]*path
+                    calorimeter.deposit(i, [amount])
+                    total += amount
+        deposits = self.profile(showers)
+        calorimeter.deposit(0, deposits.tolist())
+        return total + float(deposits.sum())
+
+
+def _poisson(means, n):
+    '''Return the Poisson probabilities of 0 to n - 1 counts for each of the means.'''
+    probabilities = np.empty((len(means), n))
+    probabilities[:, 0] = np.exp(-means)
+    for k in range(1, n):
+        probabilities[:, k] = probabilities[:, k - 1]*means/k
+    return probabilities
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+from .dataset import run_settings
+
+
+def particles_digest(particles):
+    '''Return a hash of the incident particles, given as Particle objects or as plain
+    energies, by their types, positions, directions, energies and weights.'''
+    digest = hashlib.sha256()
+    if len(particles) and hasattr(particles[0], 'type'):
+        digest.update(' '.join(p.type for p in particles).encode())
+        columns = [[p.z, p.x, p.y, p.angle_x, p.angle_y, p.energy, p.weight] for p in particles]
+        digest.update(np.ascontiguousarray(columns, dtype=np.float64).tobytes())
+    else:
+        digest.update(b'energies')
+        digest.update(np.ascontiguousarray(particles, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    '''An on-disk cache of the samples of simulate_sample, stored as .npy files in
+    directory under a key given by the layers of the calorimeter, the incident
+    particles, the settings of the simulation and the seed, see key. Only runs with a
+    given seed are cached, as only they can be repeated.
+
+    The files are used least recently used first: a hit updates the modification
+    time of its file, and after every store the oldest files are removed until the
+    cache holds at most max_bytes. Several processes can share a cache: a file is
+    written under a temporary name and renamed into place, so it is only seen
+    complete, a file is read in one go, and files removed by another process while
+    evicting or reading count as misses.'''
+
+    def __init__(self, directory, max_bytes=2**30):
+        self.directory = os.fspath(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, simulation, particles, seed, deadcellfraction=0.0, first_event=0):
+        '''Return the key of a sample, a hash of the name, material, thickness and
+        response of every layer, the geometry fingerprint, which also covers the
+        positions and production cuts, the particles, the settings of the simulation,
+        the seed and the index of the first event.'''
+        geometry = simulation._calorimeter.geometry()
+        layers = [[layer.get_name(), layer.get_material(), layer.get_thickness(), layer.get_yield()]
+                  for layer in geometry.layers]
+        text = json.dumps({'layers': layers, 'fingerprint': geometry.fingerprint(),
+                           'particles': particles_digest(particles),
+                           'settings': run_settings(simulation, deadcellfraction), 'seed': seed,
+                           'first_event': first_event}, sort_keys=True, default=repr)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.npy')
+
+    def get(self, key):
+        '''Return the sample stored under key, or None if it is not in the cache.'''
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                sample = np.load(f, allow_pickle=False)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return sample
+
+    def put(self, key, sample):
+        '''Store the sample under key and evict the least recently used samples.'''
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                np.save(f, np.asarray(sample))
+            os.replace(temporary, self._path(key))
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        self.evict()
+
+    def entries(self):
+        '''Return the (modification time, size, path) of the stored samples, oldest first.'''
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy'):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    @property
+    def nbytes(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        '''Remove the least recently used samples until at most max_bytes are held.'''
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        '''Remove all stored samples.'''
+        for _, _, path in self.entries():
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
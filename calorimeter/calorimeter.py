@@ -1,13 +1,19 @@
 import copy
+import random
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 from matplotlib.lines import Line2D
+from matplotlib.collections import LineCollection
+from .geometry import Geometry
+from .particle import check_cuts
 
 class Calorimeter:
     '''This defines the calorimeter. The model is a strict one dimensinal model,
     where layers are positioned along the positive z direction and are imagined to
-    stretch infinitely into the x and y directions.'''
+    stretch infinitely into the x and y directions. The production cuts, the energy
+    below which a particle is absorbed rather than split, can be given as cuts, a
+    dictionary of the cut by particle type, and are overridden by those of a layer.'''
 
     class Volume:
         '''A simple volume of the detector that has a layer starting at a given z position'''
@@ -16,51 +22,165 @@ class Calorimeter:
             self.z = z
             self.layer = layer
 
-    def __init__(self, layers=[]):
+    def __init__(self, layers=[], cuts=None):
         self._layers = layers.copy()
+        self._cuts = check_cuts(cuts)
         self._zend = 0
         self._trace_enabled = False
         self._particle_traces = []
+        self._geometry = None
+        # Which layers the particles are followed up to, the active ones if None
+        self._reaching = None
 
     def add_layer(self, layer):
         '''Add a single layer to the back of the calorimeter.'''
         self._layers.append(self.Volume(self._zend, copy.copy(layer)))
         self._zend += layer.get_thickness()
+        if self._reaching is not None:
+            self._reaching.append(layer.get_yield() > 0)
+        self._geometry = None
 
     def add_layers(self, layers):
         '''Add a list of layers, one after the other to the back of the calorimeter.'''
         for l in layers:
             self.add_layer(l)
 
-    def step(self, particle, step):
+    def get_cuts(self):
+        return dict(self._cuts)
+
+    def set_cuts(self, cuts):
+        '''Set the production cuts of the particle types in the dictionary cuts, keeping
+        those of the other types.'''
+        self._cuts.update(check_cuts(cuts))
+        self._geometry = None
+
+    def with_cuts(self, cuts):
+        '''Return a copy of the calorimeter with the production cuts in cuts set.'''
+        calorimeter = copy.deepcopy(self)
+        calorimeter.set_cuts(cuts)
+        return calorimeter
+
+    def raw(self):
+        '''Return a copy of the calorimeter in which every layer has a response of one,
+        so its ionisations are the charged path lengths in all layers, passive or active.
+        A Digitiser turns them into the ionisations of the calorimeter. Particles are
+        still only followed up to the back of the last active layer of the calorimeter,
+        so the showers draw the same random numbers and are the same as in it, and
+        layers behind it have no path length.'''
+        calorimeter = copy.deepcopy(self)
+        calorimeter._reaching = self.geometry().active.tolist()
+        for volume in calorimeter._layers:
+            volume.layer._yield = 1.0
+        calorimeter._geometry = None
+        return calorimeter
+
+    def geometry(self):
+        '''Return the compiled, read-only Geometry of the layer stack. It is built on
+        first use and rebuilt after layers have been added or the cuts changed.'''
+        if self._geometry is None:
+            self._geometry = Geometry(self._layers, self._cuts, self._reaching)
+        return self._geometry
+
+    def step(self, particle, step, rng=random):
         '''Move a particle by the amount step forward in the calorimeter,
         Return a list of particles created during
         the step. If particle doesn't do anything it is just stepped forward.
-        If trace is enabled, records the particle trajectory.'''
+        If trace is enabled, records the particle trajectory. As a particle moves in a
+        straight line, only the point where it starts is recorded. Random numbers are
+        drawn from rng, the stdlib random module or a RandomStream.'''
+        particles = self.propagate(particle, step, rng)
+        if particles is None:
+            return [particle]
+        return particles
 
-        involume = False
-        for volume in self._layers:
-            if (particle.z >= volume.z) and (particle.z < volume.z + volume.layer.get_thickness()):
-                involume = True
-                break
+    def advance(self, particle, rng=random):
+        '''Event driven alternative to step. The particle is moved straight to its next
+        interaction point or to the next layer boundary, whichever comes first, and the
+        exact path length travelled is deposited in the layer. Return the list of
+        particles after the move in the same way as step.'''
+        particles = self.propagate(particle, None, rng)
+        if particles is None:
+            return [particle]
+        return particles
+
+    def propagate(self, particle, step=None, rng=random, straight=False):
+        '''Move a particle as step does for a fixed step, or as advance does if step is
+        None. Return None if the particle has only moved on, otherwise the list of
+        particles it turned into, which is empty if it was absorbed. This is the
+        stepping used by the simulation, as it does not build a list for every step.
 
-        particle.move(step)
+        With straight=True a segment on which the particle cannot interact is crossed
+        in one go, with the ionisation of every layer on the way in closed form: a
+        particle that never interacts, such as a muon, goes straight to the back of the
+        last active layer, where its trace also ends, and any other particle to
+        the back of the run of layers without material it is in.'''
+        geometry = self.geometry()
+        index = geometry.locate(particle.z)
+        if self._trace_enabled and particle.trace is None:
+            particle.record()
 
-        particles = [particle]
-        if involume:
-            layer = volume.layer
+        if straight and index >= 0:
+            if particle.interacts:
+                end = geometry.clear_end(index)
+            else:
+                end = max(geometry.reach, particle.z)
+            if end is not None:
+                layers = geometry.layers
+                for i, path in geometry.paths(particle.z, end):
+                    layers[i].ionise(particle, path)
+                particle.move(end - particle.z)
+                particle.z = end
+                return None
+
+        if step:
+            particle.move(step)
+            if index < 0:
+                return None
+            layer = geometry.layers[index]
             layer.ionise(particle, step)
-            particles = layer.interact(particle, step)
+            return layer.collide(particle, step, rng, geometry.layer_cuts[index])
 
-        return particles
+        if index < 0:
+            # Outside the layers, go directly to the front of the next one
+            boundary = geometry.next_start(particle.z)
+            if boundary > particle.z:
+                particle.move(boundary - particle.z)
+                particle.z = boundary
+            return None
+
+        layer = geometry.layers[index]
+        boundary = geometry.boundary(index)
+        distance = boundary - particle.z
+        path = layer.free_path(rng)
+        if path < distance:
+            particle.move(path)
+            layer.ionise(particle, path)
+            return particle.interact(rng, geometry.layer_cuts[index][particle.type])
+
+        particle.move(distance)
+        # Avoid rounding leaving the particle a fraction short of the boundary
+        particle.z = boundary
+        layer.ionise(particle, distance)
+        return None
 
     def volumes(self, active=True):
         '''Return the list of volumes in the calorimeter.'''
-        return [v for v in self._layers if not active or v.layer.get_yield()>0]
+        if not active:
+            return list(self._layers)
+        return [self._layers[i] for i in self.geometry().active_index]
 
     def ionisations(self, active=True):
         '''Provide a list of the ionisation deposited in each of the layers. If active=True, only return the active layers'''
-        return np.array([v.layer.get_ionisation() for v in self._layers if not active or v.layer.get_yield()>0])
+        geometry = self.geometry()
+        if not active:
+            return np.array([l.get_ionisation() for l in geometry.layers])
+        return np.array([geometry.layers[i].get_ionisation() for i in geometry.active_index])
+
+    def deposit(self, index, amounts):
+        '''Add the ionisation amounts to the layers, starting with the layer at index.
+        Amounts beyond the back of the calorimeter are dropped.'''
+        for layer, amount in zip(self.geometry().layers[index:], amounts):
+            layer._ionisation += amount
 
     def reset(self):
         '''Clears the recorded ionisation in each layer and particle traces'''
@@ -85,15 +205,18 @@ class Calorimeter:
 
     def get_particle_traces(self):
         '''Return the recorded particle traces as a list of (particle, trace_list) tuples.
-        Each trace_list contains (z, x, y) positions along the particle trajectory.'''
+        Each trace_list contains the (z, x, y) positions where the trajectory starts and
+        changes direction, followed by the final position. Straight lines between them
+        give the full trajectory.'''
         return self._particle_traces
 
     def record_trace(self, particle):
         '''Record the final trajectory of a particle.'''
-        if self._trace_enabled and particle.trace and (particle.type in ('elec', 'muon')):
-            # Add final position to the trace
-            final_trace = particle.trace + [(particle.z, particle.x, particle.y)]
-            self._particle_traces.append((particle, final_trace))
+        if self._trace_enabled and (particle.type in ('elec', 'muon')):
+            trace = particle.history()
+            if trace:
+                # Add final position to the trace
+                self._particle_traces.append((particle, trace + [(particle.z, particle.x, particle.y)]))
 
     def draw(self, ax=None, extend=15, show_traces=False):
         '''Draw the calorimeter design with z-axis horizontal.
@@ -145,18 +268,16 @@ class Calorimeter:
         has_electron_trace = False
         has_muon_trace = False
         if show_traces and self._particle_traces:
+            # Traces are polylines through the points where particles change direction
+            lines = {'elec': [], 'muon': []}
             for particle, trace in self._particle_traces:
-                if particle.type not in ('elec', 'muon'):
-                    continue
-                if len(trace) > 1:
-                    z_coords = [pos[0] for pos in trace]
-                    x_coords = [pos[1] for pos in trace]
-                    color = electron_color if particle.type == 'elec' else muon_color
-                    ax.plot(z_coords, x_coords, '-', color=color, linewidth=1.0, alpha=0.03)
-                    if particle.type == 'elec':
-                        has_electron_trace = True
-                    else:
-                        has_muon_trace = True
+                if particle.type in lines and len(trace) > 1:
+                    lines[particle.type].append([(pos[0], pos[1]) for pos in trace])
+            for ptype, color in (('elec', electron_color), ('muon', muon_color)):
+                if lines[ptype]:
+                    ax.add_collection(LineCollection(lines[ptype], colors=color, linewidths=1.0, alpha=0.03))
+            has_electron_trace = bool(lines['elec'])
+            has_muon_trace = bool(lines['muon'])
 
         # Set axis properties
         ax.set_xlim(-0.5, self._zend + 0.5)
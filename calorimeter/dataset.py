@@ -0,0 +1,141 @@
+import json
+import os
+import numpy as np
+from .sparse import SparseSample
+
+
+def run_settings(simulation, deadcellfraction=0.0):
+    '''Return a dictionary of the settings of a simulation that, besides the geometry
+    and the seed, decide its results. Libraries are given by the hash of their
+    contents.'''
+    roulette = simulation._roulette
+    return {'engine': simulation._engine, 'transport': simulation._transport, 'step': simulation._step,
+            'batch_size': simulation._batch_size, 'traversal': simulation._traversal, 'raw': simulation._raw,
+            'deadcellfraction': deadcellfraction, 'budget': simulation._budget,
+            'roulette': None if roulette is None else [roulette.threshold, roulette.survival],
+            'library': None if simulation._library is None else simulation._library.digest(),
+            'subshowers': None if simulation._subshowers is None else simulation._subshowers.digest()}
+
+
+class ResultDataset:
+    '''The results of a simulation run stored on disk in directory, as chunks of .npy
+    files described by a JSON manifest. Each chunk holds a column for the
+    ionisations, the incident energy and type code of the particles, see
+    vectorised.TYPE_CODES, the index of every event, which together with the run seed
+    gives its random stream, see rng.event_generator, and any further per event
+    arrays of the sample blocks, such as 'peak_stack'. The manifest holds the seed,
+    the geometry fingerprint and layers, the settings of the simulation, the chunk
+    size for engines whose results depend on it and any metadata given.
+
+    A dataset is filled block by block with append, normally by
+    Simulation.write_sample while the simulation runs. The chunk files are written
+    before the manifest is replaced, so a reader never sees a partial chunk. Opening a
+    dataset only reads the manifest, and the columns are memory-mapped, so runs larger
+    than the memory can be written and analysed.'''
+
+    manifest_name = 'manifest.json'
+
+    def __init__(self, directory):
+        self.directory = os.fspath(directory)
+        with open(os.path.join(self.directory, self.manifest_name)) as f:
+            self.manifest = json.load(f)
+
+    @classmethod
+    def create(cls, directory, simulation, seed, deadcellfraction=0.0, metadata=None, chunksize=None):
+        '''Create an empty dataset in directory for a run of simulation with the given
+        seed and, for the batch and fast engines, chunk size. Raise ValueError if the
+        directory already holds a dataset.'''
+        directory = os.fspath(directory)
+        if os.path.exists(os.path.join(directory, cls.manifest_name)):
+            raise ValueError(f"There is already a result dataset in {directory}")
+        os.makedirs(directory, exist_ok=True)
+        geometry = simulation._calorimeter.geometry()
+        layers = [{'name': layer.get_name(), 'z': z, 'material': layer.get_material(),
+                   'thickness': layer.get_thickness(), 'response': layer.get_yield()}
+                  for layer, z in zip(geometry.layers, geometry.z.tolist())]
+        manifest = {'format': 1, 'seed': seed, 'fingerprint': geometry.fingerprint(), 'layers': layers,
+                    'active': geometry.active_index.tolist(), 'settings': run_settings(simulation, deadcellfraction),
+                    'chunksize': chunksize, 'metadata': metadata or {}, 'width': len(geometry.active_index), 'events': 0,
+                    'columns': None, 'chunks': []}
+        _write_manifest(directory, manifest)
+        return cls(directory)
+
+    def check(self, simulation, deadcellfraction=0.0):
+        '''Raise ValueError if simulation, with the dead cell fraction, does not give
+        results of the same geometry and settings as the dataset.'''
+        if simulation._calorimeter.geometry().fingerprint() != self.manifest['fingerprint']:
+            raise ValueError(f"The result dataset in {self.directory} is of another geometry")
+        settings = json.loads(json.dumps(run_settings(simulation, deadcellfraction)))
+        if settings != self.manifest['settings']:
+            raise ValueError(f"The result dataset in {self.directory} was simulated with the settings "
+                             f"{self.manifest['settings']}, not {settings}")
+
+    @property
+    def seed(self):
+        return self.manifest['seed']
+
+    @property
+    def chunksize(self):
+        '''The number of events per chunk of the simulation, None if its results do not
+        depend on it.'''
+        return self.manifest.get('chunksize')
+
+    @property
+    def width(self):
+        return self.manifest['width']
+
+    @property
+    def columns(self):
+        '''The names of the columns, None while the dataset is empty.'''
+        return self.manifest['columns']
+
+    def __len__(self):
+        return self.manifest['events']
+
+    def append(self, block):
+        '''Add a sample block (indices, ionisations, info) as a new chunk. Sparse
+        ionisations are stored dense.'''
+        indices, ionisations, info = block
+        if isinstance(ionisations, SparseSample):
+            ionisations = ionisations.to_dense()
+        data = {'ionisations': np.asarray(ionisations), 'event': np.asarray(indices, dtype=np.int64)}
+        data.update((name, np.asarray(value)) for name, value in info.items())
+        if data['ionisations'].shape[1:] != (self.width,):
+            raise ValueError(f"The ionisations have {data['ionisations'].shape[1:]} columns, "
+                             f"the dataset {self.width}")
+        if self.columns is not None and sorted(data) != self.columns:
+            raise ValueError(f"The block has the columns {sorted(data)}, the dataset {self.columns}")
+
+        name = f'chunk-{len(self.manifest["chunks"]):06d}'
+        for column, array in data.items():
+            np.save(os.path.join(self.directory, f'{name}.{column}.npy'), array)
+        self.manifest['columns'] = sorted(data)
+        self.manifest['chunks'].append({'name': name, 'start': int(indices[0]) if len(indices) else None,
+                                        'events': len(indices)})
+        self.manifest['events'] += len(indices)
+        _write_manifest(self.directory, self.manifest)
+
+    def chunk(self, i):
+        '''Return the columns of chunk i as a dictionary of memory-mapped arrays.'''
+        name = self.manifest['chunks'][i]['name']
+        return {column: np.load(os.path.join(self.directory, f'{name}.{column}.npy'), mmap_mode='r')
+                for column in self.columns}
+
+    def iter_chunks(self):
+        '''Yield the columns of every chunk in turn, see chunk.'''
+        for i in range(len(self.manifest['chunks'])):
+            yield self.chunk(i)
+
+    def __getitem__(self, column):
+        '''Return the column of all events as one array, read into memory.'''
+        if not self.manifest['chunks']:
+            return np.zeros((0, self.width)) if column == 'ionisations' else np.zeros(0)
+        return np.concatenate([chunk[column] for chunk in self.iter_chunks()], axis=0)
+
+
+def _write_manifest(directory, manifest):
+    '''Replace the manifest in directory in one go.'''
+    path = os.path.join(directory, ResultDataset.manifest_name)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(f'{path}.tmp', path)
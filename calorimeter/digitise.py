@@ -0,0 +1,51 @@
+import numpy as np
+
+
+class Digitiser:
+    '''Turns the raw charged path lengths in every layer of a sample, as simulated by
+    Simulation(raw=True), into the ionisations of the active layers of a calorimeter
+    under given detector conditions, all with array operations on the whole sample.
+    A single simulation can so serve many variants of the detector.
+
+    The path lengths are multiplied by the response of each layer, yields if given for
+    every layer, otherwise those of the calorimeter, and the active layers are those
+    with a response. Their signals are then multiplied by gain, have gaussian noise of
+    standard deviation noise added, and are set to zero below threshold. The cells in
+    dead, a boolean map of the active layers, are set to zero in every event, and each
+    further cell with probability deadcellfraction. Gain, noise and threshold are
+    either a single value or one per active layer.'''
+
+    def __init__(self, calorimeter, yields=None, gain=1.0, noise=0.0, threshold=None, dead=None,
+                 deadcellfraction=0.0):
+        geometry = calorimeter.geometry()
+        self.yields = geometry.yields if yields is None else np.asarray(yields, dtype=float)
+        if self.yields.shape != (len(geometry),):
+            raise ValueError(f"Expected a response for each of the {len(geometry)} layers, got {self.yields.shape}")
+        self.active_index = np.flatnonzero(self.yields > 0)
+        n = len(self.active_index)
+        self.gain = np.broadcast_to(np.asarray(gain, dtype=float), n)
+        self.noise = np.broadcast_to(np.asarray(noise, dtype=float), n)
+        self.threshold = None if threshold is None else np.broadcast_to(np.asarray(threshold, dtype=float), n)
+        self.dead = np.zeros(n, dtype=bool) if dead is None else np.asarray(dead, dtype=bool)
+        if self.dead.shape != (n,):
+            raise ValueError(f"Expected a dead cell map of the {n} active layers, got {self.dead.shape}")
+        self.deadcellfraction = deadcellfraction
+
+    def digitise(self, raw, rng=None):
+        '''Return the (events x active layers) ionisations for the (events x layers)
+        raw path lengths. The noise and the random dead cells are drawn from the numpy
+        Generator rng.'''
+        rng = np.random.default_rng() if rng is None else rng
+        raw = np.asarray(raw, dtype=float)
+        if raw.ndim != 2 or raw.shape[1] != len(self.yields):
+            raise ValueError(f"Expected raw path lengths of {len(self.yields)} layers, got shape {raw.shape}")
+
+        signal = raw[:, self.active_index]*(self.yields[self.active_index]*self.gain)
+        if self.noise.any():
+            signal += rng.standard_normal(signal.shape)*self.noise
+        if self.threshold is not None:
+            signal[signal < self.threshold] = 0
+        signal[:, self.dead] = 0
+        if self.deadcellfraction > 0:
+            signal[rng.random(signal.shape) < self.deadcellfraction] = 0
+        return signal
@@ -0,0 +1,458 @@
+import hashlib
+import math
+import os
+import time
+import numpy as np
+from .calorimeter import Calorimeter
+from .layer import Layer
+from .particle import Electron, Photon, Muon
+from .vectorised import simulate_batch
+
+# The particle classes by their type
+_PARTICLES = {'elec': Electron, 'phot': Photon, 'muon': Muon}
+
+
+def library_key(calorimeter, particle_type=Electron, step=None):
+    '''Return the key of a shower library, given by the geometry fingerprint of the
+    calorimeter, the type of the incoming particle and the step of the transport
+    (None for event driven transport).'''
+    text = f'{calorimeter.geometry().fingerprint()}:{particle_type(0.0, 0.0).type}:{step!r}'
+    return hashlib.sha256(text.encode()).hexdigest()[:24]
+
+
+def _digest(arrays):
+    '''Return a hash of the types, shapes and contents of the arrays. Memory-mapped
+    arrays are read from their file without a copy.'''
+    digest = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(f'{array.dtype.str}{array.shape}'.encode())
+        digest.update(array.reshape(-1).view(np.uint8))
+    return digest.hexdigest()
+
+
+class ShowerLibrary:
+    '''A parameterisation of the response of a calorimeter, fitted to full simulations
+    on a grid of incident energies, from which ionisation vectors of new events are
+    drawn with a few array operations per event.
+
+    An event is described by its total ionisation and by its longitudinal profile, the
+    fraction of the total in each active layer. For every grid energy the mean and
+    spread of the total are kept, the mean profile is fitted with a Gamma distribution
+    in depth, z**(a-1) * exp(-b*z), and the covariance of the profile fractions is kept
+    to describe the fluctuations of the shape of the shower and the correlation of the
+    layers. Splitting the total from the shape keeps the strong anticorrelation
+    between early and late layers, so the total is not smeared by the fluctuations of
+    the profile. Between grid energies the mean total and the Gamma parameters are
+    interpolated in log(energy), the variance of the total in proportion to the energy,
+    and the profile fluctuations are taken from either of the two neighbouring grid
+    points. Build a library with build or cached and check it against the full
+    simulation with validate.'''
+
+    def __init__(self, key, fingerprint, particle, energies, totals, spreads, shapes, means, covariances, depths,
+                 weights):
+        self.key = str(key)
+        self.fingerprint = str(fingerprint)
+        self.particle = str(particle)
+        self.energies = np.asarray(energies, dtype=float)
+        self.totals = np.asarray(totals, dtype=float)
+        self.spreads = np.asarray(spreads, dtype=float)
+        self.shapes = np.asarray(shapes, dtype=float)
+        self.means = np.asarray(means, dtype=float)
+        self.covariances = np.asarray(covariances, dtype=float)
+        self.depths = np.asarray(depths, dtype=float)
+        self.weights = np.asarray(weights, dtype=float)
+
+        # Matrix square roots of the covariances, so correlated fluctuations are A @ normals
+        self._factors = []
+        for covariance in self.covariances:
+            values, vectors = np.linalg.eigh(covariance)
+            self._factors.append(vectors*np.sqrt(np.clip(values, 0.0, None)))
+        self._factors = np.array(self._factors)
+
+    @classmethod
+    def build(cls, simulation, energies=(1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0), events=200, particle_type=Electron,
+              seed=None):
+        '''Build the library by simulating events incoming particles of particle_type
+        at each of the energies with the full model of the simulation.'''
+        energies = np.sort(np.asarray(energies, dtype=float))
+        if len(energies) < 2:
+            raise ValueError("A shower library needs at least two energies")
+        calorimeter = simulation._calorimeter
+        geometry = calorimeter.geometry()
+        active = geometry.active_index
+        depths = geometry.z[active] + geometry.thickness[active]/2
+        weights = geometry.thickness[active]*geometry.yields[active]
+
+        totals, spreads, shapes, means, covariances = [], [], [], [], []
+        for i, energy in enumerate(energies):
+            sample = simulation.simulate_sample([particle_type(0.0, energy) for _ in range(events)], seed=seed,
+                                                first_event=i*events)
+            seed = simulation.last_seed
+            mean = sample.mean(axis=0)
+            total = sample.sum(axis=1)
+            totals.append(total.mean())
+            spreads.append(total.std())
+            shapes.append(_fit_gamma(depths, mean/weights, weights))
+            means.append(mean)
+            fractions = sample[total > 0]/total[total > 0, None]
+            if len(fractions) > 1:
+                covariances.append(np.cov(fractions, rowvar=False).reshape(len(active), len(active)))
+            else:
+                covariances.append(np.zeros((len(active), len(active))))
+
+        return cls(library_key(calorimeter, particle_type, simulation._step), geometry.fingerprint(),
+                   particle_type(0.0, 0.0).type, energies, totals, spreads, shapes, means, covariances, depths,
+                   weights)
+
+    @classmethod
+    def cached(cls, simulation, directory, energies=(1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0), events=200,
+               particle_type=Electron, seed=None):
+        '''Load the library for the calorimeter of the simulation from directory, where
+        it is stored under its key, or build and store it if it is not there yet.'''
+        key = library_key(simulation._calorimeter, particle_type, simulation._step)
+        path = os.path.join(directory, f'{key}.npz')
+        if os.path.exists(path):
+            return cls.load(path)
+        library = cls.build(simulation, energies, events, particle_type, seed)
+        os.makedirs(directory, exist_ok=True)
+        library.save(path)
+        return library
+
+    def save(self, path):
+        '''Save the library to a .npz file.'''
+        np.savez(path, **{name: getattr(self, name) for name in self._fields})
+
+    @classmethod
+    def load(cls, path):
+        '''Load a library saved with save.'''
+        with np.load(path, allow_pickle=False) as data:
+            return cls(*(data[name][()] for name in cls._fields))
+
+    _fields = ('key', 'fingerprint', 'particle', 'energies', 'totals', 'spreads', 'shapes', 'means', 'covariances',
+               'depths', 'weights')
+
+    def digest(self):
+        '''Return a hash of the contents of the library. Unlike the key, which only
+        tells which geometry and particle it is for, it differs between libraries
+        fitted to different energies or events.'''
+        return _digest(np.asarray(getattr(self, name)) for name in self._fields)
+
+    def check_particles(self, particles):
+        '''Raise ValueError if any of the particles, which may also be given as plain
+        energies, is not of the type of the library or does not come in as the library
+        was built: at z=0 along the axis with a weight of one.'''
+        for p in particles:
+            if not hasattr(p, 'type'):
+                return
+            if p.type != self.particle:
+                raise ValueError(f"The library is for '{self.particle}' particles, not '{p.type}'")
+            if p.z != 0 or p.angle_x != 0 or p.angle_y != 0 or p.weight != 1:
+                raise ValueError(f"The library is for particles coming in at z=0 along the axis with weight one, not "
+                                 f"z={p.z}, angles ({p.angle_x}, {p.angle_y}) and weight {p.weight}")
+
+    def mean(self, energies):
+        '''Return the parameterised mean ionisation in the active layers for each of the
+        energies, as an (events x active layers) array.'''
+        energies = np.atleast_1d(np.asarray(energies, dtype=float))
+        total, _, profile = self._parameters(energies)
+        return total[:, None]*profile
+
+    def sample(self, energies, rng=None):
+        '''Draw the ionisations in the active layers of events with the given incident
+        energies, which have to be inside the range of the library. Return an
+        (events x active layers) array.'''
+        rng = np.random.default_rng() if rng is None else rng
+        energies = np.atleast_1d(np.asarray(energies, dtype=float))
+        bins, fraction = self._interpolation(energies)
+        total, spread, profile = self._parameters(energies)
+        total = np.clip(total + spread*rng.standard_normal(len(energies)), 0.0, None)
+
+        # The profile fluctuations come from one of the two neighbouring grid points,
+        # chosen with the interpolation fraction as probability
+        grid = bins + (rng.random(len(energies)) < fraction)
+        normals = rng.standard_normal((len(energies), len(self.depths)))
+        for i in np.unique(grid):
+            selected = grid == i
+            profile[selected] += normals[selected] @ self._factors[i].T
+        profile = np.clip(profile, 0.0, None)
+        norm = profile.sum(axis=1, keepdims=True)
+        return total[:, None]*profile/np.where(norm > 0, norm, 1.0)
+
+    def validate(self, simulation, energies=None, events=200, seed=None):
+        '''Compare the library with the full simulation of events particles at each of
+        the energies, by default the middle of each interval of the library grid.
+        Return a dictionary of arrays with one entry per energy: the mean and standard
+        deviation of the total ionisation from the full and fast simulations, the
+        largest difference of the mean profiles relative to the maximum of the full
+        profile, and the time per event of each. See validation_table.'''
+        if energies is None:
+            energies = np.sqrt(self.energies[:-1]*self.energies[1:])
+        energies = np.asarray(energies, dtype=float)
+        particle_type = _PARTICLES[self.particle]
+
+        names = ('full_mean', 'fast_mean', 'full_std', 'fast_std', 'profile_difference', 'full_time', 'fast_time')
+        report = {name: np.zeros(len(energies)) for name in names}
+        report['energy'] = energies
+        rng = np.random.default_rng(seed)
+        for i, energy in enumerate(energies):
+            start = time.perf_counter()
+            full = simulation.simulate_sample([particle_type(0.0, energy) for _ in range(events)], seed=seed,
+                                              first_event=i*events)
+            report['full_time'][i] = (time.perf_counter() - start)/events
+            start = time.perf_counter()
+            fast = self.sample(np.full(events, energy), rng)
+            report['fast_time'][i] = (time.perf_counter() - start)/events
+
+            report['full_mean'][i], report['full_std'][i] = full.sum(axis=1).mean(), full.sum(axis=1).std()
+            report['fast_mean'][i], report['fast_std'][i] = fast.sum(axis=1).mean(), fast.sum(axis=1).std()
+            profile = full.mean(axis=0)
+            report['profile_difference'][i] = np.abs(fast.mean(axis=0) - profile).max()/max(profile.max(), 1e-300)
+        return report
+
+    def _interpolation(self, energies):
+        '''Return the index of the grid interval of each energy and the fraction of the
+        way through it in log(energy).'''
+        if len(energies) and (energies.min() < self.energies[0] or energies.max() > self.energies[-1]):
+            raise ValueError(f"Energies outside the library range [{self.energies[0]}, {self.energies[-1]}]")
+        log_energies = np.log(self.energies)
+        bins = np.clip(np.searchsorted(self.energies, energies, side='right') - 1, 0, len(self.energies) - 2)
+        fraction = (np.log(energies) - log_energies[bins])/(log_energies[bins + 1] - log_energies[bins])
+        return bins, fraction
+
+    def _parameters(self, energies):
+        '''Return the mean total, the spread of the total and the mean profile for
+        each of the energies.'''
+        bins, fraction = self._interpolation(energies)
+
+        def interpolate(values):
+            return values[bins]*(1.0 - fraction) + values[bins + 1]*fraction
+
+        total = np.exp(interpolate(np.log(np.clip(self.totals, 1e-300, None))))
+        spread = np.sqrt(energies*interpolate(self.spreads**2/self.energies))
+        a = interpolate(self.shapes[:, 0])
+        b = interpolate(self.shapes[:, 1])
+        log_profile = (a[:, None] - 1.0)*np.log(self.depths) - b[:, None]*self.depths + np.log(self.weights)
+        profile = np.exp(log_profile - log_profile.max(axis=1, keepdims=True))
+        return total, spread, profile/profile.sum(axis=1, keepdims=True)
+
+
+def _fit_gamma(depths, density, weights):
+    '''Fit a Gamma distribution z**(a-1) * exp(-b*z) to a longitudinal profile given
+    as the density of ionisation at the depths. The logarithm of the profile is linear
+    in log(z) and z, so this is a linear least squares fit, weighted by the mean
+    ionisation in the layers. Unlike a fit of the moments it is not biased by a
+    shower leaking out of the back. Return (a, b).'''
+    hit = density > 0
+    if np.count_nonzero(hit) < 3:
+        return (1.0, 0.0)
+    w = np.sqrt(density[hit]*weights[hit])
+    design = np.column_stack((np.ones(np.count_nonzero(hit)), np.log(depths[hit]), -depths[hit]))
+    (_, slope, b), *_ = np.linalg.lstsq(design*w[:, None], np.log(density[hit])*w, rcond=None)
+    return (slope + 1.0, b)
+
+
+class SubShowerLibrary:
+    '''A library of the ionisation deposited by the sub-showers of low energy electrons
+    and photons, so the python engine can stop following a particle once its energy
+    is below threshold and deposit a pattern drawn from the library instead.
+
+    The patterns are indexed by particle type (electron or photon), energy and the
+    starting position within the repeating pattern of layers of the calorimeter, given
+    as the layer in the pattern and the bin of the position within that layer. Each
+    entry holds samples patterns of the ionisation in the span layers starting with
+    the layer the particle is in. The first energy entry is for particles at or below
+    the cutoff, which only travel to their next interaction, the others for a grid of
+    energies from the cutoff up to threshold. A particle between two grid energies
+    takes its pattern from either of them, chosen with the fraction of the way between
+    them in log(energy) as probability, scaled to the mean ionisation interpolated
+    between them. The library is built for event driven transport, as with a fixed
+    step the ionisation depends on where the grid of steps falls in every layer.
+
+    The patterns are kept in a .npy file which load opens memory-mapped, and a loaded
+    library is pickled as its path, so the worker processes all map the same file
+    rather than receiving a copy of it. Build a library with build or cached.'''
+
+    types = ('elec', 'phot')
+
+    def __init__(self, key, threshold, pattern, energies, means, deposits, path=None):
+        self.key = str(key)
+        self.threshold = float(threshold)
+        self.pattern = np.asarray(pattern, dtype=float)
+        self.energies = np.asarray(energies, dtype=float)
+        self.means = np.asarray(means, dtype=float)
+        self.deposits = deposits
+        self.path = path
+        self.period = len(self.pattern)
+        self.positions = deposits.shape[2]//self.period
+        self.samples = deposits.shape[3]
+        self.span = deposits.shape[4]
+        # Plain numbers are faster than arrays for the lookup of a single particle
+        self._cutoff = float(self.energies[1])
+        self._log_step = math.log(self.energies[2]/self.energies[1])
+        self._grid = len(self.energies) - 1
+        self._means = self.means.tolist()
+        self._energies = self.energies.tolist()
+        self._codes = {name: i for i, name in enumerate(self.types)}
+        self._digest = None
+
+    @classmethod
+    def build(cls, simulation, threshold=0.1, bins=8, positions=4, samples=100, max_span=20, seed=None):
+        '''Build the library for the calorimeter of the simulation, which has to use
+        event driven transport, by simulating samples sub-showers for every particle
+        type, grid energy and starting position with the batch engine, with bins grid
+        energies from the cutoff to threshold. The sub-showers are followed through
+        max_span repetitions of the layer pattern and the patterns are cut to the
+        fewest layers holding 99.9% of the ionisation.'''
+        cutoff = Electron(0.0, 0.0).cutoff
+        _check_cuts(simulation._calorimeter.geometry())
+        if threshold <= cutoff or bins < 2:
+            raise ValueError(f"A sub-shower library needs a threshold above the cutoff of {cutoff} "
+                             "and at least two energies")
+        if simulation._step is not None:
+            raise ValueError("Sub-shower libraries are only available with event driven transport")
+        geometry = simulation._calorimeter.geometry()
+        period = geometry.period()
+        pattern = _pattern(geometry, period)
+        energies = np.concatenate(([cutoff/2], np.geomspace(cutoff, threshold, bins)))
+
+        # A calorimeter of the layer pattern repeated max_span times
+        calorimeter = Calorimeter()
+        for _ in range(max_span):
+            calorimeter.add_layers([Layer('', material, thickness, response)
+                                    for thickness, material, response in pattern])
+        long = calorimeter.geometry()
+
+        rng = np.random.default_rng(seed)
+        deposits = np.zeros((len(cls.types), len(energies), period*positions, samples, len(long)))
+        for t, particle_type in enumerate((Electron, Photon)):
+            for e, energy in enumerate(energies):
+                # A particle exactly at the cutoff does not split, so start the grid just above it
+                energy = np.nextafter(energy, np.inf) if e == 1 else energy
+                for k in range(period*positions):
+                    layer, position = divmod(k, positions)
+                    z = long.z[layer] + (position + rng.random(samples))/positions*long.thickness[layer]
+                    deposit = simulate_batch(long, [particle_type(zi, energy) for zi in z], None, rng)
+                    deposits[t, e, k, :, :len(long) - layer] = deposit[:, layer:]
+
+        cumulative = np.cumsum(deposits.sum(axis=(0, 1, 2, 3)))
+        span = int(np.searchsorted(cumulative, 0.999*cumulative[-1])) + 1 if cumulative[-1] > 0 else 1
+        return cls(subshower_key(geometry, threshold), threshold, pattern, energies,
+                   deposits.sum(axis=-1).mean(axis=-1), deposits[..., :span].astype(np.float32))
+
+    @classmethod
+    def cached(cls, simulation, directory, threshold=0.1, bins=8, positions=4, samples=100, max_span=20, seed=None):
+        '''Load the library for the calorimeter of the simulation from directory, where
+        it is stored under its key, or build and store it if it is not there yet.'''
+        key = subshower_key(simulation._calorimeter.geometry(), threshold)
+        path = os.path.join(directory, key)
+        if not os.path.exists(f'{path}.npy'):
+            os.makedirs(directory, exist_ok=True)
+            cls.build(simulation, threshold, bins, positions, samples, max_span, seed).save(path)
+        return cls.load(path)
+
+    def save(self, path):
+        '''Save the library as path.npz, holding the description, and path.npy, holding
+        the patterns.'''
+        np.savez(f'{path}.npz', key=self.key, threshold=self.threshold, pattern=self.pattern,
+                 energies=self.energies, means=self.means)
+        np.save(f'{path}.npy', self.deposits)
+
+    @classmethod
+    def load(cls, path):
+        '''Load a library saved with save, with the patterns memory-mapped.'''
+        path = os.fspath(path)
+        with np.load(f'{path}.npz', allow_pickle=False) as data:
+            fields = [data[name][()] for name in ('key', 'threshold', 'pattern', 'energies', 'means')]
+        return cls(*fields, np.load(f'{path}.npy', mmap_mode='r'), path)
+
+    def __getstate__(self):
+        # A library on disk travels as its path, so the patterns are not copied
+        if self.path is not None:
+            return {'mapped': self.path}
+        return self.__dict__
+
+    def __setstate__(self, state):
+        if 'mapped' in state:
+            state = SubShowerLibrary.load(state['mapped']).__dict__
+        self.__dict__.update(state)
+
+    def digest(self):
+        '''Return a hash of the contents of the library, see ShowerLibrary.digest. It
+        is worked out once, as it reads all the patterns.'''
+        if self._digest is None:
+            self._digest = _digest([np.asarray(self.key), self.threshold, self.pattern, self.energies, self.means,
+                                    self.deposits])
+        return self._digest
+
+    def check(self, simulation):
+        '''Raise ValueError if the library was not built for the layer pattern, cuts and
+        transport of the simulation.'''
+        geometry = simulation._calorimeter.geometry()
+        _check_cuts(geometry)
+        if len(geometry) and not np.array_equal(_pattern(geometry, geometry.period()), self.pattern):
+            raise ValueError("The sub-shower library was built for a different layer pattern")
+        if simulation._step is not None:
+            raise ValueError("Sub-shower libraries are only available with event driven transport")
+
+    def absorb(self, calorimeter, particle, rng):
+        '''Replace the sub-shower of the particle by a pattern from the library if it
+        is an electron or photon below threshold, adding the ionisation to the
+        calorimeter scaled by the weight of the particle. Return True if the particle was replaced, otherwise False and the
+        particle has to be followed as usual.'''
+        code = self._codes.get(particle.type)
+        if code is None or particle.energy >= self.threshold:
+            return False
+        index, fraction = calorimeter.geometry().position(particle.z)
+        if index < 0:
+            return False
+        position = (index % self.period)*self.positions + min(int(fraction*self.positions), self.positions - 1)
+
+        energy = 0
+        scale = 1.0
+        if particle.energy > self._cutoff:
+            grid = math.log(particle.energy/self._cutoff)/self._log_step
+            lower = min(int(grid), self._grid - 2) + 1
+            fraction = grid - lower + 1
+            energy = lower + (rng.random() < fraction)
+            # Scale the pattern to the mean ionisation interpolated to the energy
+            means = self._means[code]
+            linear = (particle.energy - self._energies[lower])/(self._energies[lower + 1] - self._energies[lower])
+            mean = means[lower][position]*(1.0 - linear) + means[lower + 1][position]*linear
+            if means[energy][position] > 0:
+                scale = mean/means[energy][position]
+        pattern = self.deposits[code, energy, position, int(rng.random()*self.samples)]
+        calorimeter.deposit(index, (pattern*(scale*particle.weight)).tolist())
+        return True
+
+
+def subshower_key(geometry, threshold):
+    '''Return the key of a sub-shower library, given by the repeating layer pattern of
+    the geometry and the threshold.'''
+    digest = hashlib.sha256(_pattern(geometry, geometry.period()).tobytes())
+    digest.update(f':{float(threshold)!r}'.encode())
+    return digest.hexdigest()[:24]
+
+
+def _check_cuts(geometry):
+    '''Raise ValueError unless electrons and photons have the default production cut
+    in every layer of the geometry, which sub-shower libraries are built for.'''
+    if geometry.uniform_cut() != Electron(0.0, 0.0).cutoff:
+        raise ValueError("Sub-shower libraries are only available with the default production cuts")
+
+
+def _pattern(geometry, period):
+    '''The (thickness, material, yield) of each layer in the first period of the
+    geometry, as a (period x 3) array.'''
+    return np.column_stack((geometry.thickness, geometry.material, geometry.yields))[:period]
+
+
+def validation_table(report):
+    '''Format a validation report of ShowerLibrary.validate as a text table.'''
+    lines = ['  energy   full mean   fast mean   full std   fast std   profile diff   full us/ev   fast us/ev']
+    for i, energy in enumerate(report['energy']):
+        lines.append(f"{energy:8.2f}  {report['full_mean'][i]:10.3f}  {report['fast_mean'][i]:10.3f}  "
+                     f"{report['full_std'][i]:9.3f}  {report['fast_std'][i]:9.3f}  "
+                     f"{report['profile_difference'][i]:13.3f}  {1e6*report['full_time'][i]:11.1f}  "
+                     f"{1e6*report['fast_time'][i]:11.1f}")
+    return '\n'.join(lines)
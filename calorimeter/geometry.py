@@ -0,0 +1,134 @@
+import bisect
+import hashlib
+import numpy as np
+from .particle import DEFAULT_CUTS
+
+
+class Geometry:
+    '''A compiled, read-only view of the layer stack of a calorimeter. The properties
+    of the layers are held in contiguous arrays indexed by layer number, so the layer
+    containing a given z position can be found by bisection rather than by scanning
+    every volume. A Geometry is built by the Calorimeter and is discarded whenever
+    layers are added to it or its production cuts change.
+
+    The production cuts are resolved for each layer from the cuts of the layer, those
+    of the calorimeter given as cuts and the defaults, in that order. They are held in
+    cuts, an array per particle type, and in layer_cuts, a dictionary per layer.
+
+    Particles are followed up to reach, the back of the last active layer, or of the
+    last layer flagged in reaching if given, a boolean per layer.'''
+
+    def __init__(self, volumes, cuts=None, reaching=None):
+        self.layers = tuple(v.layer for v in volumes)
+        self.z = np.array([v.z for v in volumes], dtype=float)
+        self.thickness = np.array([l.get_thickness() for l in self.layers], dtype=float)
+        self.material = np.array([l.get_material() for l in self.layers], dtype=float)
+        self.yields = np.array([l.get_yield() for l in self.layers], dtype=float)
+        self.active = self.yields > 0
+        self.active_index = np.flatnonzero(self.active)
+        self.layer_cuts = [{**DEFAULT_CUTS, **(cuts or {}), **l.get_cuts()} for l in self.layers]
+        self.cuts = {type: np.array([c[type] for c in self.layer_cuts], dtype=float) for type in DEFAULT_CUTS}
+        for array in (self.z, self.thickness, self.material, self.yields, self.active, self.active_index,
+                      *self.cuts.values()):
+            array.flags.writeable = False
+
+        # Plain lists are faster than arrays for bisecting a single position
+        self._starts = self.z.tolist()
+        self._ends = [z + t for z, t in zip(self._starts, self.thickness.tolist())]
+        self.zend = max(self._ends, default=0.0)
+        # Nothing behind the last active layer can add to the ionisations
+        last = np.flatnonzero(self.active if reaching is None else np.asarray(reaching, dtype=bool))
+        self.reach = self._ends[last[-1]] if len(last) else 0.0
+        self._reaching = reaching is not None
+
+        # The back of the run of layers without material starting at each layer, None
+        # for layers with material
+        self._clear_ends = [end if m == 0 else None for end, m in zip(self._ends, self.material.tolist())]
+        for i in range(len(self) - 2, -1, -1):
+            if self._clear_ends[i] is not None and self._clear_ends[i + 1] is not None \
+                    and self._ends[i] == self._starts[i + 1]:
+                self._clear_ends[i] = self._clear_ends[i + 1]
+
+    def __len__(self):
+        return len(self.layers)
+
+    def fingerprint(self):
+        '''Return a hash of the positions and properties of the layers and of the
+        production cuts. Two geometries with the same fingerprint give the same
+        simulation results, whatever the names of their layers, so it can be used as
+        the key of stored results.'''
+        digest = hashlib.sha256()
+        for array in (self.z, self.thickness, self.material, self.yields, *self.cuts.values()):
+            digest.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+        if self._reaching:
+            digest.update(np.float64(self.reach).tobytes())
+        return digest.hexdigest()
+
+    def locate(self, z):
+        '''Return the index of the layer containing the position z, or -1 if the
+        position is not inside any layer.'''
+        i = bisect.bisect_right(self._starts, z) - 1
+        if i < 0 or z >= self._ends[i]:
+            return -1
+        return i
+
+    def position(self, z):
+        '''Return the index of the layer containing the position z and the fraction of
+        the way through the layer, or (-1, 0.0) if z is not inside any layer.'''
+        i = self.locate(z)
+        if i < 0:
+            return (-1, 0.0)
+        return (i, (z - self._starts[i])/(self._ends[i] - self._starts[i]))
+
+    def period(self):
+        '''Return the number of layers in the repeating pattern of the layer stack, the
+        smallest p for which every layer has the same properties as the one p layers in
+        front of it. A stack without repetition has the number of layers as period.'''
+        properties = np.column_stack((self.thickness, self.material, self.yields))
+        for p in range(1, len(self)):
+            if np.array_equal(properties[p:], properties[:-p]):
+                return p
+        return len(self)
+
+    def uniform_cut(self, types=('elec', 'phot')):
+        '''Return the production cut shared by the particle types in all layers, or None
+        if it differs between them.'''
+        cuts = set(np.concatenate([self.cuts[type] for type in types]).tolist()) or {DEFAULT_CUTS[types[0]]}
+        return cuts.pop() if len(cuts) == 1 else None
+
+    def clear_end(self, index):
+        '''Return the z position of the back of the run of adjacent layers without
+        material starting with the layer at index, or None if that layer has material.'''
+        return self._clear_ends[index]
+
+    def paths(self, z0, z1):
+        '''Return the (index, path) pairs of the layers crossed on the way from z0 to
+        z1, with path the length along z inside each layer.'''
+        crossed = []
+        i = max(bisect.bisect_right(self._starts, z0) - 1, 0)
+        while i < len(self._starts) and self._starts[i] < z1:
+            path = min(self._ends[i], z1) - max(self._starts[i], z0)
+            if path > 0:
+                crossed.append((i, path))
+            i += 1
+        return crossed
+
+    def boundary(self, index):
+        '''Return the z position of the back face of the layer with the given index.'''
+        return self._ends[index]
+
+    def next_start(self, z):
+        '''Return the z position of the front face of the first layer starting after z.
+        If there is no such layer, the back of the calorimeter is returned.'''
+        i = bisect.bisect_right(self._starts, z)
+        if i < len(self._starts):
+            return self._starts[i]
+        return self.zend
+
+    def locate_all(self, z):
+        '''Vectorised version of locate for an array of z positions.'''
+        z = np.asarray(z, dtype=float)
+        i = np.searchsorted(self.z, z, side='right') - 1
+        inside = i >= 0
+        inside[inside] = z[inside] < self.z[i[inside]] + self.thickness[i[inside]]
+        return np.where(inside, i, -1)
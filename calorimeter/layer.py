@@ -1,16 +1,20 @@
+import math
 import random
+from .particle import check_cuts
 
 class Layer:
     '''Defines an individual layer of a calorimeter. The properties of the layer are
     name, its material given as X0 per cm, the thickness, the response measuring the
     level of ionisation (in arbitrary units, zero for passive layer). The layer can
-    keep track of the ionisation in it.'''
+    keep track of the ionisation in it. The production cuts of the calorimeter can be
+    overridden in the layer with cuts, a dictionary of the cut by particle type.'''
 
-    def __init__(self, name, material, thickness, response=1.0):
+    def __init__(self, name, material, thickness, response=1.0, cuts=None):
         self._name = name
         self._material = material
         self._thickness = thickness
         self._yield = response
+        self._cuts = check_cuts(cuts)
         self._ionisation = 0
 
     def get_name(self):
@@ -28,20 +32,39 @@ class Layer:
     def get_ionisation(self):
         return self._ionisation
 
+    def get_cuts(self):
+        return dict(self._cuts)
+
     def ionise(self, particle, step):
-        '''Records the ionisation in each layer from a particle going a certain length.'''
+        '''Records the ionisation in each layer from a particle going a certain length,
+        scaled by the statistical weight of the particle.'''
         if particle.ionise:
-            self._ionisation += self._yield*step
+            self._ionisation += self._yield*step*particle.weight
 
-    def interact(self, particle, step):
+    def interact(self, particle, step, rng=random, cuts=None):
         '''Let a particle interact (bremsstrahlung or pair production). The interaction
-        length is assumed to be the same for electrons and photons.'''
-        material = self._material*step
-        particles = [particle]
-        if random.random() < material:
-            particles = particle.interact()
-
+        length is assumed to be the same for electrons and photons. The random numbers
+        are drawn from rng, the stdlib random module or a RandomStream. If given, cuts
+        is the dictionary of production cuts by particle type to apply.'''
+        particles = self.collide(particle, step, rng, cuts)
+        if particles is None:
+            return [particle]
         return particles
 
+    def collide(self, particle, step, rng=random, cuts=None):
+        '''Same as interact, but return None if the particle does not interact in the
+        step, so no list has to be built for the common case.'''
+        if rng.random() < self._material*step:
+            return particle.interact(rng) if cuts is None else particle.interact(rng, cuts[particle.type])
+        return None
+
+    def free_path(self, rng=random):
+        '''Sample the distance a particle travels in the layer before it interacts. The
+        distance is exponentially distributed with the material as the interaction rate
+        per cm, so a layer without material gives an infinite free path.'''
+        if self._material > 0:
+            return rng.expovariate(self._material)
+        return math.inf
+
     def __str__(self):
         return f'{self._name:10} {self._material:.3f} {self._thickness:.2f} cm {self._ionisation:.3f}'
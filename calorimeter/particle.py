@@ -1,9 +1,33 @@
 import random
 
+# Production cuts by particle type, the energy below which a particle is absorbed at
+# its next interaction rather than split. A Calorimeter or its Layers can change them.
+DEFAULT_CUTS = {'elec': 0.01, 'phot': 0.01, 'muon': 0.01}
+
+
+def check_cuts(cuts):
+    '''Return a copy of the dictionary of production cuts by particle type, raising
+    ValueError for an unknown type or a negative cut.'''
+    cuts = dict(cuts or {})
+    for type, cut in cuts.items():
+        if type not in DEFAULT_CUTS:
+            raise ValueError(f"Unknown particle type '{type}', use one of {tuple(DEFAULT_CUTS)}")
+        if cut < 0:
+            raise ValueError(f"The production cut of '{type}' cannot be negative, not {cut}")
+    return cuts
+
+
 class Particle:
-    '''Base class for particles'''
+    '''Base class for particles. The attributes are held in slots rather than a per
+    instance dictionary, as a shower creates a very large number of particles.'''
+
+    __slots__ = ('type', 'z', 'energy', 'ionise', 'cutoff', 'x', 'y', 'angle_x', 'angle_y', 'trace', 'parent', 'weight')
 
-    def __init__(self, type, z, energy, ionise, cutoff, x=0, y=0, angle_x=0, angle_y=0, trace=None):
+    # False for particles that never interact, so they can cross the calorimeter in one go
+    interacts = True
+
+    def __init__(self, type, z, energy, ionise, cutoff, x=0, y=0, angle_x=0, angle_y=0, trace=None, parent=None,
+                 weight=1.0):
         self.type = type
         self.z = z
         self.energy = energy
@@ -13,13 +37,29 @@ class Particle:
         self.y = y  # Transverse position (y-direction)
         self.angle_x = angle_x  # Angle with respect to z-axis in x-z plane
         self.angle_y = angle_y  # Angle with respect to z-axis in y-z plane
-        self.trace = trace if trace is not None else []  # List of (z, x, y) positions
+        self.trace = trace  # List of (z, x, y) positions, None unless tracing
+        self.parent = parent  # The particle this was created from, only kept when tracing
+        self.weight = weight  # Statistical weight of the particle, scaling its ionisation
+
+    def record(self):
+        '''Record the current position in the trace of the particle.'''
+        if self.trace is None:
+            self.trace = []
+        self.trace.append((self.z, self.x, self.y))
+
+    def history(self):
+        '''Return the list of (z, x, y) positions recorded for the particle, preceded by
+        those recorded for the chain of particles it was created from.'''
+        traces = []
+        particle = self
+        while particle is not None:
+            if particle.trace:
+                traces.append(particle.trace)
+            particle = particle.parent
+        return [position for trace in reversed(traces) for position in trace]
 
     def move(self, step):
         '''Move the particle forward by step, updating transverse position based on angle'''
-        # Record current position before moving
-        self.trace.append((self.z, self.x, self.y))
-
         # Update transverse positions based on angles
         self.x += step * self.angle_x
         self.y += step * self.angle_y
@@ -27,9 +67,10 @@ class Particle:
         # Move forward in z
         self.z += step
 
-    def interact(self):
-        '''This should implement the model for interaction.
-        The base class particle doesn't interact at all'''
+    def interact(self, rng=random, cutoff=None):
+        '''This should implement the model for interaction, drawing random numbers
+        from rng. A cutoff given overrides that of the particle, as where the
+        production cuts are set per layer. The base class particle doesn't interact at all'''
         return [self]
 
     def __str__(self):
@@ -37,52 +78,67 @@ class Particle:
 
 
 class Electron(Particle):
+    __slots__ = ()
 
-    def __init__(self, z, energy, x=0, y=0, angle_x=0, angle_y=0, trace=None):
-        super(Electron, self).__init__('elec', z, energy, True, 0.01, x, y, angle_x, angle_y, trace)
+    def __init__(self, z, energy, x=0, y=0, angle_x=0, angle_y=0, trace=None, parent=None, weight=1.0):
+        super(Electron, self).__init__('elec', z, energy, True, DEFAULT_CUTS['elec'], x, y, angle_x, angle_y,
+                                       trace, parent, weight)
 
-    def interact(self):
+    def interact(self, rng=random, cutoff=None):
         '''An electron radiates a photon. Make the energy split evenly.
         New particles are created with a small random scattering angle.'''
         particles = []
-        if self.energy > self.cutoff:
-            split = random.random()
+        if self.energy > (self.cutoff if cutoff is None else cutoff):
+            split = rng.random()
             # Small scattering angles (in radians) - approximately 1-10 degrees
             angle_sigma = 0.02  # Standard deviation of scattering angle
-            new_angle_x = self.angle_x + random.gauss(0, angle_sigma)
-            new_angle_y = self.angle_y + random.gauss(0, angle_sigma)
+            new_angle_x = self.angle_x + rng.gauss(0, angle_sigma)
+            new_angle_y = self.angle_y + rng.gauss(0, angle_sigma)
+            # Only link to the parent when traced, so untraced showers hold no history
+            parent = self if self.trace is not None else None
 
             particles = [
-                Electron(self.z, split*self.energy, self.x, self.y, new_angle_x, new_angle_y, self.trace.copy()),
-                Photon(self.z, (1.0-split)*self.energy, self.x, self.y, new_angle_x, new_angle_y, self.trace.copy())
+                Electron(self.z, split*self.energy, self.x, self.y, new_angle_x, new_angle_y, parent=parent,
+                         weight=self.weight),
+                Photon(self.z, (1.0-split)*self.energy, self.x, self.y, new_angle_x, new_angle_y, parent=parent,
+                         weight=self.weight)
             ]
         return particles
 
 
 class Photon(Particle):
+    __slots__ = ()
 
-    def __init__(self, z, energy, x=0, y=0, angle_x=0, angle_y=0, trace=None):
-        super(Photon, self).__init__('phot', z, energy, False, 0.01, x, y, angle_x, angle_y, trace)
+    def __init__(self, z, energy, x=0, y=0, angle_x=0, angle_y=0, trace=None, parent=None, weight=1.0):
+        super(Photon, self).__init__('phot', z, energy, False, DEFAULT_CUTS['phot'], x, y, angle_x, angle_y,
+                                     trace, parent, weight)
 
-    def interact(self):
+    def interact(self, rng=random, cutoff=None):
         '''A photon splits into an electron and a positron. Make the energy split evenly.
         New particles are created with a small random scattering angle.'''
         particles = []
-        if self.energy > self.cutoff:
-            split = random.random()
+        if self.energy > (self.cutoff if cutoff is None else cutoff):
+            split = rng.random()
             # Small scattering angles (in radians) - approximately 1-10 degrees
             angle_sigma = 0.05  # Standard deviation of scattering angle
-            new_angle_x = self.angle_x + random.gauss(0, angle_sigma)
-            new_angle_y = self.angle_y + random.gauss(0, angle_sigma)
+            new_angle_x = self.angle_x + rng.gauss(0, angle_sigma)
+            new_angle_y = self.angle_y + rng.gauss(0, angle_sigma)
+            # Only link to the parent when traced, so untraced showers hold no history
+            parent = self if self.trace is not None else None
 
             particles = [
-                Electron(self.z, split*self.energy, self.x, self.y, new_angle_x, new_angle_y, self.trace.copy()),
-                Electron(self.z, (1.0-split)*self.energy, self.x, self.y, new_angle_x, new_angle_y, self.trace.copy())
+                Electron(self.z, split*self.energy, self.x, self.y, new_angle_x, new_angle_y, parent=parent,
+                         weight=self.weight),
+                Electron(self.z, (1.0-split)*self.energy, self.x, self.y, new_angle_x, new_angle_y, parent=parent,
+                         weight=self.weight)
             ]
         return particles
 
 
 class Muon(Particle):
+    __slots__ = ()
+    interacts = False
 
-    def __init__(self, z, energy, x=0, y=0, angle_x=0, angle_y=0, trace=None):
-        super(Muon, self).__init__('muon', z, energy, True, 0.01, x, y, angle_x, angle_y, trace)
+    def __init__(self, z, energy, x=0, y=0, angle_x=0, angle_y=0, trace=None, parent=None, weight=1.0):
+        super(Muon, self).__init__('muon', z, energy, True, DEFAULT_CUTS['muon'], x, y, angle_x, angle_y,
+                                   trace, parent, weight)
@@ -0,0 +1,46 @@
+import numpy as np
+
+
+def event_generator(seed, event):
+    '''Return the numpy Generator for an event of a run. The stream is the child that
+    SeedSequence(seed).spawn would give for the event index, so it only depends on the
+    run seed and the index of the event, not on which process or machine simulates it.'''
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(event,)))
+
+
+def new_seed():
+    '''Return a fresh run seed from the operating system entropy.'''
+    return np.random.SeedSequence().entropy
+
+
+class RandomStream:
+    '''A source of random numbers drawing from a numpy Generator, with the same
+    interface as the stdlib random module for the calls the physics uses. Either can
+    be passed as the rng of Layer, Particle and Calorimeter methods.
+
+    Calling into numpy for every single number is slower than the stdlib, so the
+    uniform, normal and exponential numbers are drawn in blocks of block numbers and
+    handed out one by one from a list. The numbers handed out only depend on the
+    generator and the block size.'''
+
+    def __init__(self, generator, block=4096):
+        self.generator = generator
+        self.block = block
+        self._uniforms = []
+        self._normals = []
+        self._exponentials = []
+
+    def random(self):
+        if not self._uniforms:
+            self._uniforms = self.generator.random(self.block).tolist()
+        return self._uniforms.pop()
+
+    def gauss(self, mu, sigma):
+        if not self._normals:
+            self._normals = self.generator.standard_normal(self.block).tolist()
+        return mu + sigma*self._normals.pop()
+
+    def expovariate(self, lambd):
+        if not self._exponentials:
+            self._exponentials = self.generator.standard_exponential(self.block).tolist()
+        return self._exponentials.pop()/lambd
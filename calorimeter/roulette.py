@@ -0,0 +1,29 @@
+import random
+
+
+class RussianRoulette:
+    '''Variance reduction by Russian roulette. An electron or photon created below
+    threshold by the interaction of a particle above it is killed with probability
+    1 - survival, and if it survives its weight is divided by survival, so the mean
+    ionisation is unchanged. Particles are only played once, when their lineage
+    crosses the threshold, so the weights stay bounded by 1/survival. Far fewer
+    particles are followed, at the price of larger fluctuations of each event.'''
+
+    def __init__(self, threshold, survival):
+        if threshold <= 0:
+            raise ValueError(f"The roulette threshold has to be positive, not {threshold}")
+        if not 0 < survival <= 1:
+            raise ValueError(f"The survival probability has to be between 0 and 1, not {survival}")
+        self.threshold = threshold
+        self.survival = survival
+
+    def play(self, parent, particle, rng=random):
+        '''Return False if particle, created in an interaction of parent, is killed,
+        otherwise True with the weight of the particle adjusted if it was played.
+        Random numbers are drawn from rng.'''
+        if particle.energy >= self.threshold or parent.energy < self.threshold:
+            return True
+        if rng.random() < self.survival:
+            particle.weight /= self.survival
+            return True
+        return False
@@ -1,69 +1,878 @@
 import copy
+import ctypes
+import functools
+import itertools
+import os
+import queue
+import random
+import time
+import weakref
 import numpy as np
-from collections import deque
-from multiprocessing import Pool
+from collections import deque, namedtuple
+from multiprocessing.pool import Pool
+from multiprocessing import shared_memory
 import multiprocessing as mp
+from .vectorised import simulate_shower, simulate_batch, TYPE_CODES
+from .tracestore import TraceStore, trace_segments
+from .rng import RandomStream, event_generator, new_seed
+from .budget import EnergyBudget
+from .sparse import SparseSample
+from .dataset import ResultDataset
+from .accumulate import LayerStatistics
 
 
-def _run_single_simulation_indexed(args):
+def _run_single_simulation_indexed(args, rng=random, traversal='breadth', max_stack=None, stats=None, policy=None):
     '''Helper function for parallel simulation that preserves particle order.
-    Takes a tuple of (calorimeter, particle, step_size, index) and returns (ionisations, index).'''
+    Takes a tuple of (calorimeter, particle, step_size, index) and returns (ionisations, index).
+    A step_size of None selects event driven transport. Random numbers are drawn from rng.
+    The shower is traversed breadth or depth first, see _take, and MemoryError is raised
+    if more than max_stack particles wait on the stack. If stats is a dictionary, the
+    largest number of particles that waited on the stack is stored in it as 'peak_stack'.
+    If policy is a _ShowerPolicy, it decides which of the particles created in every
+    interaction are followed and when the shower is stopped, and adds its counts to
+    stats.'''
     calorimeter, particle, step_size, index = args
 
     calorimeter.reset()
-    particles = deque([copy.copy(particle)])
+    particles = deque()
+    # Particles behind the last active layer are dropped, also when traced, so tracing
+    # does not change the random numbers drawn
+    end = calorimeter.geometry().reach
+    if policy is None or policy.start(calorimeter, particle, end, rng):
+        particles.append(copy.copy(particle))
+    peak = _follow(calorimeter, particles, step_size, rng, _take(particles, traversal), end, max_stack, policy)
+
+    if policy is not None:
+        policy.finish(particles, stats)
+    if stats is not None:
+        stats['peak_stack'] = peak
+    return (calorimeter.ionisations(), index)
+
 
+def _follow(calorimeter, particles, step_size, rng, take, end, max_stack=None, policy=None):
+    '''Follow the particles on the stack, taking the next one with take, until the
+    stack is empty or the policy stops the shower. Particles that reach z=end are
+    dropped, with their trace recorded when tracing. Return the peak number of
+    particles on the stack.'''
+    peak = len(particles)
     while particles:
-        p = particles.popleft()
-        newparticles = calorimeter.step(p, step_size)
-        # Only add particles that are still in the calorimeter
+        p = take()
+        newparticles = calorimeter.propagate(p, step_size, rng, straight=True)
+        if newparticles is None:
+            # The particle has only moved on
+            if p.z < end:
+                particles.append(p)
+                continue
+            calorimeter.record_trace(p)
+            newparticles = ()
+        if policy is not None:
+            newparticles = policy.daughters(p, newparticles, rng)
+        # Only add particles that can still reach an active layer
         for np_p in newparticles:
-            if np_p.z < calorimeter._zend:
+            if np_p.z < end:
                 particles.append(np_p)
-            elif calorimeter._trace_enabled:
+            else:
                 # Record trace when particle exits calorimeter
                 calorimeter.record_trace(np_p)
+        if len(particles) > peak:
+            peak = _grown(particles, max_stack)
+        if policy is not None and policy.pending <= policy.limit:
+            break
+    return peak
+
+
+class _ShowerPolicy:
+    '''The options of the python engine that change which particles of a shower are
+    followed, built once per worker. If subshowers is a fastsim.SubShowerLibrary,
+    particles below its threshold are replaced by a deposit pattern from the library
+    rather than followed. If budget is a budget.EnergyBudget, the shower is stopped
+    once the energy of the particles on the stack, counted with their weights, has
+    dropped to its fraction of the energy of the event, and their expected ionisation
+    is added instead. If roulette is a roulette.RussianRoulette, it is played on the
+    particles created in every interaction. The counts of the event being simulated
+    are kept from start to finish.'''
+
+    def __init__(self, subshowers=None, budget=None, roulette=None):
+        self.subshowers = subshowers
+        self.budget = budget
+        self.roulette = roulette
+
+    def start(self, calorimeter, particle, end, rng):
+        '''Start the event of the incoming particle, in which particles are followed up
+        to z=end. Return False if the particle was replaced by a sub-shower.'''
+        self._calorimeter = calorimeter
+        self._particle = particle
+        self._end = end
+        self.killed = self.weighted = 0
+        # The energy of the particles on the stack and at which the shower is stopped
+        self.pending = 0.0
+        self.limit = -np.inf if self.budget is None else self.budget.limit(particle)
+        if self.subshowers is not None and self.subshowers.absorb(calorimeter, particle, rng):
+            return False
+        self.pending = particle.weight*particle.energy
+        return True
+
+    def daughters(self, parent, particles, rng):
+        '''Return those of the particles created by parent that are followed, after the
+        roulette was played on them and the sub-showers of the others deposited.'''
+        self.pending -= parent.weight*parent.energy
+        roulette = self.roulette
+        followed = []
+        for p in particles:
+            if roulette is not None and parent.energy >= roulette.threshold > p.energy:
+                if not roulette.play(parent, p, rng):
+                    self.killed += 1
+                    continue
+                self.weighted += 1
+            if self.subshowers is not None and self.subshowers.absorb(self._calorimeter, p, rng):
+                continue
+            if p.z < self._end:
+                self.pending += p.weight*p.energy
+            followed.append(p)
+        return followed
+
+    def finish(self, particles, stats=None):
+        '''End the event, adding the expected ionisation of the particles left on the
+        stack. If stats is a dictionary, the ionisation added is stored in it as
+        'residual' and the fraction of the energy that was left as 'truncated' with an
+        energy budget, and the numbers of particles the roulette killed and kept with a
+        larger weight as 'killed' and 'weighted'.'''
+        if self.budget is not None:
+            residual = self.budget.residual(self._calorimeter, particles)
+            if stats is not None:
+                stats['residual'] = residual
+                energy = self._particle.weight*self._particle.energy
+                stats['truncated'] = max(self.pending, 0.0)/energy if self.limit > 0 else 0.0
+        if stats is not None and self.roulette is not None:
+            stats['killed'] = self.killed
+            stats['weighted'] = self.weighted
+
+
+def _take(particles, traversal):
+    '''Return the function taking the next particle from the deque of waiting
+    particles. With 'breadth' the oldest particle is taken, so a whole generation of
+    the shower is held at once. With 'depth' the newest is taken, so the stack only
+    grows with the depth of the shower.'''
+    return particles.pop if traversal == 'depth' else particles.popleft
+
+
+def _grown(particles, max_stack):
+    '''Return the new peak size of the stack of waiting particles, raising
+    MemoryError if it holds more than max_stack particles.'''
+    if max_stack is not None and len(particles) > max_stack:
+        raise MemoryError(f"Shower stack of {len(particles)} particles exceeds max_stack={max_stack}")
+    return len(particles)
+
+
+def _trace_shower(calorimeter, particle, step_size, rng=random, traversal='breadth', max_stack=None):
+    '''Simulate the shower of a particle in a calorimeter with tracing enabled and
+    return the list of all final particles, those that were absorbed as well as
+    those that reached the back of the last active layer, where they are dropped as
+    in an untraced shower.'''
+    end = calorimeter.geometry().reach
+    particles = deque([copy.copy(particle)])
+    take = _take(particles, traversal)
+    all_particles = []
+
+    while particles:
+        p = take()
+        newparticles = calorimeter.propagate(p, step_size, rng, straight=True)
+        if newparticles is None:
+            newparticles = (p,)
+
+        # If no new particles created (energy below cutoff), record the current particle
+        if not newparticles:
+            all_particles.append(p)
+        else:
+            # Add all returned particles back to queue if still in calorimeter
+            for np_p in newparticles:
+                if np_p.z < end:
+                    particles.append(np_p)
+                else:
+                    # Record particles that exit the calorimeter
+                    all_particles.append(np_p)
+            _grown(particles, max_stack)
+
+    return all_particles
+
+
+def _run_traced_simulation_indexed(args, rng=random, traversal='breadth', max_stack=None):
+    '''Same as _run_single_simulation_indexed, but with tracing enabled. Returns
+    (ionisations, index, segments) where segments are the columns of the trace
+    segments of the event, ready to be added to a TraceStore.'''
+    calorimeter, particle, step_size, index = args
+
+    calorimeter.enable_tracing()
+    calorimeter.reset()
+    try:
+        all_particles = _trace_shower(calorimeter, particle, step_size, rng, traversal, max_stack)
+    finally:
+        calorimeter.disable_tracing()
+    return (calorimeter.ionisations(), index, trace_segments(all_particles, index))
+
+
+def _run_vectorised_simulation_indexed(args, rng=None):
+    '''Same as _run_single_simulation_indexed, but with the shower simulated by the
+    vectorised engine where all shower particles are held in arrays. Random numbers
+    are drawn from the numpy Generator rng.'''
+    calorimeter, particle, step_size, index = args
+
+    geometry = calorimeter.geometry()
+    deposits = simulate_shower(geometry, particle, step_size, rng)
+    return (deposits[geometry.active_index], index)
+
+
+def _run_batch_simulation_indexed(args, rng=None):
+    '''Helper function for the batch engine. Takes a tuple of (geometry, particles,
+    step_size, index) where particles is a chunk of the sample starting at index, and
+    returns (ionisations, index) with one row of ionisations per particle in the chunk.'''
+    geometry, particles, step_size, index = args
+
+    deposits = simulate_batch(geometry, particles, step_size, rng)
+    return (deposits[:, geometry.active_index], index)
+
+
+# State of a worker process, set once by _init_worker when the worker starts. Tasks
+# run in this process are given a state of their own as worker instead.
+_worker = {}
+
+
+def _init_worker(calorimeter, engine, step_size, traversal='breadth', max_stack=None, library=None,
+                 subshowers=None, budget=None, roulette=None, worker=None):
+    '''Initializer of the worker processes. The calorimeter is shipped to each worker
+    once here, so tasks only have to carry the particles and their index. A
+    sub-shower library loaded from disk is shipped as its path and memory-mapped. The
+    energy budget is set up from its fraction for the geometry of the calorimeter, and
+    with the sub-showers and roulette makes up the _ShowerPolicy of the python engine.
+    The state is set in the dictionary worker if given, otherwise in that of the
+    process.'''
+    worker = _worker if worker is None else worker
+    worker['calorimeter'] = calorimeter
+    worker['engine'] = engine
+    worker['step_size'] = step_size
+    worker['traversal'] = traversal
+    worker['max_stack'] = max_stack
+    worker['library'] = library
+    worker['policy'] = None
+    if subshowers is not None or budget is not None or roulette is not None:
+        worker['policy'] = _ShowerPolicy(subshowers, None if budget is None else
+                                         EnergyBudget(calorimeter.geometry(), budget), roulette)
+    return worker
+
+
+def _simulate_task(task, out=None, worker=None):
+    '''Simulate a (particles, start, seed, deadcellfraction) task in a worker with the
+    engine it was initialised with, where particles is a chunk of the sample starting
+    at index start. Every event draws from its own random stream given by the run seed
+    and its index, which also decides its dead cells. Returns (start, ionisations, info)
+    with one row of ionisations per particle and info a dictionary of per event arrays.
+    The python engine adds the peak number of particles on the stack as 'peak_stack',
+    and with an energy budget the ionisation added for the stopped showers as
+    'residual' and the fraction of their energy that was left as 'truncated',
+    and with Russian roulette the numbers of particles killed and kept with a larger
+    weight as 'killed' and 'weighted'.
+
+    The batch and fast engines simulate the chunk in one go from a stream given by the
+    index of its first event, so their results also depend on the chunk size. The fast
+    engine raises ValueError for particles the library is not for. If out
+    is given, the ionisations are written into it and it is returned in their place.
+    The state of the worker is that of the process unless given as worker.'''
+    particles, start, seed, deadcellfraction = task
+    worker = _worker if worker is None else worker
+    calorimeter, step_size = worker['calorimeter'], worker['step_size']
+    if worker['engine'] in ('batch', 'fast'):
+        generator = event_generator(seed, start)
+        if worker['engine'] == 'fast':
+            worker['library'].check_particles(particles)
+            ionisations = worker['library'].sample(_energies(particles), generator)
+            types = _types(particles, worker['library'].particle)
+        else:
+            types = _types(particles)
+            ionisations, _ = _run_batch_simulation_indexed((calorimeter.geometry(), particles, step_size, start),
+                                                           generator)
+        ionisations[generator.random(ionisations.shape) < deadcellfraction] = 0
+        if out is not None:
+            out[...] = ionisations
+            ionisations = out
+        return (start, ionisations, {'energy': _energies(particles), 'type': types})
+
+    if out is None:
+        out = np.empty((len(particles), len(calorimeter.geometry().active_index)))
+    peaks = []
+    residuals = []
+    truncated = []
+    played = []
+    for i, p in enumerate(particles):
+        generator = event_generator(seed, start + i)
+        if worker['engine'] == 'vector':
+            row, _ = _run_vectorised_simulation_indexed((calorimeter, p, step_size, start + i), generator)
+        else:
+            stats = {}
+            row, _ = _run_single_simulation_indexed((calorimeter, p, step_size, start + i), RandomStream(generator),
+                                                    worker['traversal'], worker['max_stack'], stats,
+                                                    worker['policy'])
+            peaks.append(stats['peak_stack'])
+            residuals.append(stats.get('residual', 0.0))
+            truncated.append(stats.get('truncated', 0.0))
+            played.append((stats.get('killed', 0), stats.get('weighted', 0)))
+        row[generator.random(row.shape) < deadcellfraction] = 0
+        out[i] = row
+    info = {'energy': _energies(particles), 'type': _types(particles)}
+    policy = worker['policy']
+    if worker['engine'] == 'python':
+        info['peak_stack'] = np.array(peaks, dtype=np.int64)
+        if policy is not None and policy.budget is not None:
+            info['residual'] = np.array(residuals, dtype=float)
+            info['truncated'] = np.array(truncated, dtype=float)
+        if policy is not None and policy.roulette is not None:
+            info['killed'], info['weighted'] = np.array(played, dtype=np.int64).reshape(-1, 2).T
+    return (start, out, info)
+
+
+def _simulate_shared_task(task, worker=None):
+    '''Simulate a (particles, start, seed, deadcellfraction, name, shape, first_event)
+    task as _simulate_task, writing the ionisations in place into the rows from
+    start - first_event of the (events x active layers) array of shape in the shared
+    memory block called name. Only (start, info) is sent back.'''
+    particles, start, seed, deadcellfraction, name, shape, first_event = task
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        ionisations = np.ndarray(shape, buffer=block.buf)
+        row = start - first_event
+        _, _, info = _simulate_task((particles, start, seed, deadcellfraction),
+                                    ionisations[row:row + len(particles)], worker)
+        del ionisations
+    finally:
+        block.close()
+    return (start, info)
+
+
+def _sparse_task(function, task, worker=None):
+    '''Run function on the task in a worker and return its ionisations as a
+    SparseSample, so only the non-zero entries are sent back.'''
+    start, ionisations, info = function(task, worker=worker)
+    return (start, SparseSample.from_dense(ionisations), info)
+
+
+def _statistics_task(edges, task, worker=None):
+    '''Simulate a task in a worker and return its events folded into LayerStatistics
+    with the histogram edges, in place of the ionisations and info.'''
+    start, ionisations, _ = _simulate_task(task, worker=worker)
+    statistics = LayerStatistics(ionisations.shape[1], edges)
+    statistics.add(ionisations)
+    return (start, statistics)
+
+
+def _in_order(pool, function, tasks, window):
+    '''Apply function to the tasks in the pool with at most window of them in flight,
+    and yield the results in the order of the tasks.'''
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(function, (task,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
 
-    return (calorimeter.ionisations(), index)
+
+def _as_completed(pool, function, tasks, window):
+    '''Apply function to the tasks in the pool with at most window of them in flight,
+    and yield the results as they complete.'''
+    done = queue.Queue()
+    inflight = 0
+    for task in itertools.chain(tasks, [None]):
+        if task is not None:
+            pool.apply_async(function, (task,), callback=done.put, error_callback=done.put)
+            inflight += 1
+            if inflight < window:
+                continue
+        while inflight >= (window if task is not None else 1):
+            result = done.get()
+            inflight -= 1
+            if isinstance(result, BaseException):
+                raise result
+            yield result
+
+
+class _SharedBlock:
+    '''A shared memory block holding a float array of the given shape, which worker
+    processes can attach to by name. An array made with np.asarray(block) keeps the
+    block mapped for as long as it lives, without holding a buffer of it, so the
+    block is closed once the block and all such arrays are gone. The name is removed
+    with unlink, after which no process can attach to it any more.'''
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self._memory = shared_memory.SharedMemory(create=True, size=max(8*int(np.prod(self.shape)), 1))
+        self.name = self._memory.name
+        view = ctypes.c_char.from_buffer(self._memory.buf)
+        self.__array_interface__ = {'shape': self.shape, 'typestr': np.dtype(float).str,
+                                    'data': (ctypes.addressof(view), False), 'version': 3}
+        del view
+
+    def unlink(self):
+        self._memory.unlink()
+
+    def __del__(self):
+        self._memory.close()
+
+
+def _trace_task(store, task, worker=None):
+    '''Simulate a (particles, start, seed, deadcellfraction) task in a worker with
+    tracing enabled. The trace segments of the events are added to a TraceStore with
+    the (max_segments, sampling) of store, which is returned in the info under
+    'traces', so no more than max_segments segments are sent back.'''
+    particles, start, seed, deadcellfraction = task
+    worker = _worker if worker is None else worker
+    calorimeter, step_size = worker['calorimeter'], worker['step_size']
+    max_segments, sampling = store
+    # The reservoir of the task draws from a stream of its own
+    traces = TraceStore(max_segments, sampling, np.random.SeedSequence(seed, spawn_key=(start, 0)))
+    rows = []
+    for i, p in enumerate(particles):
+        generator = event_generator(seed, start + i)
+        row, _, event_segments = _run_traced_simulation_indexed((calorimeter, p, step_size, start + i),
+                                                                RandomStream(generator), worker['traversal'],
+                                                                worker['max_stack'])
+        row[generator.random(row.shape) < deadcellfraction] = 0
+        rows.append(row)
+        traces.add_event(event_segments)
+    return (start, _stack(rows, calorimeter), {'energy': _energies(particles), 'type': _types(particles),
+                                               'traces': traces})
+
+
+def _stack(rows, calorimeter):
+    '''Stack the ionisations of a list of events, which may be empty.'''
+    if not rows:
+        return np.zeros((0, len(calorimeter.geometry().active_index)))
+    return np.stack(rows, axis=0)
+
+
+def _energies(particles):
+    '''The incident energy of a chunk given as particles or as plain energies.'''
+    if len(particles) and hasattr(particles[0], 'energy'):
+        return np.array([p.energy for p in particles], dtype=float)
+    return np.asarray(particles, dtype=float)
+
+
+def _types(particles, default='elec'):
+    '''The type codes of the incident particles of a chunk, see vectorised.TYPE_CODES,
+    where plain energies are particles of the default type.'''
+    if len(particles) and hasattr(particles[0], 'type'):
+        return np.array([TYPE_CODES[p.type] for p in particles], dtype=np.int8)
+    return np.full(len(particles), TYPE_CODES[default], dtype=np.int8)
+
+
+def _chunks(particles, chunksize, first_event=0):
+    '''Split the particles, a sequence or any iterable, into (chunk, start) pairs
+    without materialising more than one chunk of an iterable at a time. The events
+    are numbered from first_event.'''
+    if hasattr(particles, '__len__') and hasattr(particles, '__getitem__'):
+        for start in range(0, len(particles), chunksize):
+            yield (particles[start:start + chunksize], first_event + start)
+        return
+    iterator = iter(particles)
+    start = first_event
+    while True:
+        chunk = list(itertools.islice(iterator, chunksize))
+        if not chunk:
+            return
+        yield (chunk, start)
+        start += len(chunk)
+
+
+# A block of simulated events, the indices of the events in the sample, their
+# ionisations and a dictionary of further per event arrays such as the energy
+SampleBlock = namedtuple('SampleBlock', ['indices', 'ionisations', 'info'])
 
 
 class Simulation:
     '''A simulation is defined by a calorimeter. Then individual simulation runs can be created by
-    running the same particle through the calorimter multiple times.'''
-    def __init__(self, calorimeter):
+    running the same particle through the calorimter multiple times.
+
+    The transport is either 'step', where particles are moved forward by a fixed step
+    and may interact at the end of each step, or 'event', where the distance to the next
+    interaction is sampled and particles move from interaction to layer boundary in a
+    single go. The event driven transport needs far fewer iterations per particle and
+    handles layers thinner than the step correctly.
+
+    The engine is either 'python', where each shower particle is a Particle object
+    stepped through the Calorimeter, or 'vector', where the whole particle stack of a
+    shower is kept in arrays and advanced together, or 'batch', where the showers of
+    up to batch_size incoming particles share one set of arrays, or 'fast', where no
+    showers are simulated but the ionisations are drawn from the parameterised
+    response in library, a fastsim.ShowerLibrary built for the same geometry. The
+    fast engine runs in the calling process, as it only takes microseconds per event.
+    Tracing is only available with the python engine.
+
+    With the python engine the particles waiting to be simulated are kept on a stack,
+    which is processed breadth first with traversal='breadth', holding a whole
+    generation of the shower at once, or depth first with traversal='depth', where the
+    stack only grows with the depth of the shower. The peak size of the stack of every
+    event is reported in the info of the sample blocks as 'peak_stack'. If max_stack
+    is given, a shower raises MemoryError when more particles are waiting than that.
+    If subshowers is a fastsim.SubShowerLibrary built for the layer pattern, the python
+    engine with event driven transport stops following electrons and photons below
+    its threshold and deposits a pattern drawn from the library instead. With an
+    energy budget, a fraction between 0 and 1, the python engine stops a shower once
+    the particles still waiting hold less than that fraction of the energy of the
+    event, and adds the expected ionisation of their showers instead, see
+    budget.EnergyBudget. The ionisation added and the fraction of the energy left are
+    reported per event in the info as 'residual' and 'truncated'. If roulette is a
+    roulette.RussianRoulette, the python engine kills most of the low energy particles
+    and gives the survivors a larger weight. The mean ionisations are unchanged, but
+    the fluctuations of each event grow, and the events are not rescaled, so the
+    spread of a sample shows them. The numbers of particles killed and weighted are
+    reported per event in the info as 'killed' and 'weighted'. Tracing always
+    follows the full shower.
+
+    The production cuts of the calorimeter and its layers, the energy below which an
+    electron or photon is absorbed rather than split, are overridden by cuts, a
+    dictionary of the cut by particle type. The simulation then runs on its own copy
+    of the calorimeter with the cuts set, which does not follow layers added later to
+    the calorimeter given. Lower cuts follow the showers further at a steeply rising
+    cost.
+
+    With raw=True the simulation records the charged path length in every layer,
+    passive or active, rather than the ionisations, by running on a copy of the
+    calorimeter where every layer has a response of one, see Calorimeter.raw. The
+    samples then have a column for every layer, and a digitise.Digitiser turns them
+    into ionisations for any response, dead cells, noise, threshold and gain, so dead
+    cells are not applied in the simulation. The showers are followed up to the last
+    active layer as without raw, so digitising with the responses of the calorimeter
+    gives the ionisations of the same run, and layers behind it stay empty.
+
+    If cache is a cache.ResultCache, simulate_sample returns the stored ionisations of
+    a run that has been simulated before with the same layers, particles, settings and
+    seed, and stores those of new runs. Runs without a seed, with tracing or with
+    sparse output are not cached.
+
+    The sample is spread over processes worker processes, all available cores if None.
+    With processes=0 everything runs in the calling process. The pool of workers is
+    started on first use with the given multiprocessing start_method ('fork', 'spawn'
+    or 'forkserver', the platform default if None) and kept for later calls. Each worker
+    receives the calorimeter once when it starts. Release the workers with close(), or
+    use the simulation as a context manager. Otherwise they are terminated once the
+    simulation is garbage collected. The pool is restarted if layers have been
+    added to the calorimeter since it was started.'''
+
+    transports = ('step', 'event')
+    engines = ('python', 'vector', 'batch', 'fast')
+    traversals = ('breadth', 'depth')
+
+    def __init__(self, calorimeter, transport='step', step=0.1, engine='python', batch_size=1000, processes=None,
+                 start_method=None, traversal='breadth', max_stack=None, library=None, subshowers=None,
+                 budget=None, cuts=None, roulette=None, raw=False, cache=None):
+        if cuts is not None:
+            calorimeter = calorimeter.with_cuts(cuts)
+        if raw:
+            calorimeter = calorimeter.raw()
+        if transport not in self.transports:
+            raise ValueError(f"Unknown transport '{transport}', use one of {self.transports}")
+        if engine not in self.engines:
+            raise ValueError(f"Unknown engine '{engine}', use one of {self.engines}")
+        if traversal not in self.traversals:
+            raise ValueError(f"Unknown traversal '{traversal}', use one of {self.traversals}")
+        self._check_engine_options(calorimeter, engine, library, subshowers, budget, roulette)
         self._calorimeter = calorimeter
+        self._engine = engine
+        self._transport = transport
+        self._step = step if transport == 'step' else None
+        self._batch_size = batch_size
+        self._processes = processes
+        self._start_method = start_method
+        self._traversal = traversal
+        self._max_stack = max_stack
+        self._library = library
+        self._subshowers = subshowers
+        self._budget = budget
+        self._roulette = roulette
+        self._raw = raw
+        self._cache = cache
+        if subshowers is not None:
+            subshowers.check(self)
+        self._pool = None
+        self._pool_geometry = None
+        self._pool_finalizer = None
+        self.last_seed = None
+
+    @staticmethod
+    def _check_engine_options(calorimeter, engine, library, subshowers, budget, roulette):
+        '''Raise ValueError if the library, sub-shower library, energy budget or
+        roulette cannot be used with the engine on the calorimeter.'''
+        if engine == 'fast':
+            if library is None:
+                raise ValueError("The fast engine needs a shower library")
+            if library.fingerprint != calorimeter.geometry().fingerprint():
+                raise ValueError("The shower library was built for a different geometry")
+        if subshowers is not None and engine != 'python':
+            raise ValueError("Sub-shower libraries are only available with the python engine")
+        if budget is not None:
+            if engine != 'python':
+                raise ValueError("The energy budget is only available with the python engine")
+            # Raises ValueError for a fraction or production cuts the budget cannot handle
+            EnergyBudget(calorimeter.geometry(), budget)
+        if roulette is not None and engine != 'python':
+            raise ValueError("Russian roulette is only available with the python engine")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        '''Shut down the worker processes. A later simulation starts new ones.'''
+        if self._pool is not None:
+            self._pool_finalizer.detach()
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+            self._pool_geometry = None
+
+    def _get_pool(self):
+        '''Return the worker pool, starting it if needed.'''
+        geometry = self._calorimeter.geometry()
+        if self._pool_geometry is not geometry:
+            self.close()
+        if self._pool is None:
+            # Use all available CPU cores for parallel simulation unless told otherwise
+            num_cores = self._processes or mp.cpu_count()
+            self._pool = Pool(num_cores, _init_worker, (self._calorimeter, self._engine, self._step, self._traversal,
+                                                        self._max_stack, self._library, self._subshowers,
+                                                        self._budget, self._roulette),
+                              context=mp.get_context(self._start_method))
+            self._pool_geometry = geometry
+            # A simulation dropped without close() terminates its workers
+            self._pool_finalizer = weakref.finalize(self, self._pool.terminate)
+        return self._pool
+
+    def _dispatch(self, function, tasks, ordered=True):
+        '''Apply function to the tasks in the worker pool, or in this process if
+        processes=0 or with the fast engine, and yield the results as they complete. Only
+        a few tasks per worker are in flight at any time, so neither the tasks nor the
+        results pile up. Tasks run in this process have a worker state of their own, so
+        several samples can be iterated at the same time.'''
+        if self._processes == 0 or self._engine == 'fast':
+            worker = _init_worker(copy.deepcopy(self._calorimeter), self._engine, self._step, self._traversal,
+                                  self._max_stack, self._library, self._subshowers, self._budget, self._roulette, {})
+            function = functools.partial(function, worker=worker)
+            for task in tasks:
+                yield function(task)
+            return
+
+        window = 2*(self._processes or mp.cpu_count())
+        yield from (_in_order if ordered else _as_completed)(self._get_pool(), function, tasks, window)
+
+    def _check_raw(self, deadcellfraction):
+        '''Raise ValueError for dead cells in a simulation of raw path lengths.'''
+        if self._raw and deadcellfraction:
+            raise ValueError("Dead cells of raw path lengths are applied by the Digitiser")
+
+    def _chunksize(self):
+        '''The default number of events per task.'''
+        return self._batch_size if self._engine in ('batch', 'fast') else 16
+
+    def iter_sample(self, particles, chunksize=None, ordered=True, deadcellfraction=0.0, progress=None,
+                    traces=None, seed=None, first_event=0, sparse=False):
+        '''Simulate the particles, a sequence or any iterable of particles (or of energies
+        with the batch and fast engines), and yield the results as a stream of
+        SampleBlock tuples (indices, ionisations, info) with one block per chunk of
+        chunksize events.
+
+        With ordered=True the blocks follow the order of the particles, otherwise they
+        are yielded as soon as they complete and the indices tell which events they hold.
+        The dead cell masking is applied to each block. If given, progress is called
+        after each block as progress(events, total, rate) with the number of events done,
+        the total number of events (None if unknown) and the rate in events/s. Only a
+        few chunks per worker are in flight at once, so arbitrarily long samples can be
+        processed in constant memory.
+
+        If traces is a TraceStore, every event is traced in the workers, which keep a
+        bounded sample of the trace segments of each chunk in a store of the same size
+        and sampling. These are merged into traces, which so keeps a sample of the
+        segments of all events. Tracing requires the python engine.
 
-    def simulate_sample(self, particles, deadcellfraction=0.0):
+        Every event draws its random numbers from its own stream given by the run seed
+        and the index of the event, so the results do not depend on the number of
+        processes or, except for the batch and fast engines, the chunk size. A new run seed is
+        drawn if seed is None; the seed used is kept in last_seed. A sample split over
+        several runs or machines gives the same events as a single run if each part is
+        given the same seed and the index of its first event as first_event, which is
+        also where the yielded indices start.
+
+        With sparse=True the ionisations of each block are a SparseSample, made by the
+        workers, so only the non-zero entries are held and sent back.'''
+        if traces is not None and self._engine != 'python':
+            raise ValueError("Tracing is only available with the python engine")
+        self._check_raw(deadcellfraction)
+        if chunksize is None:
+            chunksize = self._chunksize()
+        total = len(particles) if hasattr(particles, '__len__') else None
+        seed = new_seed() if seed is None else seed
+        self.last_seed = seed
+
+        started = time.perf_counter()
+        events = 0
+        tasks = ((chunk, start, seed, deadcellfraction) for chunk, start in _chunks(particles, chunksize, first_event))
+        function = _simulate_task
+        if traces is not None:
+            function = functools.partial(_trace_task, (traces.max_segments, traces.sampling))
+        if sparse:
+            function = functools.partial(_sparse_task, function)
+        for start, ionisations, info in self._dispatch(function, tasks, ordered):
+            if traces is not None:
+                traces.merge(info.pop('traces'))
+
+            events += len(ionisations)
+            if progress is not None:
+                progress(events, total, events/max(time.perf_counter() - started, 1e-9))
+            yield SampleBlock(np.arange(start, start + len(ionisations)), ionisations, info)
+
+    def simulate_sample(self, particles, deadcellfraction=0.0, traces=None, seed=None, first_event=0, sparse=False):
         '''Run a individual simulation. The ingoing particle is simulated going
         through the calorimeter "number" times. A 2D array is returned with the
         first axis the ionisation in the individual layers and the second corresponding to each
         new particle.
 
         Uses multiprocessing to parallelize individual particle simulations across available CPU cores.
-        Results are ordered to match the input particles array.'''
-        # Prepare arguments for parallel execution with indices to maintain order
-        args_list = [(copy.deepcopy(self._calorimeter), particle, 0.1, i) for i, particle in enumerate(particles)]
+        Results are ordered to match the input particles array. With the batch and fast engines the
+        particles can also be given as an array of electron energies.
+
+        If traces is a TraceStore, every event is traced in the workers and the trace
+        segments of all events are merged into the store, which keeps a bounded sample
+        of them. Tracing requires the python engine. The run is reproduced by giving
+        the same seed, see iter_sample, which is also a streaming version.
+
+        When a sequence of particles is simulated in worker processes without tracing,
+        the result is allocated up front in a shared memory block and the workers write
+        their rows into it in place, so the ionisations are neither sent back through
+        the pool nor stacked. The block is released when the returned array is gone,
+        and its name is removed as soon as the workers are done or have failed.
 
-        # Use all available CPU cores for parallel simulation
-        num_cores = mp.cpu_count()
+        With sparse=True a SparseSample is returned instead, made by the workers from
+        the non-zero ionisations of their events.'''
+        if self._cache is not None and seed is not None and traces is None and not sparse \
+                and hasattr(particles, '__len__'):
+            key = self._cache.key(self, particles, seed, deadcellfraction, first_event)
+            ionisations = self._cache.get(key)
+            if ionisations is None:
+                ionisations = np.array(self._simulate(particles, deadcellfraction, None, seed, first_event, False))
+                self._cache.put(key, ionisations)
+            self.last_seed = seed
+            return ionisations
+        return self._simulate(particles, deadcellfraction, traces, seed, first_event, sparse)
 
-        with Pool(num_cores) as pool:
-            results = pool.map(_run_single_simulation_indexed, args_list)
+    def _simulate(self, particles, deadcellfraction, traces, seed, first_event, sparse):
+        '''simulate_sample without the cache.'''
+        width = len(self._calorimeter.geometry().active_index)
+        if sparse:
+            return SparseSample.concatenate(
+                (block.ionisations for block in
+                 self.iter_sample(particles, deadcellfraction=deadcellfraction, traces=traces, seed=seed,
+                                  first_event=first_event, sparse=True)), width)
+        if traces is None and hasattr(particles, '__len__') and self._processes != 0 and self._engine != 'fast':
+            self._check_raw(deadcellfraction)
+            return self._simulate_shared(particles, deadcellfraction, seed, first_event)
+        blocks = [block.ionisations for block in
+                  self.iter_sample(particles, deadcellfraction=deadcellfraction, traces=traces, seed=seed,
+                                   first_event=first_event)]
+        if not blocks:
+            return np.zeros((0, width))
+        return np.concatenate(blocks, axis=0)
 
-        # Sort results by original index to maintain particle array order
-        results.sort(key=lambda x: x[1])
-        ionisations = [result[0] for result in results]
+    def accumulate(self, particles, edges=None, chunksize=None, deadcellfraction=0.0, progress=None, seed=None,
+                   first_event=0):
+        '''Simulate the particles as iter_sample, but fold the ionisations of every
+        chunk into accumulate.LayerStatistics in the worker and only send those back,
+        so the memory used does not grow with the number of events. Return the
+        statistics of the whole sample: the mean, variance and covariance of the
+        layers, the resolution and, if edges are given, a histogram of the total
+        ionisation with those bin edges. Statistics of runs split with first_event
+        are combined with merge.'''
+        self._check_raw(deadcellfraction)
+        if chunksize is None:
+            chunksize = self._chunksize()
+        total = len(particles) if hasattr(particles, '__len__') else None
+        seed = new_seed() if seed is None else seed
+        self.last_seed = seed
 
-        allionisations = np.stack(ionisations, axis=0)
-        mask = np.random.random(allionisations.shape) < deadcellfraction
-        allionisations[mask] = 0
-        return allionisations
+        started = time.perf_counter()
+        statistics = LayerStatistics(len(self._calorimeter.geometry().active_index), edges)
+        tasks = ((chunk, start, seed, deadcellfraction) for chunk, start in _chunks(particles, chunksize, first_event))
+        for _, part in self._dispatch(functools.partial(_statistics_task, statistics.edges), tasks, ordered=False):
+            statistics.merge(part)
+            if progress is not None:
+                progress(len(statistics), total, len(statistics)/max(time.perf_counter() - started, 1e-9))
+        return statistics
 
-    def simulate_with_tracing(self, particle, deadcellfraction=0.0):
+    def write_sample(self, directory, particles, chunksize=None, deadcellfraction=0.0, progress=None, seed=None,
+                     metadata=None):
+        '''Simulate the particles as iter_sample and append every block to the result
+        dataset in directory as soon as it is done, see dataset.ResultDataset, so the
+        sample never has to fit in memory. The dataset is created with the seed,
+        a new one if None, and the metadata, a dictionary that can be stored as JSON.
+
+        If the directory already holds a dataset, the run is continued: it has to be of
+        the same geometry and settings, its seed is used and the events are numbered on
+        from its last event, so a sample written in several calls is the same as one
+        written in a single call. As the results of the batch and fast engines depend on
+        the chunks, their chunk size is kept in the dataset and a run can only be
+        continued with it after a whole number of chunks, otherwise ValueError is raised.
+        Returns the dataset.'''
+        chunked = self._engine in ('batch', 'fast')
+        if os.path.exists(os.path.join(directory, ResultDataset.manifest_name)):
+            dataset = ResultDataset(directory)
+            dataset.check(self, deadcellfraction)
+            if seed is not None and seed != dataset.seed:
+                raise ValueError(f"The result dataset in {directory} was simulated with the seed {dataset.seed}")
+            if chunked:
+                if chunksize is None:
+                    chunksize = dataset.chunksize
+                if chunksize != dataset.chunksize:
+                    raise ValueError(f"The result dataset in {directory} was simulated in chunks of "
+                                     f"{dataset.chunksize} events, not {chunksize}")
+                if len(dataset) % chunksize:
+                    raise ValueError(f"The result dataset in {directory} ends inside a chunk of {chunksize} events, "
+                                     f"so it cannot be continued")
+        else:
+            self._check_raw(deadcellfraction)
+            if chunked and chunksize is None:
+                chunksize = self._chunksize()
+            dataset = ResultDataset.create(directory, self, new_seed() if seed is None else seed, deadcellfraction,
+                                           metadata, chunksize if chunked else None)
+        for block in self.iter_sample(particles, chunksize, deadcellfraction=deadcellfraction, progress=progress,
+                                      seed=dataset.seed, first_event=len(dataset)):
+            dataset.append(block)
+        return dataset
+
+    def _simulate_shared(self, particles, deadcellfraction, seed, first_event):
+        '''simulate_sample with the workers writing into a shared memory block.'''
+        seed = new_seed() if seed is None else seed
+        self.last_seed = seed
+        shape = (len(particles), len(self._calorimeter.geometry().active_index))
+        chunksize = self._chunksize()
+        if self._engine in ('python', 'vector'):
+            # The events do not depend on the chunks, so use a few large chunks per worker
+            # to attach to the block less often
+            chunksize = max(chunksize, -(-len(particles)//(8*(self._processes or mp.cpu_count()))))
+        block = _SharedBlock(shape)
+        try:
+            tasks = ((chunk, start, seed, deadcellfraction, block.name, shape, first_event)
+                     for chunk, start in _chunks(particles, chunksize, first_event))
+            for _ in self._dispatch(_simulate_shared_task, tasks, ordered=False):
+                pass
+        finally:
+            block.unlink()
+        return np.asarray(block)
+
+    def simulate_with_tracing(self, particle, deadcellfraction=0.0, seed=None):
         '''Run a single simulation with particle trajectory tracing enabled.
         This records the path of all particles created during the shower.
         Note: This is computationally expensive and should only be used for
-        a single ingoing particle (number=1).
+        a single ingoing particle (number=1). The shower is that of event 0 of a
+        run with the given seed, a new one if None.
 
         Returns:
         --------
@@ -71,36 +880,23 @@ class Simulation:
             ionisations: Array of ionisation deposited in each layer
             calorimeter: The calorimeter object containing the recorded particle traces
         '''
+        self._check_raw(deadcellfraction)
         # Create a fresh copy of the calorimeter
         cal = copy.deepcopy(self._calorimeter)
         cal.enable_tracing()
         cal.reset()
 
-        particles = deque([copy.copy(particle)])
-        all_particles = []
-
-        while particles:
-            p = particles.popleft()
-            newparticles = cal.step(p, 0.1)
-
-            # If no new particles created (energy below cutoff), record the current particle
-            if not newparticles:
-                all_particles.append(p)
-            else:
-                # Add all returned particles back to queue if still in calorimeter
-                for np_p in newparticles:
-                    if np_p.z < cal._zend:
-                        particles.append(np_p)
-                    else:
-                        # Record particles that exit the calorimeter
-                        all_particles.append(np_p)
+        seed = new_seed() if seed is None else seed
+        self.last_seed = seed
+        generator = event_generator(seed, 0)
+        all_particles = _trace_shower(cal, particle, self._step, RandomStream(generator), self._traversal,
+                                      self._max_stack)
 
         # Record all final particles
         for p in all_particles:
             cal.record_trace(p)
 
         ionisations = cal.ionisations()
-        mask = np.random.random(ionisations.shape) < deadcellfraction
-        ionisations[mask] = 0
+        ionisations[generator.random(ionisations.shape) < deadcellfraction] = 0
 
         return ionisations, cal
@@ -0,0 +1,65 @@
+import numpy as np
+
+
+class SparseSample:
+    '''The ionisations of a sample of events held in compressed sparse rows: for event
+    i the layers[offsets[i]:offsets[i + 1]] hold the indices of the layers with a
+    non-zero ionisation and values the ionisations, as float32. Samples of deep
+    calorimeters, low energies or muons, where most layers see nothing, so take a
+    fraction of the memory of the dense (events x layers) array, which width gives
+    the number of columns of. The reductions do not need SciPy.'''
+
+    def __init__(self, offsets, layers, values, width):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.layers = np.asarray(layers, dtype=np.int32)
+        self.values = np.asarray(values, dtype=np.float32)
+        self.width = int(width)
+
+    @classmethod
+    def from_dense(cls, array):
+        '''Create the sample from a dense (events x layers) array.'''
+        array = np.asarray(array)
+        mask = array != 0
+        offsets = np.concatenate(([0], np.cumsum(mask.sum(axis=1))))
+        return cls(offsets, np.nonzero(mask)[1], array[mask], array.shape[1])
+
+    @classmethod
+    def concatenate(cls, samples, width=None):
+        '''Join samples of the same width one after the other. The width has to be
+        given if there are no samples.'''
+        samples = list(samples)
+        if not samples:
+            return cls([0], [], [], width)
+        starts = np.cumsum([0] + [len(s.values) for s in samples[:-1]])
+        offsets = np.concatenate([[0]] + [s.offsets[1:] + start for s, start in zip(samples, starts)])
+        return cls(offsets, np.concatenate([s.layers for s in samples]), np.concatenate([s.values for s in samples]),
+                   samples[0].width)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def shape(self):
+        return (len(self), self.width)
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.layers.nbytes + self.values.nbytes
+
+    def rows(self):
+        '''Return the event index of every stored value.'''
+        return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+
+    def to_dense(self, dtype=float):
+        '''Return the dense (events x layers) array.'''
+        dense = np.zeros(self.shape, dtype=dtype)
+        dense[self.rows(), self.layers] = self.values
+        return dense
+
+    def row_sums(self):
+        '''Return the total ionisation of each event.'''
+        return np.bincount(self.rows(), weights=self.values, minlength=len(self))
+
+    def layer_means(self):
+        '''Return the mean ionisation of each layer over the events.'''
+        return np.bincount(self.layers, weights=self.values, minlength=self.width)/max(len(self), 1)
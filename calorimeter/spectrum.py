@@ -55,18 +55,17 @@ class Spectrum:
         ----------
         n_particles : int
             Number of particles to generate
-        seed : int or None
-            Random seed for reproducibility
+        seed : int, numpy Generator or None
+            Random seed for reproducibility. The generator is local, the global
+            numpy random state is neither used nor changed.
 
         Returns
         -------
         list
             List of particle objects with uniformly sampled energies
         """
-        if seed is not None:
-            np.random.seed(seed)
-
-        energies = np.random.uniform(self.min_energy, self.max_energy, n_particles)
+        rng = np.random.default_rng(seed)
+        energies = rng.uniform(self.min_energy, self.max_energy, n_particles)
         return [self.particle_type(0.0, E) for E in energies]
 
     def spectrum(self, n_particles, rise_constant=8, fall_constant=30, seed=None):
@@ -81,16 +80,16 @@ class Spectrum:
             Exponential constant for the rise of the distribution (1/e power)
         fall_constant : float
             Exponential constant for the fall of the distribution (1/e power)
-        seed : int or None
-            Random seed for reproducibility (default: None)
+        seed : int, numpy Generator or None
+            Random seed for reproducibility (default: None). The generator is
+            local, the global numpy random state is neither used nor changed.
 
         Returns
         -------
         list
             List of particle objects with sampled energies from the spectrum
         """
-        if seed is not None:
-            np.random.seed(seed)
+        rng = np.random.default_rng(seed)
 
         def energy_spectrum_pdf(E):
             """Compute the probability density function for the energy spectrum."""
@@ -103,9 +102,9 @@ class Spectrum:
         # Rejection sampling
         samples = []
         while len(samples) < n_particles:
-            E_candidate = np.random.uniform(self.min_energy, self.max_energy)
+            E_candidate = rng.uniform(self.min_energy, self.max_energy)
             acceptance = energy_spectrum_pdf(E_candidate) / pdf_max
-            if np.random.uniform(0, 1) < acceptance:
+            if rng.uniform(0, 1) < acceptance:
                 samples.append(E_candidate)
 
         energies = np.array(samples)
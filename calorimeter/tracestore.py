@@ -0,0 +1,199 @@
+import numpy as np
+from .vectorised import TYPE_CODES
+
+
+def trace_segments(particles, event=0):
+    '''Convert the final particles of a traced shower into trace segments. The
+    particles are followed back through their parents, so every particle of the
+    shower gets an id, and each straight line between two recorded positions of a
+    particle becomes a segment. Return a dictionary of columns as for TraceStore.'''
+    ids = {}
+    order = []
+    for particle in particles:
+        chain = []
+        while particle is not None and id(particle) not in ids:
+            chain.append(particle)
+            particle = particle.parent
+        for p in reversed(chain):
+            ids[id(p)] = len(order)
+            order.append(p)
+
+    rows = []
+    for p in order:
+        parent = ids[id(p.parent)] if p.parent is not None else -1
+        points = (p.trace or []) + [(p.z, p.x, p.y)]
+        for start, end in zip(points[:-1], points[1:]):
+            rows.append((ids[id(p)], parent, TYPE_CODES[p.type]) + start + end)
+
+    columns = {name: np.array([row[i] for row in rows], dtype=dtype)
+               for i, (name, dtype) in enumerate(TraceStore.columns[1:])}
+    columns['event'] = np.full(len(rows), event, dtype=np.int64)
+    return columns
+
+
+class TraceStore:
+    '''A bounded store of particle trace segments held in contiguous columns: event
+    id, particle id, parent id (-1 for the incoming particle), particle type code and
+    the start and end positions of the segment.
+
+    At most max_segments segments are kept. When the store is full, new data is
+    reservoir sampled: with sampling='events' complete events are kept or replaced,
+    with sampling='segments' individual segments are. Event sampling is uniform for
+    events of similar size; an event larger than the space it would replace is
+    dropped.'''
+
+    columns = (('event', np.int64), ('particle', np.int64), ('parent', np.int64), ('type', np.int8),
+               ('z0', float), ('x0', float), ('y0', float), ('z1', float), ('x1', float), ('y1', float))
+    samplings = ('events', 'segments')
+
+    def __init__(self, max_segments=1000000, sampling='events', seed=None):
+        if sampling not in self.samplings:
+            raise ValueError(f"Unknown sampling '{sampling}', use one of {self.samplings}")
+        self.max_segments = max_segments
+        self.sampling = sampling
+        self._rng = np.random.default_rng(seed)
+        self._data = {name: np.zeros(0, dtype=dtype) for name, dtype in self.columns}
+        self._size = 0
+        self.events_seen = 0
+        self.segments_seen = 0
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, name):
+        '''Return the filled part of the column with the given name.'''
+        return self._data[name][:self._size]
+
+    @property
+    def nbytes(self):
+        '''Memory used by the filled part of the columns.'''
+        return sum(self[name].nbytes for name, _ in self.columns)
+
+    def events(self):
+        '''Return the sorted ids of the events held in the store.'''
+        return np.unique(self['event'])
+
+    def event_segments(self, event):
+        '''Return the columns of all segments of the given event.'''
+        mask = self['event'] == event
+        return {name: self[name][mask] for name, _ in self.columns}
+
+    def add_event(self, segments):
+        '''Add the segments of one event, given as a dictionary of columns.'''
+        n = len(segments['event'])
+        self.events_seen += 1
+        if self.sampling == 'segments':
+            self._add_sampled_segments(segments, n)
+            return
+        self.segments_seen += n
+
+        if self._size + n <= self.max_segments:
+            self._append(segments, n)
+            return
+
+        # Reservoir sampling of whole events
+        stored = self.events()
+        j = self._rng.integers(self.events_seen)
+        if j < len(stored):
+            victim = self['event'] == stored[j]
+            if self.max_segments - self._size + np.count_nonzero(victim) >= n:
+                self._remove(victim)
+                self._append(segments, n)
+
+    def merge(self, other):
+        '''Merge the sample held by another store, for example one filled by a worker,
+        into this one. The events, or segments, of the two stores are drawn in
+        proportion to the numbers each of them has seen, so the merged store is as
+        uniform a sample of all of them as if it had seen them itself.'''
+        if other.sampling != self.sampling:
+            raise ValueError(f"Cannot merge a store sampled by '{other.sampling}' into one sampled by "
+                             f"'{self.sampling}'")
+        if self.sampling == 'segments':
+            keep = self._draw_segments(other)
+        else:
+            keep = self._draw_events(other)
+        parts = [{name: store[name][mask] for name, _ in self.columns} for store, mask in zip((self, other), keep)]
+        self._size = 0
+        for part in parts:
+            self._append(part, len(part['event']))
+        self.events_seen += other.events_seen
+        self.segments_seen += other.segments_seen
+
+    def _draw_segments(self, other):
+        '''Return the masks of the segments of this store and the other kept by merge.
+        The number taken from this store has the hypergeometric distribution of a
+        sample of all the segments seen by both.'''
+        held = (len(self), len(other))
+        total = min(self.max_segments, sum(held))
+        if total == 0:
+            return (np.zeros(held[0], dtype=bool), np.zeros(held[1], dtype=bool))
+        first = self._rng.hypergeometric(self.segments_seen, other.segments_seen, total)
+        first = min(max(first, total - held[1]), held[0])
+        masks = []
+        for n, taken in zip(held, (first, total - first)):
+            mask = np.zeros(n, dtype=bool)
+            mask[self._rng.choice(n, taken, replace=False)] = True
+            masks.append(mask)
+        return tuple(masks)
+
+    def _draw_events(self, other):
+        '''Return the masks of the segments of this store and the other kept by merge.
+        Events are drawn one at a time from either store with the probability of the
+        number of events it has seen and not yet drawn, in a random order of those it
+        holds, and kept if they fit. A store that dropped events stops the draw once it
+        has none left, one that kept them all only had events without segments left.'''
+        stores = (self, other)
+        orders = []
+        for store in stores:
+            events, sizes = np.unique(store['event'], return_counts=True)
+            order = self._rng.permutation(len(events))
+            orders.append(list(zip(events[order].tolist(), sizes[order].tolist())))
+        remaining = [store.events_seen for store in stores]
+        complete = [len(store) == store.segments_seen for store in stores]
+        taken = [[], []]
+        positions = [0, 0]
+        free = self.max_segments
+        while free > 0 and positions[0] + positions[1] < len(orders[0]) + len(orders[1]):
+            side = int(self._rng.random()*(remaining[0] + remaining[1]) >= remaining[0])
+            remaining[side] -= 1
+            if positions[side] == len(orders[side]):
+                if complete[side] and remaining[side] >= 0:
+                    continue
+                break
+            event, n = orders[side][positions[side]]
+            positions[side] += 1
+            if n <= free:
+                taken[side].append(event)
+                free -= n
+        return tuple(np.isin(store['event'], events) for store, events in zip(stores, taken))
+
+    def _add_sampled_segments(self, segments, n):
+        free = min(self.max_segments - self._size, n)
+        self._append({name: column[:free] for name, column in segments.items()}, free)
+        seen = self.segments_seen + free
+        self.segments_seen += n
+
+        # Reservoir sampling of the remaining segments
+        if free < n:
+            slots = np.floor(self._rng.random(n - free)*(seen + 1 + np.arange(n - free))).astype(np.int64)
+            keep = slots < self.max_segments
+            for name, column in segments.items():
+                self._data[name][slots[keep]] = column[free:][keep]
+
+    def _append(self, segments, n):
+        if self._size + n > len(self._data['event']):
+            capacity = min(self.max_segments, max(2*len(self._data['event']), self._size + n, 1024))
+            for name, dtype in self.columns:
+                column = np.zeros(capacity, dtype=dtype)
+                column[:self._size] = self._data[name][:self._size]
+                self._data[name] = column
+        for name, _ in self.columns:
+            self._data[name][self._size:self._size + n] = segments[name]
+        self._size += n
+
+    def _remove(self, mask):
+        keep = ~mask
+        n = np.count_nonzero(keep)
+        for name, _ in self.columns:
+            self._data[name][:n] = self[name][keep]
+        self._size = n
@@ -0,0 +1,146 @@
+import numpy as np
+from .particle import Particle, Electron
+
+# Integer codes used for the particle type column
+ELECTRON, PHOTON, MUON = 0, 1, 2
+TYPE_CODES = {'elec': ELECTRON, 'phot': PHOTON, 'muon': MUON}
+
+# Standard deviation of the scattering angle of the daughters, per type code of the parent
+_ANGLE_SIGMA = np.array([0.02, 0.05, 0.0])
+
+
+class ParticleStack:
+    '''The state of a set of particles held as a structure of arrays, one entry per
+    particle, so the whole stack can be advanced with array operations. The event
+    column holds the index of the incoming particle whose shower a particle belongs to.'''
+
+    columns = ('event', 'type', 'z', 'x', 'y', 'angle_x', 'angle_y', 'energy')
+
+    def __init__(self, event, type, z, x, y, angle_x, angle_y, energy):
+        self.event = event
+        self.type = type
+        self.z = z
+        self.x = x
+        self.y = y
+        self.angle_x = angle_x
+        self.angle_y = angle_y
+        self.energy = energy
+
+    @classmethod
+    def from_particles(cls, particles):
+        '''Create the stack from a list of Particle objects, one event per particle.'''
+        return cls(np.arange(len(particles)),
+                   np.array([TYPE_CODES[p.type] for p in particles], dtype=np.int8),
+                   *(np.array([getattr(p, c) for p in particles], dtype=float) for c in cls.columns[2:]))
+
+    @classmethod
+    def from_energies(cls, energies, particle_type=Electron):
+        '''Create the stack from an array of energies for particles of the given
+        Particle class entering at the front of the calorimeter, one event per particle.'''
+        energies = np.asarray(energies, dtype=float)
+        n = len(energies)
+        code = TYPE_CODES[particle_type(0.0, 0.0).type]
+        return cls(np.arange(n), np.full(n, code, dtype=np.int8),
+                   *(np.zeros(n) for _ in cls.columns[2:-1]), energies.copy())
+
+    def __len__(self):
+        return len(self.z)
+
+    def select(self, mask):
+        '''Return a new stack with only the particles selected by mask.'''
+        return ParticleStack(*(getattr(self, c)[mask] for c in self.columns))
+
+    def extend(self, other):
+        '''Return a new stack with the particles of other appended.'''
+        return ParticleStack(*(np.concatenate((getattr(self, c), getattr(other, c))) for c in self.columns))
+
+
+def _split(parents, rng):
+    '''Let all particles in parents interact at once. Electrons radiate a photon and
+    photons convert to two electrons, with the energy split uniformly and a common
+    gaussian scattering of the daughters. Return the stack of daughters.'''
+    n = len(parents)
+    split = rng.random(n)
+    sigma = _ANGLE_SIGMA[parents.type]
+    angle_x = parents.angle_x + rng.normal(0.0, 1.0, n)*sigma
+    angle_y = parents.angle_y + rng.normal(0.0, 1.0, n)*sigma
+
+    second = np.where(parents.type == ELECTRON, PHOTON, ELECTRON).astype(np.int8)
+    first = np.full(n, ELECTRON, dtype=np.int8)
+    return ParticleStack(np.tile(parents.event, 2), np.concatenate((first, second)), np.tile(parents.z, 2), np.tile(parents.x, 2),
+                         np.tile(parents.y, 2), np.tile(angle_x, 2), np.tile(angle_y, 2),
+                         np.concatenate((split*parents.energy, (1.0-split)*parents.energy)))
+
+
+def simulate_shower(geometry, particle, step=0.1, rng=None):
+    '''Simulate the shower of a single incoming particle through the geometry with all
+    shower particles advanced together. Use the same model as Calorimeter.step for a
+    fixed step, or as Calorimeter.advance for event driven transport if step is None.
+    Return the ionisation deposited in every layer of the geometry.'''
+    return simulate_batch(geometry, [particle], step, rng)[0]
+
+
+def simulate_batch(geometry, particles, step=0.1, rng=None, particle_type=Electron, chunksize=1000):
+    '''Simulate the showers of many incoming particles together. The particles are
+    given either as a list of Particle objects or as an array of energies of particles
+    of particle_type entering at the front. The shower particles of up to chunksize
+    events are tracked in one shared set of arrays, which bounds the memory used.
+    Return a 2D array with the ionisation deposited in every layer (second axis)
+    for each event (first axis).'''
+    rng = np.random.default_rng() if rng is None else rng
+    objects = len(particles) > 0 and isinstance(particles[0], Particle)
+    deposits = np.zeros((len(particles), len(geometry)))
+
+    for start in range(0, len(particles), chunksize):
+        chunk = particles[start:start + chunksize]
+        if objects:
+            stack = ParticleStack.from_particles(chunk)
+        else:
+            stack = ParticleStack.from_energies(chunk, particle_type)
+        _transport(geometry, stack, step, rng, deposits[start:start + chunksize])
+
+    return deposits
+
+
+def _transport(geometry, stack, step, rng, deposits):
+    '''Advance all particles in the stack until they have left the calorimeter or been
+    absorbed, adding their ionisation to the (events x layers) array deposits.'''
+    ends = geometry.z + geometry.thickness
+    starts = np.append(geometry.z, geometry.zend)
+    # Energy below which a particle is absorbed rather than splitting, per type code and layer
+    cuts = np.stack([geometry.cuts[type] for type in TYPE_CODES])
+
+    while len(stack):
+        n = len(stack)
+        index = geometry.locate_all(stack.z)
+        inside = index >= 0
+        layer = np.where(inside, index, 0)
+        # Muons never interact
+        material = np.where(inside & (stack.type != MUON), geometry.material[layer], 0.0)
+
+        if step:
+            distance = np.full(n, float(step))
+            interacts = rng.random(n) < material*step
+            z = stack.z + distance
+        else:
+            # Move to the next interaction point or layer boundary, whichever comes first
+            boundary = np.where(inside, ends[layer], starts[np.searchsorted(geometry.z, stack.z, side='right')])
+            with np.errstate(divide='ignore'):
+                free = rng.exponential(1.0, n)/material
+            interacts = free < boundary - stack.z
+            distance = np.where(interacts, free, boundary - stack.z)
+            z = np.where(interacts, stack.z + free, boundary)
+
+        stack.x += distance*stack.angle_x
+        stack.y += distance*stack.angle_y
+        stack.z = z
+
+        ionising = inside & (stack.type != PHOTON)
+        np.add.at(deposits, (stack.event[ionising], index[ionising]),
+                  geometry.yields[index[ionising]]*distance[ionising])
+
+        splitting = interacts & (stack.energy > cuts[stack.type, layer])
+        daughters = _split(stack.select(splitting), rng)
+        # Particles behind the last active layer can no longer add to the ionisations
+        stack = stack.select(~interacts & (stack.z < geometry.reach))
+        stack = stack.extend(daughters.select(daughters.z < geometry.reach))
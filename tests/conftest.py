@@ -0,0 +1,21 @@
+import pytest
+
+from calorimeter.calorimeter import Calorimeter
+from calorimeter.layer import Layer
+
+
+@pytest.fixture(scope="session")
+def shower_calorimeter():
+    '''Return a function making a sampling calorimeter of layers pairs of lead and an
+    active layer, called name, with the given response, followed by a passive block
+    of lead of thickness back if given.'''
+
+    def make(layers=5, name="scin", response=1.0, back=0.0):
+        cal = Calorimeter()
+        for _ in range(layers):
+            cal.add_layers([Layer("lead", 2.0, 0.5, 0.0), Layer(name, 0.01, 0.5, response)])
+        if back:
+            cal.add_layer(Layer("lead", 2.0, back, 0.0))
+        return cal
+
+    return make
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from calorimeter.particle import Electron
+from calorimeter.simulation import Simulation
+from calorimeter.accumulate import LayerStatistics
+
+
+def test_statistics_of_blocks_match_whole_sample():
+    rng = np.random.default_rng(1)
+    sample = rng.gamma(2.0, 1.0, (500, 4)) + 100.0
+    edges = np.linspace(400.0, 420.0, 11)
+    parts = []
+    for block in np.array_split(sample, [7, 8, 300]):
+        part = LayerStatistics(4, edges)
+        part.add(block)
+        parts.append(part)
+    statistics = LayerStatistics.combine(reversed(parts))
+
+    totals = sample.sum(axis=1)
+    assert len(statistics) == 500
+    assert statistics.mean == pytest.approx(sample.mean(axis=0))
+    assert statistics.variance == pytest.approx(sample.var(axis=0, ddof=1))
+    assert statistics.covariance == pytest.approx(np.cov(sample, rowvar=False))
+    assert statistics.resolution == pytest.approx(totals.std(ddof=1)/totals.mean())
+    assert list(statistics.counts) == list(np.histogram(totals, edges)[0])
+    assert statistics.underflow == np.count_nonzero(totals < 400.0)
+    assert statistics.overflow == np.count_nonzero(totals > 420.0)
+
+
+def test_statistics_with_other_bins_cannot_be_merged():
+    with pytest.raises(ValueError):
+        LayerStatistics(2, [0.0, 1.0]).merge(LayerStatistics(2, [0.0, 2.0]))
+    with pytest.raises(ValueError):
+        LayerStatistics(2).merge(LayerStatistics(3))
+
+
+def test_statistics_save_and_load(tmp_path):
+    statistics = LayerStatistics(3, [0.0, 1.0, 2.0])
+    statistics.add(np.array([[0.1, 0.2, 0.3], [0.5, 0.0, 0.2]]))
+    statistics.save(tmp_path / "stats.npz")
+    loaded = LayerStatistics.load(tmp_path / "stats.npz")
+    assert len(loaded) == 2
+    assert loaded.covariance == pytest.approx(statistics.covariance)
+    assert list(loaded.counts) == list(statistics.counts)
+
+
+@pytest.mark.parametrize("processes", [0, 1])
+def test_accumulated_simulation_matches_sample(processes, shower_calorimeter):
+    particles = [Electron(0.0, 0.5)] * 30
+    with Simulation(shower_calorimeter(), transport="event", processes=processes) as sim:
+        sample = sim.simulate_sample(particles, seed=4)
+        statistics = sim.accumulate(particles, edges=np.linspace(0.0, 5.0, 6), chunksize=7, seed=4)
+        first = sim.accumulate(particles[:10], seed=4)
+        rest = sim.accumulate(particles[10:], seed=4, first_event=10)
+    assert len(statistics) == 30
+    assert statistics.mean == pytest.approx(sample.mean(axis=0))
+    assert statistics.covariance == pytest.approx(np.cov(sample, rowvar=False))
+    assert statistics.counts.sum() + statistics.underflow + statistics.overflow == 30
+    assert first.merge(rest).covariance == pytest.approx(statistics.covariance)
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+from calorimeter.calorimeter import Calorimeter
+from calorimeter.layer import Layer
+from calorimeter.particle import Electron, Photon, Muon
+from calorimeter.simulation import Simulation
+from calorimeter.budget import EnergyBudget
+
+
+def test_tracks_follow_the_splitting_recursion(shower_calorimeter):
+    budget = EnergyBudget(shower_calorimeter(10).geometry(), 0.1)
+    tracks = {"e": lambda E: budget.tracks(Electron(0.0, E)), "p": lambda E: budget.tracks(Photon(0.0, E))}
+    assert tracks["e"](0.005) == 1.0
+    assert tracks["p"](0.005) == 0.0
+    assert budget.tracks(Muon(0.0, 10.0)) == 0.0
+
+    # Average over the energy split of the daughters
+    u = (np.arange(20000) + 0.5)/20000
+    E = 0.05
+    electron = 1 + np.mean([tracks["e"](s*E) + tracks["p"]((1 - s)*E) for s in u])
+    photon = np.mean([tracks["e"](s*E) + tracks["e"]((1 - s)*E) for s in u])
+    assert tracks["e"](E) == pytest.approx(electron, rel=1e-3)
+    assert tracks["p"](E) == pytest.approx(photon, rel=1e-3)
+
+
+def test_generations_add_up_to_the_tracks(shower_calorimeter):
+    budget = EnergyBudget(shower_calorimeter(10).geometry(), 0.1)
+    particles = [P(0.0, E) for P in (Electron, Photon) for E in (0.005, 0.02, 0.3, 10.0)]
+    generations = budget.generations(particles)
+    assert generations.sum(axis=1) == pytest.approx([budget.tracks(p) for p in particles], rel=1e-3)
+    # Beyond the range of the table it is extended
+    assert budget.generations([Electron(0.0, 500.0, weight=0.5)]).sum() == pytest.approx(
+        budget.tracks(Electron(0.0, 500.0, weight=0.5)), rel=1e-3)
+
+
+def test_residual():
+    cal = Calorimeter()
+    cal.add_layers([Layer("gap", 0.0, 1.0, 2.0), Layer("lead", 1.0, 1.0, 0.0), Layer("scin", 0.0, 1.0, 1.0)])
+    budget = EnergyBudget(cal.geometry(), 0.1)
+    cal.reset()
+    added = budget.residual(cal, [Electron(0.5, 0.005), Photon(0.5, 0.005), Muon(0.0, 1.0)])
+    # The electron track reaches the scintillator with the probability to cross the lead
+    assert list(cal.ionisations()) == pytest.approx([1.0 + 2.0, np.exp(-1.0) + 1.0])
+    assert added == pytest.approx(3.0 + np.exp(-1.0) + 1.0)
+
+
+@pytest.mark.parametrize("particle", [Electron(0.3, 0.2), Photon(2.7, 0.3)])
+def test_profile_is_the_mean_of_the_showers(particle, shower_calorimeter):
+    cal = shower_calorimeter(10)
+    sample = Simulation(cal, transport="event", processes=0).simulate_sample([particle] * 4000, seed=2)
+    profile = EnergyBudget(cal.geometry(), 0.1).profile([particle])[cal.geometry().active_index]
+    error = sample.std(axis=0)/np.sqrt(len(sample))
+    # Layers the shower cannot have reached yet have no spread
+    assert profile[error == 0] == pytest.approx(sample.mean(axis=0)[error == 0])
+    pulls = (profile - sample.mean(axis=0))[error > 0]/error[error > 0]
+    # The layers fluctuate together, so the pulls are correlated
+    assert np.abs(pulls).max() < 4
+    assert np.mean(pulls**2) < 4
+
+
+@pytest.mark.parametrize("traversal", ["depth", "breadth"])
+def test_budget_keeps_the_mean_of_every_layer(traversal, shower_calorimeter):
+    cal = shower_calorimeter(10)
+    particles = [Electron(0.0, 0.5)] * 1000
+    full = Simulation(cal, transport="event", processes=0, traversal=traversal).simulate_sample(particles, seed=1)
+    sim = Simulation(cal, transport="event", processes=0, traversal=traversal, budget=0.3)
+    blocks = list(sim.iter_sample(particles, seed=1))
+    cut = np.concatenate([b.ionisations for b in blocks])
+    # The events draw the same random numbers until they are stopped
+    difference = cut - full
+    error = difference.std(axis=0)/np.sqrt(len(particles))
+    assert (difference[:, error == 0] == 0).all()
+    pulls = difference.mean(axis=0)[error > 0]/error[error > 0]
+    assert np.abs(pulls).max() < 4
+    assert np.mean(pulls**2) < 4
+
+    residual = np.concatenate([b.info["residual"] for b in blocks])
+    truncated = np.concatenate([b.info["truncated"] for b in blocks])
+    assert (residual > 0).mean() > 0.9
+    assert ((truncated >= 0) & (truncated <= 0.3)).all()
+    assert np.array_equal(sim.simulate_sample(particles, seed=1), cut)
+
+
+def test_budget_with_step_transport_reports_the_cut(shower_calorimeter):
+    sim = Simulation(shower_calorimeter(10), transport="step", processes=0, budget=0.2)
+    blocks = list(sim.iter_sample([Electron(0.0, 0.5)] * 20, seed=1))
+    truncated = np.concatenate([b.info["truncated"] for b in blocks])
+    assert ((truncated >= 0) & (truncated <= 0.2)).all()
+
+
+def test_budget_needs_python_engine_and_a_fraction(shower_calorimeter):
+    with pytest.raises(ValueError):
+        Simulation(shower_calorimeter(10), engine="batch", budget=0.1)
+    with pytest.raises(ValueError):
+        Simulation(shower_calorimeter(10), budget=1.5)
+    with pytest.raises(ValueError):
+        EnergyBudget(shower_calorimeter(10).geometry(), 0.0)
+    with pytest.raises(ValueError):
+        Simulation(shower_calorimeter(10), budget=0.1, cuts={"phot": 0.1})
+
+
+def test_budget_leaves_muons_exact(shower_calorimeter):
+    sim = Simulation(shower_calorimeter(10), transport="event", processes=0, budget=0.1)
+    assert sim.simulate_sample([Muon(0.0, 10.0)], seed=1) == pytest.approx(np.full((1, 10), 0.5))
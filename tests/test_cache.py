@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+import pytest
+
+from calorimeter.particle import Electron
+from calorimeter.simulation import Simulation
+from calorimeter.cache import ResultCache
+from calorimeter.fastsim import ShowerLibrary
+
+
+def test_cached_sample_is_returned_without_simulating(tmp_path, monkeypatch, shower_calorimeter):
+    cache = ResultCache(tmp_path)
+    particles = [Electron(0.0, 0.5)] * 10
+    sim = Simulation(shower_calorimeter(), transport="event", processes=0, cache=cache)
+    first = sim.simulate_sample(particles, seed=3)
+    assert len(cache.entries()) == 1
+
+    monkeypatch.setattr(Simulation, "_simulate", lambda *args: pytest.fail("simulated again"))
+    again = Simulation(shower_calorimeter(), transport="event", processes=0, cache=cache)
+    assert np.array_equal(again.simulate_sample(particles, seed=3), first)
+    assert again.last_seed == 3
+
+
+def test_cache_key_depends_on_layers_particles_settings_and_seed(tmp_path, shower_calorimeter):
+    cache = ResultCache(tmp_path)
+    particles = [Electron(0.0, 0.5)] * 3
+    sim = Simulation(shower_calorimeter(), transport="event")
+    key = cache.key(sim, particles, 1)
+    assert cache.key(Simulation(shower_calorimeter(), transport="event"), list(particles), 1) == key
+    assert cache.key(Simulation(shower_calorimeter(name="other"), transport="event"), particles, 1) != key
+    assert cache.key(Simulation(shower_calorimeter(), transport="step"), particles, 1) != key
+    assert cache.key(sim, [Electron(0.0, 0.6)] * 3, 1) != key
+    assert cache.key(sim, particles, 2) != key
+    assert cache.key(sim, particles, 1, deadcellfraction=0.1) != key
+
+
+def test_runs_without_seed_are_not_cached(tmp_path, shower_calorimeter):
+    cache = ResultCache(tmp_path)
+    Simulation(shower_calorimeter(), transport="event", processes=0, cache=cache).simulate_sample(
+        [Electron(0.0, 0.5)] * 2)
+    assert cache.entries() == []
+
+
+def test_least_recently_used_samples_are_evicted(tmp_path):
+    sample = np.zeros((10, 10))
+    cache = ResultCache(tmp_path, max_bytes=2.5*(sample.nbytes + 128))
+    cache.put("a", sample)
+    cache.put("b", sample)
+    os.utime(tmp_path / "a.npy", (0, 0))
+    os.utime(tmp_path / "b.npy", (1, 1))
+    assert cache.get("a") is not None
+    cache.put("c", sample)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_cache_key_depends_on_the_contents_of_the_libraries(tmp_path, shower_calorimeter):
+    build = Simulation(shower_calorimeter(), transport="event", engine="batch", processes=0)
+    first = ShowerLibrary.build(build, energies=(1.0, 4.0), events=50, seed=1)
+    second = ShowerLibrary.build(build, energies=(1.0, 2.0, 4.0), events=50, seed=2)
+    assert first.key == second.key
+
+    cache = ResultCache(tmp_path)
+    energies = np.full(20, 2.0)
+    a = Simulation(shower_calorimeter(), engine="fast", library=first, cache=cache).simulate_sample(energies, seed=1)
+    sim = Simulation(shower_calorimeter(), engine="fast", library=second, cache=cache)
+    b = sim.simulate_sample(energies, seed=1)
+    assert len(cache.entries()) == 2
+    assert not np.array_equal(a, b)
+    assert np.array_equal(b, sim._simulate(energies, 0.0, None, 1, 0, False))
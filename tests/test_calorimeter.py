@@ -3,7 +3,7 @@ import pytest
 
 from calorimeter.calorimeter import Calorimeter
 from calorimeter.layer import Layer
-from calorimeter.particle import Electron, Photon
+from calorimeter.particle import Electron, Muon, Photon
 
 
 def test_calorimeter_add_layer_positions_and_zend():
@@ -239,3 +239,159 @@ def test_calorimeter_add_layers_copies_layers():
 
     # The calorimeter's layer should not be affected
     assert cal.volumes(active=False)[0].layer._ionisation == 0.0
+
+
+def test_calorimeter_advance_stops_at_layer_boundary():
+    cal = Calorimeter()
+    cal.add_layer(Layer("L1", material=0.0, thickness=0.5, response=1.0))
+    cal.add_layer(Layer("L2", material=0.0, thickness=0.01, response=2.0))
+
+    e = Electron(z=0.2, energy=1.0)
+    out = cal.advance(e)
+    assert out == [e]
+    assert e.z == 0.5
+    out = cal.advance(e)
+    assert out == [e]
+    assert e.z == 0.51
+    assert list(cal.ionisations()) == pytest.approx([0.3, 0.02])
+
+
+def test_calorimeter_advance_interacts_at_sampled_point(monkeypatch):
+    cal = Calorimeter()
+    layer = Layer("L1", material=1.0, thickness=1.0, response=1.0)
+    cal.add_layer(layer)
+    monkeypatch.setattr(random, "expovariate", lambda rate: 0.25)
+    monkeypatch.setattr(random, "random", lambda: 0.5)
+    monkeypatch.setattr(random, "gauss", lambda mu, sigma: 0.0)
+
+    e = Electron(z=0.0, energy=1.0)
+    out = cal.advance(e)
+    assert len(out) == 2
+    assert all(p.z == pytest.approx(0.25) for p in out)
+    assert cal.ionisations()[0] == pytest.approx(0.25)
+
+
+def test_calorimeter_advance_moves_to_front_face():
+    cal = Calorimeter()
+    cal.add_layer(Layer("L1", material=0.0, thickness=1.0, response=1.0))
+
+    e = Electron(z=-1.0, energy=1.0)
+    assert cal.advance(e) == [e]
+    assert e.z == 0.0
+    assert cal.ionisations()[0] == 0.0
+
+
+def test_calorimeter_step_records_trace_only_when_enabled(monkeypatch):
+    cal = Calorimeter()
+    cal.add_layer(Layer("L1", material=0.0, thickness=1.0, response=1.0))
+    monkeypatch.setattr(random, "random", lambda: 1.0)
+
+    e = Electron(z=0.0, energy=1.0)
+    cal.step(e, step=0.1)
+    assert e.trace is None
+
+    cal.enable_tracing()
+    cal.step(e, step=0.1)
+    cal.step(e, step=0.1)
+    # Only the start of the straight line is recorded
+    assert e.trace == [(0.1, 0.0, 0.0)]
+
+    cal.record_trace(e)
+    (particle, trace), = cal.get_particle_traces()
+    assert particle is e
+    assert trace == [(0.1, 0.0, 0.0), (pytest.approx(0.3), 0.0, 0.0)]
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_calorimeter_traces_only_hold_kinks(seed, shower_calorimeter):
+    from calorimeter.simulation import Simulation
+
+    cal = shower_calorimeter(10)
+
+    _, traced = Simulation(cal).simulate_with_tracing(Electron(0.0, 2.0), seed=seed)
+    traces = traced.get_particle_traces()
+    assert traces
+    for particle, trace in traces:
+        # One point per generation plus the final position
+        depth = 0
+        p = particle
+        while p is not None:
+            depth += 1
+            p = p.parent
+        if particle.trace is None:
+            # Created behind the last active layer, where it ends without a step of its own
+            assert particle.z >= cal.geometry().reach
+            assert len(trace) == depth
+        else:
+            assert len(trace) == depth + 1
+        assert trace[0] == (0.0, 0.0, 0.0)
+        assert all(a[0] <= b[0] for a, b in zip(trace[:-1], trace[1:]))
+
+
+def test_calorimeter_propagate_returns_none_when_nothing_happens(monkeypatch):
+    cal = Calorimeter()
+    cal.add_layers([Layer("gap", material=0.0, thickness=1.0, response=0.0),
+                    Layer("L1", material=1.0, thickness=1.0, response=2.0)])
+
+    monkeypatch.setattr(random, "random", lambda: 1.0)
+    e = Electron(z=0.0, energy=1.0)
+    assert cal.propagate(e, 0.5) is None
+    assert e.z == pytest.approx(0.5)
+
+    # Event driven: moved to the front of the next layer
+    assert cal.propagate(e) is None
+    assert e.z == 1.0
+
+
+def test_calorimeter_propagate_returns_daughters(monkeypatch):
+    cal = Calorimeter()
+    cal.add_layer(Layer("L1", material=1.0, thickness=1.0, response=2.0))
+
+    monkeypatch.setattr(random, "random", lambda: 0.0)
+    monkeypatch.setattr(random, "gauss", lambda mu, sigma: 0.0)
+    daughters = cal.propagate(Electron(z=0.0, energy=1.0), 0.5)
+    assert [p.type for p in daughters] == ["elec", "phot"]
+    assert cal.propagate(Electron(z=0.0, energy=0.001), 0.5) == []
+
+
+def test_calorimeter_deposit_adds_to_layers_and_drops_overflow():
+    cal = Calorimeter()
+    cal.add_layers([Layer("L1", 0.0, 1.0, 1.0), Layer("L2", 0.0, 1.0, 0.0), Layer("L3", 0.0, 1.0, 1.0)])
+    cal.deposit(1, [0.0, 2.0, 5.0])
+    cal.deposit(2, [1.0])
+    assert list(cal.ionisations()) == pytest.approx([0.0, 3.0])
+
+
+def test_calorimeter_propagate_straight_crosses_in_one_go(monkeypatch):
+    cal = Calorimeter()
+    cal.add_layers([Layer("gap", 0.0, 1.0, 0.0), Layer("scin", 0.0, 1.0, 2.0),
+                    Layer("lead", 1.0, 1.0, 0.0), Layer("scin", 0.01, 1.0, 1.0),
+                    Layer("lead", 1.0, 1.0, 0.0)])
+    monkeypatch.setattr(random, "random", lambda: 1.0)
+
+    # An electron crosses the run of layers without material and stops at the lead
+    e = Electron(z=0.5, energy=1.0)
+    assert cal.propagate(e, 0.1, straight=True) is None
+    assert e.z == 2.0
+    assert list(cal.ionisations()) == pytest.approx([2.0, 0.0])
+
+    # A muon goes to the back of the last active layer, moving sideways with its angle
+    cal.reset()
+    m = Muon(z=0.0, energy=1.0, angle_x=0.5)
+    assert cal.propagate(m, 0.1, straight=True) is None
+    assert m.z == 4.0
+    assert m.x == pytest.approx(2.0)
+    assert list(cal.ionisations()) == pytest.approx([2.0, 1.0])
+
+
+def test_calorimeter_propagate_applies_layer_cuts(monkeypatch):
+    cal = Calorimeter(cuts={"elec": 0.001})
+    cal.add_layers([Layer("L1", 1.0, 1.0, 1.0, cuts={"elec": 0.1}), Layer("L2", 1.0, 1.0, 1.0)])
+    monkeypatch.setattr(random, "random", lambda: 0.0)
+    monkeypatch.setattr(random, "gauss", lambda mu, sigma: 0.0)
+    assert cal.propagate(Electron(z=0.0, energy=0.05), 0.5) == []
+    assert len(cal.propagate(Electron(z=1.0, energy=0.05), 0.5)) == 2
+    # Event driven transport interacts at the start, with a free path of zero
+    monkeypatch.setattr(random, "expovariate", lambda rate: 0.0)
+    assert cal.propagate(Electron(z=0.5, energy=0.05)) == []
+    assert len(cal.propagate(Electron(z=1.5, energy=0.05))) == 2
@@ -0,0 +1,91 @@
+import json
+
+import numpy as np
+import pytest
+
+from calorimeter.particle import Electron, Muon
+from calorimeter.simulation import Simulation
+from calorimeter.dataset import ResultDataset
+from calorimeter.fastsim import ShowerLibrary
+from calorimeter.vectorised import TYPE_CODES
+
+
+def test_written_sample_matches_simulate_sample(tmp_path, shower_calorimeter):
+    particles = [Electron(0.0, 0.5)] * 10 + [Muon(0.0, 1.0)] * 5
+    sim = Simulation(shower_calorimeter(), transport="event", processes=0)
+    dataset = sim.write_sample(tmp_path / "run", particles, chunksize=4, seed=5, metadata={"beam": "test"})
+
+    reopened = ResultDataset(tmp_path / "run")
+    assert len(reopened) == 15
+    assert len(reopened.manifest["chunks"]) == 4
+    assert reopened["ionisations"] == pytest.approx(sim.simulate_sample(particles, seed=5))
+    assert list(reopened["event"]) == list(range(15))
+    assert list(reopened["type"]) == [TYPE_CODES["elec"]] * 10 + [TYPE_CODES["muon"]] * 5
+    assert list(reopened["energy"]) == [0.5] * 10 + [1.0] * 5
+    assert isinstance(reopened.chunk(0)["ionisations"], np.memmap)
+
+    with open(tmp_path / "run" / "manifest.json") as f:
+        manifest = json.load(f)
+    assert manifest["seed"] == 5
+    assert manifest["metadata"] == {"beam": "test"}
+    assert manifest["fingerprint"] == sim._calorimeter.geometry().fingerprint()
+    assert manifest["settings"]["transport"] == "event"
+    assert [layer["name"] for layer in manifest["layers"][:2]] == ["lead", "scin"]
+    assert dataset.columns == reopened.columns
+
+
+def test_written_sample_can_be_continued(tmp_path, shower_calorimeter):
+    particles = [Electron(0.0, 0.5)] * 12
+    sim = Simulation(shower_calorimeter(), transport="event", processes=0)
+    sim.write_sample(tmp_path / "whole", particles, seed=7)
+    sim.write_sample(tmp_path / "parts", particles[:5], seed=7)
+    parts = sim.write_sample(tmp_path / "parts", particles[5:])
+    assert list(parts["event"]) == list(range(12))
+    assert parts["ionisations"] == pytest.approx(ResultDataset(tmp_path / "whole")["ionisations"])
+
+
+def test_continuing_with_other_settings_raises(tmp_path, shower_calorimeter):
+    cal = shower_calorimeter()
+    Simulation(cal, transport="event", processes=0).write_sample(tmp_path, [Electron(0.0, 0.5)], seed=1)
+    with pytest.raises(ValueError):
+        Simulation(cal, transport="step", processes=0).write_sample(tmp_path, [Electron(0.0, 0.5)])
+    with pytest.raises(ValueError):
+        Simulation(cal, transport="event", processes=0).write_sample(tmp_path, [Electron(0.0, 0.5)], seed=2)
+    with pytest.raises(ValueError):
+        Simulation(shower_calorimeter(6), transport="event", processes=0).write_sample(tmp_path,
+                                                                                       [Electron(0.0, 0.5)])
+    with pytest.raises(ValueError):
+        ResultDataset.create(tmp_path, Simulation(cal), seed=1)
+
+
+def test_continuing_with_another_library_raises(tmp_path, shower_calorimeter):
+    build = Simulation(shower_calorimeter(), transport="event", engine="batch", processes=0)
+    first = ShowerLibrary.build(build, energies=(1.0, 4.0), events=50, seed=1)
+    second = ShowerLibrary.build(build, energies=(1.0, 4.0), events=50, seed=2)
+    Simulation(shower_calorimeter(), engine="fast", library=first).write_sample(tmp_path, np.full(5, 2.0), chunksize=5,
+                                                                                seed=1)
+    with pytest.raises(ValueError):
+        Simulation(shower_calorimeter(), engine="fast", library=second).write_sample(tmp_path, np.full(5, 2.0))
+    Simulation(shower_calorimeter(), engine="fast", library=first).write_sample(tmp_path, np.full(5, 2.0))
+
+
+@pytest.mark.parametrize("engine", ["batch", "fast"])
+def test_chunked_engines_continue_on_chunk_boundaries(tmp_path, engine, shower_calorimeter):
+    options = {"engine": engine, "processes": 0}
+    if engine == "fast":
+        build = Simulation(shower_calorimeter(), transport="event", engine="batch", processes=0)
+        options["library"] = ShowerLibrary.build(build, energies=(1.0, 4.0), events=50, seed=1)
+    sim = Simulation(shower_calorimeter(), transport="event", **options)
+    energies = np.full(12, 2.0)
+    whole = sim.write_sample(tmp_path / "whole", energies, chunksize=4, seed=3)
+    assert whole.chunksize == 4
+    sim.write_sample(tmp_path / "parts", energies[:8], chunksize=4, seed=3)
+    parts = sim.write_sample(tmp_path / "parts", energies[8:])
+    assert parts["ionisations"] == pytest.approx(whole["ionisations"])
+
+    with pytest.raises(ValueError):
+        sim.write_sample(tmp_path / "parts", energies, chunksize=3)
+    sim.write_sample(tmp_path / "odd", energies[:6], chunksize=4, seed=3)
+    with pytest.raises(ValueError):
+        sim.write_sample(tmp_path / "odd", energies[6:])
+    assert len(ResultDataset(tmp_path / "odd")) == 6
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from calorimeter.layer import Layer
+from calorimeter.particle import Electron, Muon
+from calorimeter.simulation import Simulation
+from calorimeter.digitise import Digitiser
+
+
+def test_raw_calorimeter_records_path_lengths_in_all_layers(shower_calorimeter):
+    cal = shower_calorimeter(2, response=2.0)
+    raw = Simulation(cal, transport="event", processes=0, raw=True).simulate_sample([Muon(0.0, 1.0)], seed=1)
+    assert raw == pytest.approx(np.full((1, 4), 0.5))
+    # The calorimeter given keeps its responses
+    assert list(cal.geometry().yields) == [0.0, 2.0, 0.0, 2.0]
+
+
+@pytest.mark.parametrize("engine", ["python", "vector", "batch"])
+@pytest.mark.parametrize("back", [0.0, 2.0])
+def test_digitised_raw_sample_matches_direct_simulation(engine, back, shower_calorimeter):
+    cal = shower_calorimeter(10, response=2.0, back=back)
+    particles = [Electron(0.0, 1.0)] * 50
+    raw = Simulation(cal, transport="event", engine=engine, processes=0, raw=True).simulate_sample(particles, seed=2)
+    direct = Simulation(cal, transport="event", engine=engine, processes=0).simulate_sample(particles, seed=2)
+    assert raw.shape == (50, len(cal.geometry()))
+    assert Digitiser(cal).digitise(raw) == pytest.approx(direct)
+    # Nothing is followed behind the last active layer
+    assert not raw[:, 20:].any()
+
+
+def test_raw_geometry_keeps_the_reach(shower_calorimeter):
+    cal = shower_calorimeter(2, back=2.0)
+    raw = cal.raw().geometry()
+    assert raw.reach == cal.geometry().reach < raw.zend
+    # With an active back layer the raw layers are the same, but followed further
+    active_back = shower_calorimeter(2)
+    active_back.add_layer(Layer("lead", 2.0, 2.0, 1.0))
+    assert active_back.raw().geometry().reach == raw.zend
+    assert active_back.raw().geometry().fingerprint() != raw.fingerprint()
+
+
+def test_digitiser_applies_gain_noise_threshold_and_dead_cells(shower_calorimeter):
+    cal = shower_calorimeter(2, response=2.0)
+    raw = np.array([[1.0, 0.5, 1.0, 0.01]] * 1000)
+
+    assert Digitiser(cal, gain=[1.0, 2.0]).digitise(raw)[0] == pytest.approx([1.0, 0.04])
+    assert Digitiser(cal, yields=[1.0, 1.0, 0.0, 0.0]).digitise(raw)[0] == pytest.approx([1.0, 0.5])
+    assert Digitiser(cal, threshold=0.1).digitise(raw)[0] == pytest.approx([1.0, 0.0])
+    assert Digitiser(cal, dead=[True, False]).digitise(raw)[0] == pytest.approx([0.0, 0.02])
+
+    noisy = Digitiser(cal, noise=0.1).digitise(raw, np.random.default_rng(1))
+    assert noisy[:, 0].mean() == pytest.approx(1.0, abs=0.02)
+    assert noisy[:, 0].std() == pytest.approx(0.1, rel=0.1)
+    dead = Digitiser(cal, deadcellfraction=0.3).digitise(raw, np.random.default_rng(1))
+    assert (dead == 0).mean() == pytest.approx(0.3, abs=0.05)
+
+
+def test_digitiser_and_raw_simulation_check_their_input(shower_calorimeter):
+    cal = shower_calorimeter(2, response=2.0)
+    with pytest.raises(ValueError):
+        Digitiser(cal).digitise(np.zeros((3, 2)))
+    with pytest.raises(ValueError):
+        Digitiser(cal, yields=[1.0, 2.0])
+    with pytest.raises(ValueError):
+        Digitiser(cal, dead=[True])
+    with pytest.raises(ValueError):
+        Simulation(cal, processes=0, raw=True).simulate_sample([Muon(0.0, 1.0)], deadcellfraction=0.1)
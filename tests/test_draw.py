@@ -57,3 +57,18 @@ def test_draw_with_traces_adds_legend_entries():
     assert any("Active layer" in s for s in labels)
     assert any("Electron traces" in s for s in labels)
     assert any("Muon traces" in s for s in labels)
+
+
+def test_draw_traces_as_line_collections():
+    from matplotlib.collections import LineCollection
+
+    cal = Calorimeter()
+    cal.add_layer(Layer("active", material=0.0, thickness=1.0, response=1.0))
+    cal.enable_tracing()
+    for i in range(5):
+        cal.record_trace(Electron(z=1.0, energy=0.05, x=0.1 * i, trace=[(0.0, 0.0, 0.0)]))
+
+    ax = cal.draw(show_traces=True)
+    collections = [c for c in ax.collections if isinstance(c, LineCollection)]
+    assert len(collections) == 1
+    assert len(collections[0].get_segments()) == 5
@@ -0,0 +1,150 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from calorimeter.calorimeter import Calorimeter
+from calorimeter.layer import Layer
+from calorimeter.particle import Electron, Photon, Muon
+from calorimeter.simulation import Simulation
+from calorimeter.fastsim import ShowerLibrary, SubShowerLibrary, library_key, subshower_key, validation_table
+
+
+@pytest.fixture(scope="module")
+def library(shower_calorimeter):
+    s = Simulation(shower_calorimeter(8), transport="event", engine="batch", processes=0)
+    return ShowerLibrary.build(s, energies=(1.0, 4.0, 16.0), events=200, seed=1)
+
+
+def test_library_reproduces_full_simulation(library, shower_calorimeter):
+    s = Simulation(shower_calorimeter(8), transport="event", engine="batch", processes=0)
+    report = library.validate(s, events=200, seed=2)
+    assert list(report["energy"]) == pytest.approx([2.0, 8.0])
+    assert report["fast_mean"] == pytest.approx(report["full_mean"], rel=0.05)
+    assert report["fast_std"] == pytest.approx(report["full_std"], rel=0.3)
+    assert (report["profile_difference"] < 0.25).all()
+    assert "energy" in validation_table(report)
+
+
+def test_library_sample_shape_and_range(library):
+    sample = library.sample([1.0, 3.0, 16.0], np.random.default_rng(0))
+    assert sample.shape == (3, 8)
+    assert (sample >= 0).all()
+    with pytest.raises(ValueError):
+        library.sample([20.0])
+
+
+def test_library_save_and_cached(library, tmp_path, shower_calorimeter):
+    path = tmp_path / "library.npz"
+    library.save(path)
+    loaded = ShowerLibrary.load(path)
+    assert loaded.key == library.key
+    assert np.array_equal(loaded.covariances, library.covariances)
+    assert np.array_equal(loaded.sample([5.0], np.random.default_rng(1)),
+                          library.sample([5.0], np.random.default_rng(1)))
+
+    s = Simulation(shower_calorimeter(8), transport="event", engine="batch", processes=0)
+    library.save(tmp_path / f"{library_key(s._calorimeter)}.npz")
+    # Found on disk, so nothing is simulated
+    assert ShowerLibrary.cached(s, tmp_path, energies=(1.0, 2.0)).energies.tolist() == [1.0, 4.0, 16.0]
+
+
+def test_library_key_depends_on_geometry_and_transport(shower_calorimeter):
+    assert library_key(shower_calorimeter(8)) == library_key(shower_calorimeter(8))
+    assert library_key(shower_calorimeter(8)) != library_key(shower_calorimeter(9))
+    assert library_key(shower_calorimeter(8)) != library_key(shower_calorimeter(8), step=0.1)
+
+
+def test_simulation_fast_engine(library, shower_calorimeter):
+    s = Simulation(shower_calorimeter(8), engine="fast", library=library)
+    out = s.simulate_sample(np.full(100, 5.0), seed=3)
+    assert out.shape == (100, 8)
+    assert np.array_equal(out, s.simulate_sample([Electron(0.0, 5.0)] * 100, seed=3))
+
+    with pytest.raises(ValueError):
+        Simulation(shower_calorimeter(8), engine="fast")
+    with pytest.raises(ValueError):
+        Simulation(shower_calorimeter(9), engine="fast", library=library)
+
+
+@pytest.fixture(scope="module")
+def subshowers(tmp_path_factory, shower_calorimeter):
+    s = Simulation(shower_calorimeter(8), transport="event", processes=0)
+    path = tmp_path_factory.mktemp("subshowers") / "library"
+    SubShowerLibrary.build(s, threshold=0.2, samples=50, seed=1).save(path)
+    return SubShowerLibrary.load(path)
+
+
+def test_subshower_library_is_memory_mapped_and_pickled_by_path(subshowers):
+    assert isinstance(subshowers.deposits, np.memmap)
+    assert subshowers.deposits.shape[:4] == (2, 9, 2*4, 50)
+    copied = pickle.loads(pickle.dumps(subshowers))
+    assert len(pickle.dumps(subshowers)) < 1000
+    assert isinstance(copied.deposits, np.memmap)
+    assert copied.threshold == subshowers.threshold
+    assert np.array_equal(copied.deposits, subshowers.deposits)
+
+
+def test_subshower_library_absorbs_only_low_energy_showering_particles(subshowers, shower_calorimeter):
+    cal = shower_calorimeter(8)
+    rng = np.random.default_rng(0)
+    assert not subshowers.absorb(cal, Electron(0.1, 0.5), rng)
+    assert not subshowers.absorb(cal, Muon(0.1, 0.05), rng)
+    assert subshowers.absorb(cal, Photon(0.1, 0.05), rng)
+    assert subshowers.absorb(cal, Electron(0.6, 0.005), rng)
+    assert cal.ionisations().sum() > 0
+
+
+def test_hybrid_simulation_reproduces_full_simulation(subshowers, shower_calorimeter):
+    full = Simulation(shower_calorimeter(8), transport="event", processes=0)
+    hybrid = Simulation(shower_calorimeter(8), transport="event", processes=0, subshowers=subshowers)
+    a = full.simulate_sample([Electron(0.0, 5.0)] * 200, seed=4)
+    b = hybrid.simulate_sample([Electron(0.0, 5.0)] * 200, seed=4)
+    assert b.sum(axis=1).mean() == pytest.approx(a.sum(axis=1).mean(), rel=0.05)
+    assert b.sum(axis=1).std() == pytest.approx(a.sum(axis=1).std(), rel=0.3)
+    assert np.array_equal(b, hybrid.simulate_sample([Electron(0.0, 5.0)] * 200, seed=4))
+    # The workers map the library from its file
+    with Simulation(shower_calorimeter(8), transport="event", processes=2, start_method="spawn",
+                    subshowers=subshowers) as pooled:
+        assert np.array_equal(b[:20], pooled.simulate_sample([Electron(0.0, 5.0)] * 20, seed=4))
+
+
+def test_hybrid_simulation_checks_library(subshowers, tmp_path, shower_calorimeter):
+    # The same layer pattern repeated more often is fine
+    Simulation(shower_calorimeter(20), transport="event", subshowers=subshowers)
+    with pytest.raises(ValueError):
+        Simulation(shower_calorimeter(8), transport="step", subshowers=subshowers)
+    with pytest.raises(ValueError):
+        SubShowerLibrary.build(Simulation(shower_calorimeter(8), transport="step"))
+    with pytest.raises(ValueError):
+        Simulation(shower_calorimeter(8), transport="event", engine="batch", subshowers=subshowers)
+    cal = Calorimeter()
+    cal.add_layers([Layer("lead", 2.0, 0.6, 0.0), Layer("scin", 0.01, 0.5, 1.0)] * 4)
+    with pytest.raises(ValueError):
+        Simulation(cal, transport="event", subshowers=subshowers)
+
+    s = Simulation(shower_calorimeter(8), transport="event", processes=0)
+    key = subshower_key(s._calorimeter.geometry(), 0.2)
+    assert key == subshower_key(shower_calorimeter(20).geometry(), 0.2)
+    assert key != subshower_key(s._calorimeter.geometry(), 0.3)
+    library = SubShowerLibrary.cached(s, tmp_path, threshold=0.2, samples=10, seed=1)
+    assert (tmp_path / f"{key}.npy").exists()
+    assert library.key == key
+
+
+def test_library_digest_depends_on_contents(library, subshowers, shower_calorimeter):
+    s = Simulation(shower_calorimeter(8), transport="event", engine="batch", processes=0)
+    other = ShowerLibrary.build(s, energies=(1.0, 4.0, 16.0), events=200, seed=2)
+    assert other.key == library.key
+    assert other.digest() != library.digest()
+    assert pickle.loads(pickle.dumps(library)).digest() == library.digest()
+    assert pickle.loads(pickle.dumps(subshowers)).digest() == subshowers.digest()
+
+
+@pytest.mark.parametrize("particle", [Muon(0.0, 4.0), Photon(0.0, 4.0), Electron(1.0, 4.0),
+                                      Electron(0.0, 4.0, angle_x=0.1), Electron(0.0, 4.0, weight=2.0)])
+def test_fast_engine_rejects_particles_the_library_is_not_for(library, particle, shower_calorimeter):
+    sim = Simulation(shower_calorimeter(8), engine="fast", library=library)
+    with pytest.raises(ValueError):
+        sim.simulate_sample([particle])
+    assert sim.simulate_sample([Electron(0.0, 4.0)]).shape == (1, len(library.depths))
@@ -0,0 +1,130 @@
+import numpy as np
+import pytest
+
+from calorimeter.calorimeter import Calorimeter
+from calorimeter.layer import Layer
+from calorimeter.particle import Electron
+
+
+def make_calorimeter():
+    cal = Calorimeter()
+    cal.add_layer(Layer("passive", material=2.0, thickness=0.5, response=0.0))
+    cal.add_layer(Layer("active", material=0.01, thickness=0.25, response=1.0))
+    cal.add_layer(Layer("passive", material=2.0, thickness=0.5, response=0.0))
+    cal.add_layer(Layer("active", material=0.01, thickness=0.25, response=2.0))
+    return cal
+
+
+def test_geometry_arrays():
+    geometry = make_calorimeter().geometry()
+    assert len(geometry) == 4
+    assert np.allclose(geometry.z, [0.0, 0.5, 0.75, 1.25])
+    assert np.allclose(geometry.thickness, [0.5, 0.25, 0.5, 0.25])
+    assert np.allclose(geometry.material, [2.0, 0.01, 2.0, 0.01])
+    assert np.allclose(geometry.yields, [0.0, 1.0, 0.0, 2.0])
+    assert list(geometry.active) == [False, True, False, True]
+    assert list(geometry.active_index) == [1, 3]
+    assert geometry.zend == pytest.approx(1.5)
+
+
+def test_geometry_is_read_only():
+    geometry = make_calorimeter().geometry()
+    with pytest.raises(ValueError):
+        geometry.z[0] = 1.0
+
+
+def test_geometry_locate_matches_linear_scan():
+    cal = make_calorimeter()
+    geometry = cal.geometry()
+    for z in np.linspace(-0.2, 1.7, 97):
+        expected = -1
+        for i, v in enumerate(cal.volumes(active=False)):
+            if v.z <= z < v.z + v.layer.get_thickness():
+                expected = i
+                break
+        assert geometry.locate(z) == expected
+        assert geometry.locate_all([z])[0] == expected
+
+
+def test_geometry_locate_boundaries():
+    geometry = make_calorimeter().geometry()
+    assert geometry.locate(0.0) == 0
+    assert geometry.locate(0.5) == 1
+    assert geometry.locate(1.5) == -1
+    assert list(geometry.locate_all([0.0, 0.5, 0.75, 1.5])) == [0, 1, 2, -1]
+
+
+def test_geometry_rebuilt_when_layers_added():
+    cal = make_calorimeter()
+    geometry = cal.geometry()
+    assert cal.geometry() is geometry
+
+    cal.add_layer(Layer("tail", material=0.0, thickness=1.0, response=1.0))
+    rebuilt = cal.geometry()
+    assert rebuilt is not geometry
+    assert len(rebuilt) == 5
+    assert rebuilt.locate(2.0) == 4
+    assert len(cal.volumes()) == 3
+    assert cal.ionisations().shape == (3,)
+
+
+def test_step_uses_geometry_for_thin_layers(monkeypatch):
+    import random
+    cal = make_calorimeter()
+    monkeypatch.setattr(random, "random", lambda: 1.0)
+
+    e = Electron(z=0.5, energy=1.0)
+    cal.step(e, 0.1)
+    assert list(cal.ionisations()) == pytest.approx([0.1, 0.0])
+
+
+def test_geometry_fingerprint_depends_on_layers_only():
+    def build(name, thickness):
+        cal = Calorimeter()
+        cal.add_layers([Layer(name, 2.0, 0.5, 0.0), Layer("scin", 0.01, thickness, 1.0)])
+        return cal.geometry()
+
+    assert build("lead", 0.5).fingerprint() == build("Pb", 0.5).fingerprint()
+    assert build("lead", 0.5).fingerprint() != build("lead", 0.6).fingerprint()
+
+
+def test_geometry_period_and_position():
+    cal = Calorimeter()
+    cal.add_layers([Layer("lead", 2.0, 0.5, 0.0), Layer("scin", 0.01, 1.0, 1.0)] * 3)
+    geometry = cal.geometry()
+    assert geometry.period() == 2
+    assert geometry.position(1.0) == (1, pytest.approx(0.5))
+    assert geometry.position(10.0) == (-1, 0.0)
+
+    cal.add_layer(Layer("lead", 2.0, 0.6, 0.0))
+    assert cal.geometry().period() == 7
+
+
+def test_geometry_reach_clear_end_and_paths():
+    cal = Calorimeter()
+    cal.add_layers([Layer("gap", 0.0, 1.0, 0.0), Layer("air", 0.0, 0.5, 1.0),
+                    Layer("lead", 2.0, 0.5, 0.0), Layer("scin", 0.0, 1.0, 1.0),
+                    Layer("lead", 2.0, 1.0, 0.0)])
+    geometry = cal.geometry()
+    assert geometry.reach == pytest.approx(3.0)
+    assert geometry.clear_end(0) == pytest.approx(1.5)
+    assert geometry.clear_end(2) is None
+    assert geometry.clear_end(3) == pytest.approx(3.0)
+    assert geometry.paths(0.5, 2.0) == [(0, pytest.approx(0.5)), (1, pytest.approx(0.5)),
+                                        (2, pytest.approx(0.5))]
+
+
+def test_geometry_resolves_production_cuts():
+    cal = Calorimeter(cuts={"elec": 0.02})
+    cal.add_layers([Layer("lead", 2.0, 0.5, 0.0, cuts={"phot": 0.5}), Layer("scin", 0.01, 1.0, 1.0)])
+    geometry = cal.geometry()
+    assert geometry.layer_cuts[0] == {"elec": 0.02, "phot": 0.5, "muon": 0.01}
+    assert list(geometry.cuts["phot"]) == [0.5, 0.01]
+    assert geometry.uniform_cut() is None
+    assert geometry.uniform_cut(("elec",)) == 0.02
+
+    fingerprint = geometry.fingerprint()
+    cal.set_cuts({"elec": 0.05})
+    assert cal.geometry() is not geometry
+    assert cal.geometry().fingerprint() != fingerprint
+    assert cal.get_cuts() == {"elec": 0.05}
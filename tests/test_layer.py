@@ -35,6 +35,16 @@ def test_layer_interact_triggers(monkeypatch):
     assert len(out) in (1, 2)
 
 
+def test_layer_collide_returns_none_without_interaction(monkeypatch):
+    layer = Layer(name="mat", material=0.5, thickness=1.0, response=1.0)
+    e = Electron(z=0.0, energy=1.0)
+
+    monkeypatch.setattr(random, "random", lambda: 1.0)
+    assert layer.collide(e, step=0.5) is None
+    monkeypatch.setattr(random, "random", lambda: 0.0)
+    assert len(layer.collide(e, step=0.5)) == 2
+
+
 def test_layer_get_name():
     """Test the getter for layer name."""
     layer = Layer(name="TestLayer", material=0.5, thickness=1.0, response=1.0)
@@ -57,3 +67,30 @@ def test_layer_get_response():
     """Test the getter for layer response."""
     layer = Layer(name="TestLayer", material=0.5, thickness=1.0, response=1.0)
     assert layer.get_yield() == 1.0
+
+
+def test_layer_free_path_infinite_without_material():
+    layer = Layer(name="air", material=0.0, thickness=1.0, response=1.0)
+    assert layer.free_path() == float("inf")
+
+
+def test_layer_free_path_is_exponential():
+    random.seed(1)
+    layer = Layer(name="lead", material=2.0, thickness=1.0, response=0.0)
+    paths = [layer.free_path() for _ in range(20000)]
+    assert min(paths) >= 0.0
+    assert sum(paths) / len(paths) == pytest.approx(0.5, rel=0.03)
+
+
+def test_layer_cuts_are_checked_and_applied(monkeypatch):
+    layer = Layer("lead", 1.0, 1.0, 0.0, cuts={"elec": 0.1})
+    assert layer.get_cuts() == {"elec": 0.1}
+    with pytest.raises(ValueError):
+        Layer("lead", 1.0, 1.0, 0.0, cuts={"tau": 0.1})
+    with pytest.raises(ValueError):
+        Layer("lead", 1.0, 1.0, 0.0, cuts={"elec": -1.0})
+
+    monkeypatch.setattr(random, "random", lambda: 0.0)
+    e = Electron(z=0.0, energy=0.05)
+    assert len(layer.collide(e, 0.5)) == 2
+    assert layer.collide(e, 0.5, cuts={"elec": 0.1}) == []
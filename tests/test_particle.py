@@ -4,14 +4,21 @@ import pytest
 from calorimeter.particle import Particle, Electron, Photon, Muon
 
 
-def test_particle_move_updates_positions_and_trace():
+def test_particle_move_updates_positions_without_trace():
     p = Particle(type="test", z=0.0, energy=1.0, ionise=True, cutoff=0.1, x=0.0, y=0.0, angle_x=0.5, angle_y=-0.5)
     p.move(0.2)
     assert pytest.approx(p.z, 1e-8) == 0.2
     assert pytest.approx(p.x, 1e-8) == 0.1
     assert pytest.approx(p.y, 1e-8) == -0.1
-    assert len(p.trace) == 1
-    assert p.trace[0] == (0.0, 0.0, 0.0)
+    assert p.trace is None
+
+
+def test_particle_record_appends_position():
+    p = Particle(type="test", z=0.0, energy=1.0, ionise=True, cutoff=0.1)
+    p.record()
+    p.move(0.2)
+    p.record()
+    assert p.trace == [(0.0, 0.0, 0.0), (0.2, 0.0, 0.0)]
 
 
 def test_electron_interact_splits_when_energy_above_cutoff(monkeypatch):
@@ -37,6 +44,22 @@ def test_photon_interact_splits_when_energy_above_cutoff(monkeypatch):
     assert pytest.approx(sum(p.energy for p in parts), 1e-8) == ph.energy
 
 
+def test_particles_have_no_instance_dict():
+    for particle in (Electron(0.0, 1.0), Photon(0.0, 1.0), Muon(0.0, 1.0)):
+        assert not hasattr(particle, "__dict__")
+        with pytest.raises(AttributeError):
+            particle.charge = 1
+
+
+def test_particles_copy_and_pickle():
+    import copy
+    import pickle
+
+    e = Electron(1.0, 2.0, x=0.5, angle_y=0.1)
+    for clone in (copy.copy(e), copy.deepcopy(e), pickle.loads(pickle.dumps(e))):
+        assert (clone.type, clone.z, clone.energy, clone.x, clone.angle_y) == ("elec", 1.0, 2.0, 0.5, 0.1)
+
+
 def test_muon_basic_properties():
     m = Muon(z=0.0, energy=2.0)
     assert m.type == "muon"
@@ -146,28 +169,44 @@ def test_photon_interact_applies_scattering(monkeypatch):
         assert p.angle_x != ph.angle_x or p.angle_y != ph.angle_y
 
 
-def test_electron_interact_copies_trace():
-    """Test that electron interaction copies the particle trace."""
+def test_electron_interact_links_trace_to_parent():
+    """Test that electron interaction shares the trace through a parent link."""
     e = Electron(z=0.0, energy=1.0)
     e.trace = [(0.0, 0.0, 0.0), (0.5, 0.1, 0.1)]
     parts = e.interact()
 
-    # Each new particle should have a copy of the trace
+    # Each new particle sees the trace of the parent without a copy
     for p in parts:
-        assert p.trace == e.trace
-        assert p.trace is not e.trace  # Should be a copy, not same object
+        assert p.parent is e
+        assert p.trace is None
+        assert p.history() == e.trace
 
 
-def test_photon_interact_copies_trace():
-    """Test that photon interaction copies the particle trace."""
+def test_photon_interact_links_trace_to_parent():
+    """Test that photon interaction shares the trace through a parent link."""
     ph = Photon(z=0.0, energy=1.0)
     ph.trace = [(0.0, 0.0, 0.0), (0.5, 0.1, 0.1)]
     parts = ph.interact()
 
-    # Each new particle should have a copy of the trace
     for p in parts:
-        assert p.trace == ph.trace
-        assert p.trace is not ph.trace  # Should be a copy, not same object
+        assert p.parent is ph
+        assert p.history() == ph.trace
+
+
+def test_interact_without_trace_keeps_no_parent():
+    """Test that untraced particles do not keep their ancestors alive."""
+    e = Electron(z=0.0, energy=1.0)
+    for p in e.interact():
+        assert p.parent is None
+        assert p.history() == []
+
+
+def test_history_joins_ancestor_traces():
+    grandparent = Photon(z=0.0, energy=1.0, trace=[(0.0, 0.0, 0.0)])
+    parent = Electron(z=0.5, energy=0.5, trace=[(0.5, 0.0, 0.0), (0.6, 0.0, 0.0)], parent=grandparent)
+    child = Electron(z=0.7, energy=0.2, parent=parent)
+    child.record()
+    assert child.history() == [(0.0, 0.0, 0.0), (0.5, 0.0, 0.0), (0.6, 0.0, 0.0), (0.7, 0.0, 0.0)]
 
 
 def test_muon_interact_returns_empty():
@@ -224,3 +263,10 @@ def test_str_rounding_precision():
     # Should be rounded to 3 decimal places
     assert "z:1.235" in result  # Rounded up from 1.23456
     assert "E:9.877" in result  # Rounded up from 9.87654
+
+
+def test_interact_cutoff_overrides_the_particle_cut():
+    e = Electron(z=0.0, energy=0.05)
+    assert len(e.interact()) == 2
+    assert e.interact(cutoff=0.1) == []
+    assert Photon(z=0.0, energy=0.005).interact(cutoff=0.001) != []
@@ -0,0 +1,48 @@
+import random
+
+import numpy as np
+import pytest
+
+from calorimeter.rng import RandomStream, event_generator, new_seed
+
+
+def test_event_generator_matches_spawned_children():
+    children = np.random.SeedSequence(42).spawn(5)
+    for event, child in enumerate(children):
+        assert event_generator(42, event).random() == np.random.default_rng(child).random()
+
+
+def test_event_generators_are_distinct():
+    assert event_generator(1, 0).random() != event_generator(1, 1).random()
+    assert event_generator(1, 0).random() != event_generator(2, 0).random()
+
+
+def test_new_seed_is_fresh():
+    assert new_seed() != new_seed()
+
+
+def test_random_stream_follows_stdlib_interface():
+    stream = RandomStream(np.random.default_rng(0))
+    draws = [stream.random() for _ in range(1000)]
+    assert all(0.0 <= d < 1.0 for d in draws)
+    assert np.mean([stream.expovariate(2.0) for _ in range(5000)]) == pytest.approx(0.5, rel=0.1)
+    assert np.std([stream.gauss(1.0, 0.1) for _ in range(5000)]) == pytest.approx(0.1, rel=0.1)
+    # The stdlib module has the same methods
+    for name in ("random", "gauss", "expovariate"):
+        assert callable(getattr(random, name))
+
+
+def test_random_stream_hands_out_blocks_in_order():
+    stream = RandomStream(np.random.default_rng(3), block=8)
+    draws = [stream.random() for _ in range(20)]
+    expected = np.random.default_rng(3).random(24)
+    blocks = [list(reversed(expected[i:i + 8])) for i in range(0, 24, 8)]
+    assert draws == [x for block in blocks for x in block][:20]
+
+
+def test_random_stream_is_reproducible():
+    first = RandomStream(event_generator(5, 2))
+    second = RandomStream(event_generator(5, 2))
+    for _ in range(10000):
+        assert (first.random(), first.gauss(0, 1), first.expovariate(3.0)) == \
+            (second.random(), second.gauss(0, 1), second.expovariate(3.0))
@@ -0,0 +1,57 @@
+import random
+
+import numpy as np
+import pytest
+
+from calorimeter.calorimeter import Calorimeter
+from calorimeter.layer import Layer
+from calorimeter.particle import Electron, Photon
+from calorimeter.simulation import Simulation
+from calorimeter.roulette import RussianRoulette
+
+
+def test_play_only_when_crossing_the_threshold(monkeypatch):
+    roulette = RussianRoulette(0.1, 0.25)
+    parent = Electron(0.0, 0.2)
+    assert roulette.play(parent, Photon(0.0, 0.15))
+    assert roulette.play(Electron(0.0, 0.05), Photon(0.0, 0.01))
+
+    monkeypatch.setattr(random, "random", lambda: 0.5)
+    assert not roulette.play(parent, Photon(0.0, 0.05))
+    monkeypatch.setattr(random, "random", lambda: 0.1)
+    survivor = Photon(0.0, 0.05)
+    assert roulette.play(parent, survivor)
+    assert survivor.weight == pytest.approx(4.0)
+    assert [p.weight for p in survivor.interact()] == [4.0, 4.0]
+
+
+def test_roulette_rejects_bad_parameters():
+    with pytest.raises(ValueError):
+        RussianRoulette(0.1, 0.0)
+    with pytest.raises(ValueError):
+        RussianRoulette(-0.1, 0.5)
+    with pytest.raises(ValueError):
+        Simulation(Calorimeter(), engine="batch", roulette=RussianRoulette(0.1, 0.5))
+
+
+def test_weighted_particles_ionise_with_their_weight():
+    layer = Layer("scin", 0.0, 1.0, 2.0)
+    layer.ionise(Electron(0.0, 1.0, weight=3.0), 0.5)
+    assert layer.get_ionisation() == pytest.approx(3.0)
+
+
+def test_roulette_keeps_the_mean_and_reports_the_particles_played(shower_calorimeter):
+    cal = shower_calorimeter(40)
+    particles = [Electron(0.0, 2.0)] * 300
+    full = Simulation(cal, transport="event", processes=0).simulate_sample(particles, seed=1)
+    sim = Simulation(cal, transport="event", processes=0, roulette=RussianRoulette(0.1, 0.5))
+    blocks = list(sim.iter_sample(particles, seed=1))
+    played = np.concatenate([b.ionisations for b in blocks])
+
+    # Unbiased within the larger spread of the weighted events
+    assert played.sum(1).mean() == pytest.approx(full.sum(1).mean(), abs=3*played.sum(1).std()/np.sqrt(300))
+    assert played.sum(1).std() > full.sum(1).std()
+    killed = np.concatenate([b.info["killed"] for b in blocks])
+    weighted = np.concatenate([b.info["weighted"] for b in blocks])
+    assert (killed > 0).all() and (weighted > 0).all()
+    assert np.array_equal(sim.simulate_sample(particles, seed=1), played)
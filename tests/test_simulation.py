@@ -1,22 +1,46 @@
+import copy
+import gc
 import random
+import warnings
+from multiprocessing import shared_memory
+from multiprocessing.pool import TERMINATE
+import numpy as np
 import pytest
 
 from calorimeter.calorimeter import Calorimeter
 from calorimeter.layer import Layer
-from calorimeter.particle import Electron
+from calorimeter.particle import Electron, Muon
 import calorimeter.simulation as sim_module
-from calorimeter.simulation import Simulation
+from calorimeter.simulation import Simulation, _run_single_simulation_indexed
+from calorimeter.tracestore import TraceStore
+
+
+class DummyResult:
+    def __init__(self, value):
+        self.value = value
+    def get(self):
+        return self.value
 
 
 class DummyPool:
-    def __init__(self, n):
+    instances = 0
+
+    def __init__(self, n, initializer=None, initargs=(), context=None):
         self.n = n
-    def __enter__(self):
-        return self
-    def __exit__(self, exc_type, exc, tb):
-        return False
-    def map(self, fn, args_list):
-        return [fn(args) for args in args_list]
+        DummyPool.instances += 1
+        # Workers get their own copy of the initializer arguments
+        initializer(*copy.deepcopy(initargs))
+    def apply_async(self, fn, args, callback=None, error_callback=None):
+        result = DummyResult(fn(*args))
+        if callback is not None:
+            callback(result.get())
+        return result
+    def close(self):
+        pass
+    def join(self):
+        pass
+    def terminate(self):
+        pass
 
 
 def test_simulate_with_tracing_records_traces():
@@ -57,20 +81,11 @@ def test_simulate_sample_preserves_order(monkeypatch):
     # Patch multiprocessing to run inline but track call order
     call_order = []
 
-    class OrderTrackingPool:
-        def __init__(self, n):
-            self.n = n
-        def __enter__(self):
-            return self
-        def __exit__(self, exc_type, exc, tb):
-            return False
-        def map(self, fn, args_list):
-            results = []
-            for args in args_list:
-                # Track which particle index is being processed
-                call_order.append(args[3])  # args[3] is the index
-                results.append(fn(args))
-            return results
+    class OrderTrackingPool(DummyPool):
+        def apply_async(self, fn, args, **kwargs):
+            # Track which chunk of particles is being processed
+            call_order.append(args[0][1])  # the task is (particles, start index, seed, deadcellfraction)
+            return super().apply_async(fn, args, **kwargs)
 
     monkeypatch.setattr(sim_module, "Pool", OrderTrackingPool)
     monkeypatch.setattr(sim_module.mp, "cpu_count", lambda: 1)
@@ -90,6 +105,7 @@ def test_simulate_sample_preserves_order(monkeypatch):
     out = s.simulate_sample(particles, deadcellfraction=0.0)
 
     # Results should be in the same order as the input particles
+    assert call_order == [0]
     assert out.shape == (3, 1)
     # Verify that results maintain the original particle order (0, 1, 2)
     # by checking the indexed results are properly sorted
@@ -97,9 +113,6 @@ def test_simulate_sample_preserves_order(monkeypatch):
 
 
 def test_run_single_simulation_indexed():
-    import copy
-    from calorimeter.simulation import _run_single_simulation_indexed
-
     cal = Calorimeter()
     cal.add_layer(Layer("active", material=0.0, thickness=1.0, response=1.0))
 
@@ -113,3 +126,331 @@ def test_run_single_simulation_indexed():
     ionisations, index = result
     assert index == 42
     assert ionisations.shape == (1,)
+
+
+def test_simulation_rejects_unknown_transport():
+    with pytest.raises(ValueError):
+        Simulation(Calorimeter(), transport="teleport")
+
+
+def test_event_transport_handles_thin_layers():
+    cal = Calorimeter()
+    for _ in range(5):
+        cal.add_layers([Layer("lead", 0.0, 0.5, 0.0), Layer("scin", 0.0, 0.01, 1.0)])
+
+    ionisations, _ = _run_single_simulation_indexed((cal, Muon(0.0, 10.0), None, 0))
+    assert ionisations == pytest.approx([0.01] * 5)
+
+
+def test_muon_deposits_in_closed_form_with_either_transport():
+    cal = Calorimeter()
+    for _ in range(5):
+        cal.add_layers([Layer("lead", 2.0, 0.5, 0.0), Layer("scin", 0.01, 0.3, 1.0)])
+    cal.add_layer(Layer("lead", 2.0, 5.0, 0.0))
+
+    for step in (0.1, None):
+        ionisations, _ = _run_single_simulation_indexed((cal, Muon(0.0, 10.0, angle_x=0.2), step, 0))
+        assert ionisations == pytest.approx([0.3] * 5)
+
+
+def test_event_and_step_transport_agree_on_average(shower_calorimeter):
+    cal = shower_calorimeter(10)
+
+    random.seed(3)
+    totals = {}
+    for step in (0.1, None):
+        totals[step] = sum(_run_single_simulation_indexed((cal, Electron(0.0, 1.0), step, 0))[0].sum()
+                           for _ in range(300)) / 300
+    assert totals[None] == pytest.approx(totals[0.1], rel=0.1)
+
+
+def test_simulate_sample_vector_engine(monkeypatch):
+    monkeypatch.setattr(sim_module, "Pool", DummyPool)
+    monkeypatch.setattr(sim_module.mp, "cpu_count", lambda: 1)
+
+    cal = Calorimeter()
+    cal.add_layer(Layer("active", material=0.5, thickness=1.0, response=1.0))
+    cal.add_layer(Layer("passive", material=2.0, thickness=1.0, response=0.0))
+
+    s = Simulation(cal, engine="vector")
+    out = s.simulate_sample([Electron(z=0.0, energy=0.5), Electron(z=0.0, energy=2.0)])
+    assert out.shape == (2, 1)
+    assert cal.ionisations().shape == (1,)
+
+
+def test_simulation_rejects_unknown_engine():
+    with pytest.raises(ValueError):
+        Simulation(Calorimeter(), engine="quantum")
+
+
+def test_simulate_sample_batch_engine_without_pool():
+    cal = Calorimeter()
+    cal.add_layer(Layer("active", material=0.0, thickness=1.0, response=1.0))
+    cal.add_layer(Layer("passive", material=0.0, thickness=1.0, response=0.0))
+
+    s = Simulation(cal, transport="event", engine="batch", batch_size=2, processes=0)
+    out = s.simulate_sample([Muon(0.0, 1.0)] * 5)
+    assert out.shape == (5, 1)
+    assert out[:, 0] == pytest.approx([1.0] * 5)
+
+    out = s.simulate_sample(np.array([0.001, 0.002, 0.003]))
+    assert out.shape == (3, 1)
+
+
+def test_simulate_sample_batch_engine_with_pool(monkeypatch):
+    monkeypatch.setattr(sim_module, "Pool", DummyPool)
+
+    cal = Calorimeter()
+    cal.add_layer(Layer("active", material=0.5, thickness=1.0, response=1.0))
+
+    s = Simulation(cal, engine="batch", batch_size=2, processes=1)
+    out = s.simulate_sample([Electron(0.0, 1.0)] * 3)
+    assert out.shape == (3, 1)
+
+
+def test_simulation_reuses_pool_across_calls(monkeypatch):
+    monkeypatch.setattr(sim_module, "Pool", DummyPool)
+    DummyPool.instances = 0
+
+    cal = Calorimeter()
+    cal.add_layer(Layer("active", material=0.0, thickness=1.0, response=1.0))
+
+    with Simulation(cal, processes=2) as s:
+        for energy in (0.1, 0.2, 0.3):
+            assert s.simulate_sample([Electron(0.0, energy)] * 2).shape == (2, 1)
+        assert DummyPool.instances == 1
+
+        # Changing the geometry restarts the workers
+        cal.add_layer(Layer("active", material=0.0, thickness=1.0, response=1.0))
+        assert s.simulate_sample([Electron(0.0, 0.1)]).shape == (1, 2)
+        assert DummyPool.instances == 2
+    assert s._pool is None
+
+
+def test_worker_tasks_carry_only_particles_index_and_seed(monkeypatch):
+    seen = []
+
+    class RecordingPool(DummyPool):
+        def apply_async(self, fn, args, **kwargs):
+            seen.append(args[0])
+            return super().apply_async(fn, args, **kwargs)
+
+    monkeypatch.setattr(sim_module, "Pool", RecordingPool)
+    cal = Calorimeter()
+    cal.add_layer(Layer("active", material=0.0, thickness=1.0, response=1.0))
+    e = Electron(0.0, 0.1)
+    Simulation(cal, processes=1).simulate_sample([e], seed=7)
+    # Besides the particles, index and seed only the shared result block is named
+    assert [task[:4] for task in seen] == [([e], 0, 7, 0.0)]
+    assert [task[5:] for task in seen] == [((1, 1), 0)]
+    list(Simulation(cal, processes=1).iter_sample([e], seed=7))
+    assert seen[-1] == ([e], 0, 7, 0.0)
+
+
+@pytest.mark.parametrize("start_method", ["fork", "spawn", "forkserver"])
+def test_simulation_with_real_pool(start_method):
+    cal = Calorimeter()
+    cal.add_layer(Layer("active", material=0.0, thickness=1.0, response=1.0))
+    with Simulation(cal, transport="event", processes=1, start_method=start_method) as s:
+        first = s.simulate_sample([Muon(0.0, 1.0)] * 3)
+        second = s.simulate_sample([Muon(0.0, 1.0)] * 2)
+    assert first[:, 0] == pytest.approx([1.0] * 3)
+    assert second.shape == (2, 1)
+
+
+def muon_calorimeter():
+    cal = Calorimeter()
+    cal.add_layer(Layer("active", material=0.0, thickness=1.0, response=1.0))
+    cal.add_layer(Layer("passive", material=0.0, thickness=1.0, response=0.0))
+    return cal
+
+
+def test_iter_sample_yields_ordered_blocks():
+    s = Simulation(muon_calorimeter(), transport="event", processes=0)
+    particles = [Muon(0.0, float(e)) for e in range(1, 11)]
+    blocks = list(s.iter_sample(particles, chunksize=4))
+    assert [len(b.indices) for b in blocks] == [4, 4, 2]
+    assert list(blocks[1].indices) == [4, 5, 6, 7]
+    assert blocks[1].ionisations.shape == (4, 1)
+    assert list(blocks[2].info["energy"]) == [9.0, 10.0]
+
+
+def test_iter_sample_consumes_iterables_lazily():
+    consumed = []
+
+    def particles():
+        for i in range(100):
+            consumed.append(i)
+            yield Muon(0.0, 1.0)
+
+    s = Simulation(muon_calorimeter(), transport="event", processes=0)
+    stream = s.iter_sample(particles(), chunksize=10)
+    first = next(stream)
+    assert list(first.indices) == list(range(10))
+    assert len(consumed) <= 20
+    assert sum(len(b.indices) for b in stream) == 90
+
+
+def test_iter_sample_reports_progress_and_masks_blocks():
+    reports = []
+    s = Simulation(muon_calorimeter(), transport="event", processes=0)
+    blocks = list(s.iter_sample([Muon(0.0, 1.0)] * 6, chunksize=3, deadcellfraction=1.0,
+                                progress=lambda *args: reports.append(args)))
+    assert all((b.ionisations == 0).all() for b in blocks)
+    assert [(done, total) for done, total, _ in reports] == [(3, 6), (6, 6)]
+    assert all(rate > 0 for _, _, rate in reports)
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_iter_sample_with_real_pool(ordered, shower_calorimeter):
+    cal = shower_calorimeter(5)
+    energies = np.linspace(0.1, 2.0, 40)
+    with Simulation(cal, transport="event", processes=2, start_method="fork") as s:
+        blocks = list(s.iter_sample([Electron(0.0, e) for e in energies], chunksize=3, ordered=ordered))
+    indices = np.concatenate([b.indices for b in blocks])
+    if ordered:
+        assert list(indices) == list(range(40))
+    assert sorted(indices) == list(range(40))
+    for block in blocks:
+        assert block.info["energy"] == pytest.approx(energies[block.indices])
+
+
+def test_simulate_sample_empty():
+    s = Simulation(muon_calorimeter(), processes=0)
+    assert s.simulate_sample([]).shape == (0, 1)
+
+
+@pytest.mark.parametrize("engine", ["python", "vector"])
+def test_simulate_sample_is_independent_of_processes_and_chunks(engine, shower_calorimeter):
+    particles = [Electron(0.0, e) for e in np.linspace(0.5, 3.0, 12)]
+    runs = []
+    for processes, chunksize in [(0, 12), (0, 1), (1, 5), (2, 3)]:
+        with Simulation(shower_calorimeter(), transport="event", engine=engine, processes=processes,
+                        start_method="fork") as s:
+            runs.append(np.concatenate([b.ionisations for b in
+                                        s.iter_sample(particles, chunksize=chunksize, seed=11,
+                                                      deadcellfraction=0.2)]))
+    for run in runs[1:]:
+        assert np.array_equal(run, runs[0])
+
+
+def test_simulate_sample_split_over_runs_matches_single_run(shower_calorimeter):
+    particles = [Electron(0.0, 2.0)] * 8
+    s = Simulation(shower_calorimeter(), transport="event", processes=0)
+    whole = s.simulate_sample(particles, seed=3)
+    first = s.simulate_sample(particles[:5], seed=3)
+    second = s.simulate_sample(particles[5:], seed=3, first_event=5)
+    assert np.array_equal(np.concatenate([first, second]), whole)
+    assert not np.array_equal(s.simulate_sample(particles, seed=4), whole)
+
+
+def test_simulate_sample_records_seed():
+    s = Simulation(muon_calorimeter(), processes=0)
+    s.simulate_sample([Electron(0.0, 0.1)])
+    assert s.last_seed is not None
+    s.simulate_sample([Electron(0.0, 0.1)], seed=5)
+    assert s.last_seed == 5
+
+
+def test_simulate_with_tracing_is_seeded(shower_calorimeter):
+    s = Simulation(shower_calorimeter(), transport="event", processes=0)
+    first, _ = s.simulate_with_tracing(Electron(0.0, 2.0), seed=9)
+    second, _ = s.simulate_with_tracing(Electron(0.0, 2.0), seed=9)
+    assert np.array_equal(first, second)
+    assert np.array_equal(first, s.simulate_sample([Electron(0.0, 2.0)], seed=9)[0])
+
+
+def test_depth_first_traversal_bounds_the_stack(shower_calorimeter):
+    particles = [Electron(0.0, 20.0)] * 3
+    peaks = {}
+    for traversal in ("breadth", "depth"):
+        s = Simulation(shower_calorimeter(), transport="event", processes=0, traversal=traversal)
+        blocks = list(s.iter_sample(particles, seed=2))
+        peaks[traversal] = np.concatenate([b.info["peak_stack"] for b in blocks])
+    assert (peaks["depth"] < peaks["breadth"]).all()
+
+
+def test_max_stack_raises_memory_error(shower_calorimeter):
+    s = Simulation(shower_calorimeter(), transport="event", processes=0, max_stack=5)
+    with pytest.raises(MemoryError):
+        s.simulate_sample([Electron(0.0, 20.0)], seed=1)
+    s = Simulation(shower_calorimeter(), transport="event", processes=0, traversal="depth", max_stack=100)
+    assert s.simulate_sample([Electron(0.0, 20.0)], seed=1).shape == (1, 5)
+
+
+def test_simulation_rejects_unknown_traversal():
+    with pytest.raises(ValueError):
+        Simulation(Calorimeter(), traversal="random")
+
+
+@pytest.mark.parametrize("engine", ["python", "batch"])
+def test_simulation_cuts_apply_to_a_copy(engine, shower_calorimeter):
+    cal = shower_calorimeter(10)
+    coarse = Simulation(cal, transport="event", engine=engine, processes=0, cuts={"elec": 0.5, "phot": 0.5})
+    fine = Simulation(cal, transport="event", engine=engine, processes=0)
+    particles = [Electron(0.0, 1.0)] * 100
+    assert coarse.simulate_sample(particles, seed=1).sum() < fine.simulate_sample(particles, seed=1).sum()
+    assert cal.get_cuts() == {}
+
+
+def test_simulate_sample_writes_into_shared_memory_and_releases_it(monkeypatch):
+    names = []
+    block = sim_module._SharedBlock
+
+    def recording_block(shape):
+        b = block(shape)
+        names.append(b.name)
+        return b
+
+    monkeypatch.setattr(sim_module, "_SharedBlock", recording_block)
+    particles = [Muon(0.0, 1.0)] * 40 + [Electron(0.0, 1.0)] * 40
+    with Simulation(muon_calorimeter(), transport="event", processes=2, start_method="fork") as s:
+        shared = s.simulate_sample(particles, seed=3)
+        blocks = [b.ionisations for b in s.iter_sample(particles, seed=3)]
+        assert np.array_equal(shared, np.concatenate(blocks))
+
+        # A failing worker still removes the block
+        with pytest.raises(AttributeError):
+            s.simulate_sample(particles[:5] + ["not a particle"], seed=3)
+    assert len(names) == 2
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+
+def test_interleaved_in_process_samples_keep_their_own_state():
+    thin = muon_calorimeter()
+    thick = Calorimeter()
+    thick.add_layer(Layer("active", material=0.0, thickness=3.0, response=1.0))
+    first = Simulation(thin, transport="event", processes=0).iter_sample([Muon(0.0, 1.0)] * 4, chunksize=1)
+    second = Simulation(thick, transport="event", engine="vector", processes=0).iter_sample([Muon(0.0, 1.0)] * 4,
+                                                                                             chunksize=1)
+    for a, b in zip(first, second):
+        assert a.ionisations[:, 0] == pytest.approx([1.0])
+        assert b.ionisations[:, 0] == pytest.approx([3.0])
+        assert "peak_stack" in a.info and "peak_stack" not in b.info
+
+
+@pytest.mark.parametrize("transport", ["event", "step"])
+def test_tracing_does_not_change_showers_behind_the_last_active_layer(transport, shower_calorimeter):
+    cal = shower_calorimeter(3, back=2.0)
+    particles = [Electron(0.0, 2.0)] * 20
+    s = Simulation(cal, transport=transport, processes=0)
+    plain = s.simulate_sample(particles, seed=3)
+    store = TraceStore()
+    assert s.simulate_sample(particles, seed=3, traces=store) == pytest.approx(plain)
+    assert store["z1"].max() <= cal.geometry().reach + 1e-9
+    traced, _ = s.simulate_with_tracing(Electron(0.0, 2.0), seed=3)
+    assert traced == pytest.approx(plain[0])
+
+
+def test_dropped_simulation_terminates_its_workers():
+    s = Simulation(muon_calorimeter(), transport="event", processes=1, start_method="fork")
+    s.simulate_sample([Electron(0.0, 0.1)] * 2)
+    pool = s._pool
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        del s
+        gc.collect()
+    assert pool._state == TERMINATE
+    assert not [w for w in caught if issubclass(w.category, ResourceWarning)]
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from calorimeter.particle import Electron, Muon
+from calorimeter.simulation import Simulation
+from calorimeter.sparse import SparseSample
+
+
+def test_sparse_sample_round_trips_dense_array():
+    dense = np.array([[0.0, 1.5, 0.0], [0.0, 0.0, 0.0], [2.0, 0.0, 0.25]])
+    sample = SparseSample.from_dense(dense)
+    assert list(sample.offsets) == [0, 1, 1, 3]
+    assert list(sample.layers) == [1, 0, 2]
+    assert sample.values.dtype == np.float32
+    assert sample.shape == (3, 3)
+    assert np.array_equal(sample.to_dense(), dense)
+    assert sample.row_sums() == pytest.approx([1.5, 0.0, 2.25])
+    assert sample.layer_means() == pytest.approx([2.0/3, 0.5, 0.25/3])
+
+
+def test_sparse_samples_concatenate():
+    a = np.array([[1.0, 0.0], [0.0, 2.0]])
+    b = np.array([[0.0, 0.0], [3.0, 4.0]])
+    joined = SparseSample.concatenate([SparseSample.from_dense(a), SparseSample.from_dense(b)])
+    assert np.array_equal(joined.to_dense(), np.vstack((a, b)))
+    assert SparseSample.concatenate([], width=2).shape == (0, 2)
+
+
+def test_sparse_sample_is_smaller_for_mostly_empty_events():
+    dense = np.zeros((100, 200))
+    dense[:, 0] = 1.0
+    assert SparseSample.from_dense(dense).nbytes < dense.nbytes/10
+
+
+@pytest.mark.parametrize("processes", [0, 1])
+def test_sparse_simulation_matches_dense(processes, shower_calorimeter):
+    cal = shower_calorimeter(10)
+    particles = [Electron(0.0, 0.5)] * 20 + [Muon(0.0, 1.0)] * 5
+    with Simulation(cal, transport="event", processes=processes) as sim:
+        dense = sim.simulate_sample(particles, seed=3)
+        sparse = sim.simulate_sample(particles, seed=3, sparse=True)
+        blocks = list(sim.iter_sample(particles, chunksize=10, seed=3, sparse=True))
+    assert isinstance(sparse, SparseSample)
+    assert sparse.to_dense() == pytest.approx(dense, rel=1e-6)
+    assert all(isinstance(block.ionisations, SparseSample) for block in blocks)
+    assert sum(len(block.ionisations) for block in blocks) == len(particles)
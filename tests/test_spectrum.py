@@ -206,3 +206,13 @@ def test_discrete_energy_at_boundaries_succeeds():
     assert len(particles_max) == 3
     assert all(p.energy == 10.0 for p in particles_min)
     assert all(p.energy == 50.0 for p in particles_max)
+
+
+def test_seed_does_not_touch_global_random_state():
+    """Test that seeding a sample leaves the global numpy random state alone."""
+    np.random.seed(0)
+    expected = np.random.random()
+    np.random.seed(0)
+    Spectrum().uniform(n_particles=5, seed=1)
+    Spectrum().spectrum(n_particles=5, seed=1)
+    assert np.random.random() == expected
@@ -0,0 +1,152 @@
+import numpy as np
+import pytest
+
+from calorimeter.calorimeter import Calorimeter
+from calorimeter.particle import Electron, Photon, Muon
+import calorimeter.simulation as sim_module
+from calorimeter.simulation import Simulation
+from calorimeter.tracestore import TraceStore, trace_segments
+from calorimeter.vectorised import ELECTRON, PHOTON
+
+
+def fake_event(event, n):
+    return {
+        "event": np.full(n, event, dtype=np.int64),
+        "particle": np.arange(n, dtype=np.int64),
+        "parent": np.full(n, -1, dtype=np.int64),
+        "type": np.zeros(n, dtype=np.int8),
+        "z0": np.arange(n, dtype=float), "x0": np.zeros(n), "y0": np.zeros(n),
+        "z1": np.arange(n, dtype=float) + 1, "x1": np.zeros(n), "y1": np.zeros(n),
+    }
+
+
+def test_trace_segments_follow_parents():
+    photon = Photon(0.0, 1.0, trace=[(0.0, 0.0, 0.0)])
+    photon.z = 0.5
+    e1 = Electron(0.5, 0.4, trace=[(0.5, 0.0, 0.0), (0.6, 0.0, 0.0)], parent=photon)
+    e1.z = 0.7
+    e2 = Electron(0.5, 0.6, trace=[(0.5, 0.0, 0.0)], parent=photon)
+    e2.z = 0.8
+
+    columns = trace_segments([e1, e2], event=3)
+    assert list(columns["event"]) == [3] * 4
+    assert list(columns["particle"]) == [0, 1, 1, 2]
+    assert list(columns["parent"]) == [-1, 0, 0, 0]
+    assert list(columns["type"]) == [PHOTON, ELECTRON, ELECTRON, ELECTRON]
+    assert list(columns["z0"]) == [0.0, 0.5, 0.6, 0.5]
+    assert list(columns["z1"]) == [0.5, 0.6, 0.7, 0.8]
+
+
+def test_trace_store_appends_events():
+    store = TraceStore(max_segments=100)
+    store.add_event(fake_event(0, 10))
+    store.add_event(fake_event(1, 5))
+    assert len(store) == 15
+    assert list(store.events()) == [0, 1]
+    assert len(store.event_segments(1)["z0"]) == 5
+    assert store.nbytes > 0
+
+
+def test_trace_store_rejects_unknown_sampling():
+    with pytest.raises(ValueError):
+        TraceStore(sampling="all")
+
+
+def test_trace_store_event_reservoir_stays_bounded():
+    store = TraceStore(max_segments=50, sampling="events", seed=1)
+    for event in range(200):
+        store.add_event(fake_event(event, 10))
+    assert len(store) <= 50
+    assert store.events_seen == 200
+    # Events are kept whole
+    for event in store.events():
+        assert len(store.event_segments(event)["z0"]) == 10
+    # And later events get a chance to be kept
+    assert store.events().max() >= 50
+
+
+def test_trace_store_segment_reservoir_is_uniform():
+    counts = np.zeros(10)
+    for seed in range(200):
+        store = TraceStore(max_segments=20, sampling="segments", seed=seed)
+        for event in range(10):
+            store.add_event(fake_event(event, 10))
+        assert len(store) == 20
+        counts += np.bincount(store["event"], minlength=10)
+    # Every event ends up with about 2 of the 20 kept segments
+    assert counts / 200 == pytest.approx([2.0] * 10, abs=0.4)
+
+
+def test_trace_store_merge():
+    a = TraceStore(max_segments=100)
+    b = TraceStore(max_segments=100)
+    a.add_event(fake_event(0, 3))
+    b.add_event(fake_event(1, 4))
+    b.add_event(fake_event(2, 2))
+    a.merge(b)
+    assert len(a) == 9
+    assert list(a.events()) == [0, 1, 2]
+    assert (a.events_seen, a.segments_seen) == (3, 9)
+    with pytest.raises(ValueError):
+        a.merge(TraceStore(sampling="segments"))
+
+
+@pytest.mark.parametrize("sampling", ["events", "segments"])
+def test_trace_store_merge_is_uniform_over_the_events_seen(sampling):
+    counts = np.zeros(40)
+    for seed in range(200):
+        a = TraceStore(max_segments=50, sampling=sampling, seed=seed)
+        b = TraceStore(max_segments=50, sampling=sampling, seed=seed + 1000)
+        for event in range(30):
+            a.add_event(fake_event(event, 5))
+        for event in range(30, 40):
+            b.add_event(fake_event(event, 5))
+        a.merge(b)
+        assert len(a) == 50
+        assert (a.events_seen, a.segments_seen) == (40, 200)
+        counts += np.bincount(a["event"], minlength=40)
+    # Every event ends up with about 50/40 of the kept segments, whichever store saw it
+    assert counts[:30].mean() / 200 == pytest.approx(1.25, abs=0.1)
+    assert counts[30:].mean() / 200 == pytest.approx(1.25, abs=0.1)
+
+
+def test_simulate_sample_fills_trace_store(shower_calorimeter):
+    cal = shower_calorimeter(3)
+
+    store = TraceStore(max_segments=100000)
+    s = Simulation(cal, transport="event", processes=0)
+    out = s.simulate_sample([Electron(0.0, 0.5), Muon(0.0, 1.0)], traces=store)
+    assert out.shape == (2, 3)
+    assert list(store.events()) == [0, 1]
+    muon = store.event_segments(1)
+    assert muon["z0"].min() == 0.0
+    assert muon["z1"].max() == pytest.approx(3.0)
+
+
+def test_simulate_sample_tracing_needs_python_engine():
+    s = Simulation(Calorimeter(), engine="vector")
+    with pytest.raises(ValueError):
+        s.simulate_sample([Electron(0.0, 1.0)], traces=TraceStore())
+
+
+@pytest.mark.parametrize("sampling", ["events", "segments"])
+def test_workers_send_back_bounded_trace_stores(sampling, monkeypatch, shower_calorimeter):
+    cal = shower_calorimeter(3)
+    sent = []
+    trace_task = sim_module._trace_task
+
+    def recording_task(store, task, worker=None):
+        result = trace_task(store, task, worker)
+        sent.append(result[2]["traces"])
+        return result
+
+    monkeypatch.setattr(sim_module, "_trace_task", recording_task)
+    store = TraceStore(max_segments=30, sampling=sampling, seed=1)
+    s = Simulation(cal, transport="event", processes=0)
+    blocks = list(s.iter_sample([Electron(0.0, 1.0)] * 12, chunksize=4, traces=store, seed=2))
+    assert len(sent) == 3
+    assert all(len(part) <= 30 and part.events_seen == 4 for part in sent)
+    assert all("traces" not in block.info for block in blocks)
+    assert len(store) <= 30
+    assert store.events_seen == 12
+    assert store.segments_seen == sum(part.segments_seen for part in sent)
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from calorimeter.calorimeter import Calorimeter
+from calorimeter.layer import Layer
+from calorimeter.particle import Electron, Photon, Muon
+from calorimeter.vectorised import ParticleStack, simulate_shower, ELECTRON, PHOTON, MUON
+
+
+def test_particle_stack_from_particles():
+    stack = ParticleStack.from_particles([Electron(0.0, 1.0), Photon(0.5, 2.0, x=1.0), Muon(0.0, 3.0)])
+    assert len(stack) == 3
+    assert list(stack.type) == [ELECTRON, PHOTON, MUON]
+    assert list(stack.energy) == [1.0, 2.0, 3.0]
+    assert list(stack.x) == [0.0, 1.0, 0.0]
+
+    selected = stack.select(np.array([False, True, True]))
+    assert list(selected.type) == [PHOTON, MUON]
+    assert len(selected.extend(stack)) == 5
+
+
+@pytest.mark.parametrize("step", [0.25, None])
+def test_muon_deposits_exact_path(step):
+    cal = Calorimeter()
+    for _ in range(4):
+        cal.add_layers([Layer("lead", 2.0, 0.5, 0.0), Layer("scin", 0.0, 0.5, 2.0)])
+    geometry = cal.geometry()
+
+    deposits = simulate_shower(geometry, Muon(0.0, 10.0), step)
+    assert deposits.shape == (8,)
+    assert deposits[geometry.active_index] == pytest.approx([1.0] * 4)
+    assert deposits[~geometry.active] == pytest.approx([0.0] * 4)
+
+
+def test_photon_does_not_ionise():
+    cal = Calorimeter()
+    cal.add_layer(Layer("scin", 0.0, 1.0, 1.0))
+    assert simulate_shower(cal.geometry(), Photon(0.0, 10.0)) == pytest.approx([0.0])
+
+
+@pytest.mark.parametrize("step", [0.1, None])
+def test_vectorised_matches_python_engine_on_average(step, shower_calorimeter):
+    from calorimeter.simulation import _run_single_simulation_indexed
+
+    cal = shower_calorimeter(10)
+    geometry = cal.geometry()
+    rng = np.random.default_rng(5)
+
+    vector = np.mean([simulate_shower(geometry, Electron(0.0, 1.0), step, rng)[geometry.active_index]
+                      for _ in range(150)], axis=0)
+    python = np.mean([_run_single_simulation_indexed((cal, Electron(0.0, 1.0), step, 0))[0]
+                      for _ in range(150)], axis=0)
+    assert vector.shape == python.shape
+    assert vector.sum() == pytest.approx(python.sum(), rel=0.1)
+
+
+def test_simulate_batch_accepts_particles_and_energies():
+    from calorimeter.vectorised import simulate_batch
+
+    cal = Calorimeter()
+    for _ in range(3):
+        cal.add_layers([Layer("lead", 0.0, 0.5, 0.0), Layer("scin", 0.0, 0.5, 1.0)])
+    geometry = cal.geometry()
+
+    out = simulate_batch(geometry, [Muon(0.0, 1.0), Photon(0.0, 1.0), Muon(0.0, 2.0)], step=None)
+    assert out.shape == (3, 6)
+    assert out[:, geometry.active_index] == pytest.approx(np.array([[0.5] * 3, [0.0] * 3, [0.5] * 3]))
+
+    out = simulate_batch(geometry, np.array([1.0, 2.0, 3.0, 4.0, 5.0]), step=None, particle_type=Muon, chunksize=2)
+    assert out.shape == (5, 6)
+    assert out.sum(axis=1) == pytest.approx([1.5] * 5)
+
+
+def test_simulate_batch_keeps_events_apart(shower_calorimeter):
+    from calorimeter.vectorised import simulate_batch
+
+    cal = shower_calorimeter(5)
+    geometry = cal.geometry()
+    rng = np.random.default_rng(2)
+    # Events with no energy above the cutoff only deposit along the primary track
+    energies = np.array([10.0, 0.001, 10.0, 0.001])
+    out = simulate_batch(geometry, energies, step=None, rng=rng, chunksize=3)
+    assert out[1].sum() <= 5.0
+    assert out[3].sum() <= 5.0
+    assert out[0].sum() > out[1].sum()
+    assert out[2].sum() > out[3].sum()
+
+
+def test_simulate_shower_applies_layer_cuts(shower_calorimeter):
+    cal = shower_calorimeter(10).with_cuts({"elec": 100.0, "phot": 100.0})
+    # Nothing splits, so the electron deposits until it is absorbed at its first interaction
+    rng = np.random.default_rng(1)
+    deposits = np.array([simulate_shower(cal.geometry(), Electron(0.0, 10.0), None, rng).sum() for _ in range(500)])
+    assert deposits.max() <= 5.0
+    # Reaching each scintillator through the lead in front of it with probability 1/e
+    assert deposits.mean() == pytest.approx(0.5*np.exp(-1.0)/(1 - np.exp(-1.005)), rel=0.15)